@@ -42,6 +42,41 @@ def _fold_exp(tt, w, tz, tau):
     return y.T
 
 
+def _fold_exp_grad(tt, w, tz, tau):
+    """
+    Returns the folded exponentials and their derivatives with respect to
+    the decay times, the width and the time-zero.
+
+    Parameters
+    ----------
+    tt:  ndarray(N, M)
+        Array containing the time-coordinates
+    w:  float
+        The assumed width/sq2
+    tz: float
+        The assumed time zero.
+    tau: ndarray(K)
+        The K-decay rates.
+
+    Returns
+    -------
+    y, dy_dtau, dy_dw, dy_dtz: ndarray(N, M, K)
+       Folded exponentials and their derivatives.
+    """
+    ws = w
+    k = 1 / (tau[..., None, None])
+    t = (tt + tz).T[None, ...]
+    e = np.exp(k * (ws * ws * k / (4.0) - t))
+    u = -t / ws + ws * k / (2.0)
+    c = 0.5 * erfc(u)
+    dc = -np.exp(-u * u) / np.sqrt(np.pi)
+    y = e * c
+    dy_dk = e * ((ws * ws * k / 2. - t) * c + dc * ws / 2.)
+    dy_dw = e * (ws * k * k / 2. * c + dc * (t / (ws * ws) + k / 2.))
+    dy_dt = -e * (k * c + dc / ws)
+    return y.T, (-k * k * dy_dk).T, dy_dw.T, dy_dt.T
+
+
 def _fold_exp_and_coh(t_arr, w, tz, tau_arr):
     a = _fold_exp(t_arr, w, tz, tau_arr)
     b = _coh_gaussian(t_arr, w, tz)
@@ -79,3 +114,36 @@ def _coh_gaussian(t, w, tz):
     y[idx, ..., 2] *= (tt*tt/w/w - 1)
     #y[idx,..., 2] *= (-tt ** 3 / w ** 6 + 3 * tt / w ** 4)
     return y
+
+
+def _coh_gaussian_grad(t, w, tz):
+    """
+    Derivatives of `_coh_gaussian` with respect to the width and the time-zero.
+
+    Parameters
+    ----------
+    t:  ndarray
+        Array containing the time-coordinates
+    w:  float
+        The assumed width/sq2
+    tz: float
+        The assumed time zero.
+
+    Returns
+    -------
+    dy_dw, dy_dtz:  ndarray (shape(t), 3)
+        Derivatives of the three columns returned by `_coh_gaussian`.
+    """
+    ws = w / sq2
+    tt = (t + tz)[..., None]
+    x = tt / ws
+    y0 = np.where(x < 3., np.exp(-0.5 * x * x), 0)
+    dy0_dt = -y0 * tt / ws**2
+    dy0_dws = y0 * tt**2 / ws**3
+    dt = np.concatenate((dy0_dt,
+                         -exp_half / ws * (y0 + tt * dy0_dt),
+                         dy0_dt * (x * x - 1) + y0 * 2 * tt / ws**2), -1)
+    dws = np.concatenate((dy0_dws,
+                          -exp_half * tt * (dy0_dws / ws - y0 / ws**2),
+                          dy0_dws * (x * x - 1) - y0 * 2 * tt**2 / ws**3), -1)
+    return dws / sq2, dt
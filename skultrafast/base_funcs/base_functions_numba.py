@@ -127,7 +127,7 @@ def folded_fit_func(t, tz, w, k):
         return np.exp(k * (w * w * k / (4.0) - t))
 
 
-@njit(cache=True)
+@njit(cache=True, nogil=True)
 def _fold_exp(t_arr, w, tz, tau_arr):
     """
     Returns the values of the folded exponentials for given parameters.
@@ -160,7 +160,7 @@ def _fold_exp(t_arr, w, tz, tau_arr):
         return out
 
 
-@njit(fastmath=True, cache=True)
+@njit(fastmath=True, cache=True, nogil=True)
 def _fold_exp_loop(out, tau_arr, t_arr, tz, w, l, m, n):
     for tau_idx in range(l):
         k = 1 / tau_arr[tau_idx]
@@ -178,6 +178,116 @@ def _fold_exp_loop(out, tau_arr, t_arr, tz, w, l, m, n):
                 out[tau_idx, j, i] = ret
 
 
+@njit(cache=True, nogil=True)
+def fast_erfc_deriv(x):
+    """
+    Derivative of `fast_erfc`. Since the approximation is mirrored at zero,
+    the derivative is an even function.
+    """
+    a1 = 0.278393
+    a2 = 0.230389
+    a3 = 0.000972
+    a4 = 0.078108
+    x = abs(x)
+    bot = 1 + a1 * x + a2 * x * x + a3 * x * x * x + a4 * x * x * x * x
+    dbot = a1 + 2 * a2 * x + 3 * a3 * x * x + 4 * a4 * x * x * x
+    return -4. * dbot / (bot * bot * bot * bot * bot)
+
+
+@njit(cache=True, nogil=True)
+def _fold_exp_grad(t_arr, w, tz, tau_arr):
+    """
+    Returns the folded exponentials and their derivatives with respect to
+    the decay times, the width and the time-zero. Uses the same domain
+    splitting and erfc-approximation as `_fold_exp`, therefore the
+    derivatives are consistent with the values returned by it.
+
+    Parameters
+    ----------
+    t_arr:  ndarray(N, M)
+        Array containing the time-coordinates
+    w:  float
+        The assumed width/sq2
+    tz: float
+        The assumed time zero.
+    tau_arr: ndarray(K)
+        The M-decay rates.
+
+    Returns
+    -------
+    y, dy_dtau, dy_dw, dy_dtz: ndarray(N, M, K)
+       Folded exponentials and their derivatives.
+    """
+    n, m = t_arr.shape
+    l = tau_arr.size
+    out = np.zeros((4, l, m, n))
+    _fold_exp_grad_loop(out, tau_arr, t_arr, tz, w, l, m, n)
+    return out[0].T, out[1].T, out[2].T, out[3].T
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _fold_exp_grad_loop(out, tau_arr, t_arr, tz, w, l, m, n):
+    for tau_idx in range(l):
+        k = 1 / tau_arr[tau_idx]
+        for j in range(m):
+            for i in range(n):
+                t = t_arr[i, j] - tz
+                if t < -5. * w:
+                    continue
+                e = np.exp(k * (w * w * k / 4.0 - t))
+                if t < 5. * w:
+                    u = -t / w + w * k / 2.
+                    c = 0.5 * fast_erfc(u)
+                    dc = 0.5 * fast_erfc_deriv(u)
+                    y = e * c
+                    dy_dk = e * ((w * w * k / 2. - t) * c + dc * w / 2.)
+                    dy_dw = e * (w * k * k / 2. * c + dc * (t / (w * w) + k / 2.))
+                    dy_dtz = e * (k * c + dc / w)
+                else:
+                    y = e
+                    dy_dk = e * (w * w * k / 2. - t)
+                    dy_dw = e * w * k * k / 2.
+                    dy_dtz = e * k
+                out[0, tau_idx, j, i] = y
+                out[1, tau_idx, j, i] = -k * k * dy_dk
+                out[2, tau_idx, j, i] = dy_dw
+                out[3, tau_idx, j, i] = dy_dtz
+
+
+def _coh_gaussian_grad(ta, w, tz):
+    """
+    Derivatives of `_coh_gaussian` with respect to the width and the time-zero.
+
+    Parameters
+    ----------
+    ta:  ndarray
+        2d - Array containing the time-coordinates
+    w:  float
+        The assumed width/sq2
+    tz: float
+        The assumed time zero.
+
+    Returns
+    -------
+    dy_dw, dy_dtz:  ndarray (shape(t), 3)
+        Derivatives of the three columns returned by `_coh_gaussian`.
+    """
+    ws = w / 1.4142135623730951
+    tt = (ta - tz)[..., None]
+    x = tt / ws
+    y0 = np.where(x < 3., np.exp(-0.5 * x * x), 0.)
+    # Derivatives with respect to tt and the scaled width ws
+    dy0_dt = -y0 * tt / ws**2
+    dy0_dws = y0 * tt**2 / ws**3
+    dt = np.concatenate((dy0_dt,
+                         -exp_half / ws * (y0 + tt * dy0_dt),
+                         dy0_dt * (x * x - 1) + y0 * 2 * tt / ws**2), -1)
+    dws = np.concatenate((dy0_dws,
+                          -exp_half * tt * (dy0_dws / ws - y0 / ws**2),
+                          dy0_dws * (x * x - 1) - y0 * 2 * tt**2 / ws**3), -1)
+    return dws / 1.4142135623730951, -dt
+
+
 #jit(f8[:, :, :], [f8[:, :], f8, f8, f8[:]])
 def _exp(t_arr, w, tz, tau_arr):
     """
@@ -7,10 +7,14 @@ from __future__ import print_function
 try:
     from skultrafast.base_funcs.base_functions_numba import (_fold_exp,
                                                                 _fold_exp_and_coh,
-                                                                _coh_gaussian)
+                                                                _coh_gaussian,
+                                                                _fold_exp_grad,
+                                                                _coh_gaussian_grad)
 
 except ImportError:
     from skultrafast.base_funcs.base_functions_np import(_fold_exp,
                                                             _fold_exp_and_coh,
-                                                            _coh_gaussian)
+                                                            _coh_gaussian,
+                                                            _fold_exp_grad,
+                                                            _coh_gaussian_grad)
 
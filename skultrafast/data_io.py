@@ -12,8 +12,10 @@ import os
 import pathlib
 import re
 import urllib.request
+import warnings
 from pathlib import Path
 
+import h5py
 import numpy as np
 import zipfile_deflate64
 
@@ -42,6 +44,83 @@ def save_txt(name, wls, t, dat, fmt='%.3f'):
     np.savetxt(name, arr, fmt=fmt)
 
 
+def write_h5_rows(group, name, arr, block_rows=1024, compression=None):
+    """
+    Writes an array into a new dataset of an h5py group. The array is
+    copied in blocks of rows, so memory-mapped arrays are never loaded
+    completely. The mask of masked arrays is not saved.
+
+    Without compression, the dataset is contiguous and can be memory-mapped
+    by `h5_as_array`. Otherwise, it is chunked and compressed with the given
+    h5py filter, e.g. 'gzip' or 'lzf'.
+    """
+    if compression is None:
+        dset = group.create_dataset(name, shape=arr.shape, dtype=arr.dtype)
+    else:
+        dset = group.create_dataset(name, shape=arr.shape, dtype=arr.dtype,
+                                    chunks=True, compression=compression)
+    for i in range(0, arr.shape[0], block_rows):
+        dset[i:i + block_rows] = np.ma.getdata(arr[i:i + block_rows])
+    return dset
+
+
+def h5_as_array(dset, mmap_mode='r', rows=slice(None)):
+    """
+    Returns the content of an h5py dataset as an array. Uncompressed,
+    contiguous datasets are memory-mapped, so only the accessed parts are
+    read from disk. Other datasets are read into memory.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        The dataset.
+    mmap_mode : {'r', 'r+', 'c', None}
+        Mode of the memory-map, see `np.memmap`. With 'r+', changes are
+        written into the file. If None, the dataset is read into memory.
+    rows : slice
+        Only return these rows. Only they are read from the file.
+    """
+    offset = dset.id.get_offset()
+    if mmap_mode is None or dset.chunks is not None or offset is None:
+        return dset[rows]
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode=mmap_mode,
+                     shape=dset.shape, offset=offset)[rows]
+
+
+def h5_rows_in_range(t, t_range=None) -> slice:
+    """
+    Returns the slice of the sorted array t with lower <= t <= upper, where
+    t_range = (lower, upper). All rows if t_range is None.
+    """
+    if t_range is None:
+        return slice(None)
+    lower, upper = t_range
+    return slice(np.searchsorted(t, lower, 'left'), np.searchsorted(t, upper, 'right'))
+
+
+def read_scan(fname: Path) -> np.ndarray:
+    """
+    Reads a QuickControl scan file, see `quickcontrol.read_scans`. It is
+    defined here, so that worker processes only import this light module.
+    Uses `np.fromstring` on the whole file, which is
+    faster than `np.loadtxt`. Since `np.fromstring` silently stops at the
+    first unparsable value, the result is only accepted if it contains a
+    value for every column of every line. Otherwise, the file is read by
+    `np.loadtxt`, which raises a ValueError for corrupted files.
+    """
+    with open(fname, 'rb') as f:
+        text = f.read()
+    lines = text.splitlines()
+    n_cols = len(lines[0].split()) if lines else 0
+    n_rows = sum(1 for l in lines if l.strip())
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        arr = np.fromstring(text, sep=' ')
+    if n_cols == 0 or arr.size != n_rows * n_cols:
+        return np.loadtxt(fname, ndmin=2)
+    return arr.reshape(n_rows, n_cols)
+
+
 def extract_freqs_from_gaussianlog(fname):
     f = open(fname)
     fr, ir, raman = [], [], []
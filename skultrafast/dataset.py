@@ -1,11 +1,16 @@
 import functools
+import itertools
+import multiprocessing
+import os
 import typing
 import warnings
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Callable, Dict, Iterable, List, Optional, Type, Union, cast
 
 import attr
+import h5py
 import lmfit
 import matplotlib.pyplot as plt
 import numpy as np
@@ -15,10 +20,10 @@ from scipy.interpolate import UnivariateSpline, interp1d
 
 import skultrafast.dv as dv
 import skultrafast.plot_helpers as ph
-from skultrafast import filter, fitter, lifetimemap, zero_finding
-from skultrafast.data_io import save_txt
+from skultrafast import filter, fitter, lifetimemap, utils, zero_finding
+from skultrafast.data_io import h5_as_array, h5_rows_in_range, save_txt, write_h5_rows
 from skultrafast.kinetic_model import Model
-from skultrafast.utils import linreg_std_errors, sigma_clip
+from skultrafast.utils import SVDResult, bin_along, linreg_std_errors, sigma_clip_stats
 
 ndarray: Type[np.ndarray] = np.ndarray
 
@@ -101,12 +106,275 @@ class FitExpResult:
         return sas, ct
 
 
+@attr.s(auto_attribs=True)
+class TargetFitResult(FitExpResult):
+    """
+    Result of a target analysis, see `TimeResSpec.fit_target`. The fitter
+    is a `fitter.TargetFitter`.
+    """
+
+    @property
+    def compartments(self) -> List[str]:
+        return self.fitter.compartments
+
+    @property
+    def sas(self) -> np.ndarray:
+        """The species associated spectra, shape (n_compartments, n_wl)."""
+        return self.fitter.c[:, :len(self.compartments)].T
+
+    @property
+    def concentrations(self) -> np.ndarray:
+        """The concentrations, shape (n_t, n_compartments)."""
+        return self.fitter.x_vec[:, :len(self.compartments)]
+
+
+@attr.s(auto_attribs=True)
+class MultiStartResult:
+    """
+    Result of `TimeResSpec.fit_exp_multistart`.
+
+    Attributes
+    ----------
+    results : list of FitExpResult
+        One result per distinct minimum, sorted by chi-square, best first.
+    starts : ndarray(N, P)
+        The starting parameters of the N fits.
+    end_para : ndarray(N, P)
+        The fitted parameters, nan if the fit failed.
+    chisqr : ndarray(N)
+        The chi-square of each fit, nan if the fit failed.
+    minimum_idx : ndarray(N)
+        Index into `results` for each fit, -1 if the fit failed.
+    """
+    results: List[FitExpResult]
+    starts: np.ndarray
+    end_para: np.ndarray
+    chisqr: np.ndarray
+    minimum_idx: np.ndarray
+
+    @property
+    def best(self) -> FitExpResult:
+        return self.results[0]
+
+    def summary(self) -> str:
+        """Returns a table of the found minima."""
+        n = len(self.chisqr)
+        lines = []
+        for i, res in enumerate(self.results):
+            f = res.fitter
+            taus = ", ".join("%.4g" % tau for tau in f.last_para[-f.num_exponentials:])
+            lines.append("%d: chisqr=%.6g taus=[%s] found by %d of %d starts" %
+                         (i, res.lmfit_res.chisqr, taus,
+                          np.sum(self.minimum_idx == i), n))
+        n_failed = np.sum(self.minimum_idx == -1)
+        if n_failed:
+            lines.append("%d of %d fits failed" % (n_failed, n))
+        return "\n".join(lines)
+
+
+def _check_h5_type(f, expected: str):
+    kind = f.attrs.get('skultrafast_type', None)
+    if kind != expected:
+        raise ValueError(f'File contains a {kind}, not a {expected}')
+
+
+_lmfit_stats = ('chisqr', 'redchi', 'aic', 'bic', 'nfev', 'ndata', 'nvarys',
+                'nfree', 'success', 'message', 'method')
+
+
+def _save_fit_exp_result(grp, res: FitExpResult):
+    """Saves the parts of a FitExpResult needed to rebuild it."""
+    f = res.fitter
+    lm = res.lmfit_res
+    grp['para'] = f.last_para
+    grp['fit_t'] = f.t
+    grp.attrs['params'] = lm.params.dumps()
+    grp.attrs['model_coh'] = f.model_coh
+    grp.attrs['use_error'] = f.weights is not None
+    for name in _lmfit_stats:
+        if getattr(lm, name, None) is not None:
+            grp.attrs[name] = getattr(lm, name)
+    if getattr(lm, 'covar', None) is not None:
+        grp['covar'] = lm.covar
+
+
+def _load_fit_exp_result(grp, ds: 'TimeResSpec'):
+    """Rebuilds a FitExpResult saved by `_save_fit_exp_result`."""
+    params = lmfit.Parameters().loads(grp.attrs['params'])
+    stats = {k: grp.attrs[k] for k in _lmfit_stats if k in grp.attrs}
+    covar = grp['covar'][()] if 'covar' in grp else None
+    lmfit_res = MinimizerResult(params=params, covar=covar,
+                                var_names=[k for k, p in params.items() if p.vary],
+                                **stats)
+    fit_t = grp['fit_t'][()]
+    kwargs = dict(
+        model_coh=bool(grp.attrs['model_coh']),
+        use_error=bool(grp.attrs['use_error']),
+        fix_t0=not params['p0'].vary,
+        fix_sigma=not params['w'].vary,
+        fix_last_decay=False,
+        fixed_names=[k for k, p in params.items() if not p.vary],
+        from_t=fit_t[0] if fit_t.size < ds.t.size else None,
+    )
+    ds._make_fit_exp_result(grp['para'][()], lmfit_res, kwargs)
+
+
+def _fit_target(tup, err, model, x0, t0, w, y0, fix_t0, fix_sigma, fixed_names,
+                model_coh, compress) -> TargetFitResult:
+    """Does the work of `TimeResSpec.fit_target` and `PolTRSpec.fit_target`."""
+    f = fitter.TargetFitter(tup, model, y0=y0, model_coh=model_coh)
+    if err is not None:
+        f.weights = 1 / err
+    f.lsq_method = "ridge"
+    f.alpha = abs(f.data).max() * 1e-4
+    lm_model = f.start_lmfit(x0, t0, w, fix_t0=fix_t0, fix_w=fix_sigma,
+                             fixed_names=fixed_names)
+    result = f.leastsq(lm_model, compress=compress)
+    res = TargetFitResult(lm_model, result, f)
+    res.calculate_stats()
+    return res
+
+
+def _fit_exp_remote(ds: 'TimeResSpec', kwargs: dict, x0: np.ndarray):
+    """
+    Runs `fit_exp` without building a FitExpResult and returns the
+    picklable parts of the result: the fitted parameters and the lmfit
+    result. See `TimeResSpec._make_fit_exp_result`.
+    """
+    f, lm_model = ds._setup_fit_exp(x0, **kwargs)
+    res = f.leastsq(lm_model, compress=kwargs.get('use_jac', True))
+    # The residual functions are local closures and can't be pickled.
+    res.call_kws = {k: v for k, v in res.call_kws.items() if not callable(v)}
+    return np.array([p.value for p in res.params.values()]), res
+
+
+def _fit_exp_start(ds: 'TimeResSpec', kwargs: dict, x0: np.ndarray):
+    """Runs a single fit of `fit_exp_multistart`, returns None on failure."""
+    try:
+        return _fit_exp_remote(ds, kwargs, x0)
+    except Exception:
+        return None
+
+
+_multistart_state: tuple = ()
+
+
+def _multistart_init(wl, t, data, err, kwargs):
+    global _multistart_state
+    _multistart_state = (TimeResSpec(wl, t, data, err, auto_plot=False), kwargs)
+
+
+def _multistart_worker(x0):
+    return _fit_exp_start(*_multistart_state, x0)
+
+
+def _warm_up_kernels():
+    """Compiles (or loads from the cache) the numba kernels used by fit_exp."""
+    from skultrafast.base_functions import _fold_exp, _fold_exp_and_coh, _fold_exp_grad
+    t = np.zeros((2, 1))
+    taus = np.ones(1)
+    _fold_exp(t, 0.1, 0., taus)
+    _fold_exp_and_coh(t, 0.1, 0., taus)
+    _fold_exp_grad(t, 0.1, 0., taus)
+
+
+def _fit_many_worker(tup, x0, kwargs):
+    ds = TimeResSpec(*tup, auto_plot=False)
+    return _fit_exp_remote(ds, kwargs, x0)
+
+
+def fit_exp_many(datasets: Iterable['TimeResSpec'],
+                 x0,
+                 executor='thread',
+                 max_workers=None,
+                 callback: Optional[Callable] = None,
+                 **kwargs):
+    """
+    Runs `TimeResSpec.fit_exp` for many datasets in parallel and yields the
+    results as they finish.
+
+    Parameters
+    ----------
+    datasets : iterable of TimeResSpec
+        The datasets to fit.
+    x0 : list of floats or array
+        Starting values as in `fit_exp`, used for all datasets. If 2d, it
+        must contain one row per dataset.
+    executor : 'thread' or 'process'
+        Use a thread or a process pool. The numba kernels release the GIL,
+        but lmfit itself does not, hence processes scale better for large
+        numbers of small datasets. The processes are spawned, so scripts
+        using them have to be guarded by ``if __name__ == '__main__'``.
+    max_workers : int or None
+        Number of workers, defaults to the number of cores.
+    callback : callable or None
+        Called after each finished fit as ``callback(n_done, n_total, i,
+        result)``.
+    **kwargs
+        Passed to `fit_exp`.
+
+    Yields
+    ------
+    i, result : int, FitExpResult or Exception
+        The index of the dataset and its result. If the fit failed,
+        the exception is yielded instead, the other fits are not affected.
+        As with `fit_exp`, the result is also saved in `fit_exp_result_`
+        of each dataset.
+    """
+    datasets = list(datasets)
+    x0 = np.asarray(x0, dtype=float)
+    if x0.ndim == 1:
+        x0s = [x0] * len(datasets)
+    elif len(x0) == len(datasets):
+        x0s = list(x0)
+    else:
+        raise ValueError('x0 must be 1d or have one row per dataset')
+    kwargs.pop('verbose', None)
+
+    if executor == 'thread':
+        _warm_up_kernels()
+        ex = ThreadPoolExecutor(max_workers)
+
+        def submit(i):
+            return ex.submit(datasets[i].fit_exp, x0s[i], verbose=False, **kwargs)
+    elif executor == 'process':
+        ctx = multiprocessing.get_context('spawn')
+        ex = ProcessPoolExecutor(max_workers, mp_context=ctx,
+                                 initializer=_warm_up_kernels)
+
+        def submit(i):
+            ds = datasets[i]
+            tup = (ds.wavelengths, ds.t, ds.data, ds.err)
+            return ex.submit(_fit_many_worker, tup, x0s[i], kwargs)
+    else:
+        raise ValueError("executor must be 'thread' or 'process'")
+
+    with ex:
+        futures = {submit(i): i for i in range(len(datasets))}
+        try:
+            for n_done, fut in enumerate(as_completed(futures), 1):
+                i = futures[fut]
+                try:
+                    result = fut.result()
+                    if executor == 'process':
+                        result = datasets[i]._make_fit_exp_result(*result, kwargs)
+                except Exception as e:
+                    result = e
+                if callback is not None:
+                    callback(n_done, len(datasets), i, result)
+                yield i, result
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+
 @attr.s(eq=False)
 class LDMResult:
     skmodel: object = attr.ib()
     coefs: np.ndarray = attr.ib()
     fit: np.ndarray = attr.ib()
     alpha: np.ndarray = attr.ib()
+    path: Optional[lifetimemap.LTMPath] = attr.ib(default=None)
 
 
 class TimeResSpec:
@@ -120,6 +388,7 @@ class TimeResSpec:
             freq_unit="nm",
             disp_freq_unit=None,
             auto_plot=True,
+            copy=True,
     ):
         """
         Class for working with time-resolved spectra. If offers methods for
@@ -144,6 +413,10 @@ class TimeResSpec:
         disp_freq_unit : 'nm','cm' or None (optional)
             Unit which is used by default for plotting, masking and cutting
             the dataset. If `None`, it defaults to `freq_unit`.
+        copy : bool (optional)
+            If False, data and err are used without copying them, e.g. to
+            work with memory-mapped arrays, see `from_h5`. If the frequencies
+            are not sorted, sorting the data will still create a copy.
 
         Attributes
         ----------
@@ -167,7 +440,10 @@ class TimeResSpec:
         assert correct_shape, f"Data shapes do not match: {t.shape}, {wl.shape} != {data.shape}"
         t = t.copy()
         wl = wl.copy()
-        data = data.copy()
+        if copy:
+            data = data.copy()
+            if err is not None:
+                err = err.copy()
 
         if freq_unit == "nm":
             self._wavelengths = wl
@@ -189,11 +465,12 @@ class TimeResSpec:
 
         # Sort wavelenths and data.
         idx = np.argsort(self._wavelengths)
-        self._wavelengths = self._wavelengths[idx]
-        self._wavenumbers = self._wavenumbers[idx]
-        self.data = self.data[:, idx]
-        if err is not None:
-            self.err = self.err[:, idx]
+        if np.any(idx != np.arange(idx.size)):
+            self._wavelengths = self._wavelengths[idx]
+            self._wavenumbers = self._wavenumbers[idx]
+            self.data = self.data[:, idx]
+            if err is not None:
+                self.err = self.err[:, idx]
         self.auto_plot = auto_plot
         self.plot = TimeResSpecPlotter(self)
         self.t_idx = lambda x: dv.fi(self.t, x)
@@ -210,6 +487,23 @@ class TimeResSpec:
         self.spec = self.plot.spec
         self.map = self.plot.map
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.invalidate_svd()
+
+    def invalidate_svd(self):
+        """
+        Clears the cached SVD of the data, see `svd`. Setting `data` and the
+        masking methods already do this, call it after modifying parts of
+        `data` in place.
+        """
+        self._svd_cache = None
+
     @property
     def wavelengths(self):
         return self._wavelengths
@@ -292,6 +586,46 @@ class TimeResSpec:
             auto_plot=self.auto_plot,
         )
 
+    def svd(self, n: Optional[int] = None, method: str = 'auto') -> SVDResult:
+        """
+        Returns the first `n` SVD components of the data. The decomposition
+        is cached, calling it again with a smaller `n` reuses it. The cache
+        is cleared when `data` is set or masked, after in-place changes of
+        its values, call `invalidate_svd`.
+
+        Parameters
+        ----------
+        n : int or None
+            Number of components, all if None.
+        method : 'auto', 'full', 'randomized' or 'arpack'
+            Method used to calculate the decomposition, see `utils.svd`.
+            'auto' uses the randomized method if `n` is small compared to
+            the size of the data, otherwise the full SVD.
+
+        Returns
+        -------
+        SVDResult
+        """
+        if method == 'auto':
+            k = min(self.data.shape)
+            method = 'randomized' if n is not None and k > 200 and n < k // 10 else 'full'
+        if self._svd_cache is None:
+            self._svd_cache = {}
+        cache = self._svd_cache
+        for m in ('full', method):
+            res = cache.get(m)
+            if res is not None and (n is None and m == 'full' or n is not None and n <= res.rank):
+                return res if n is None else res.truncate(n)
+        # Calculate a few more components, so increasing n step by step does
+        # not recompute the decomposition every time.
+        if method == 'full' or n is None:
+            n_calc = None
+        else:
+            n_calc = max(n, 2 * cache[method].rank if method in cache else 10)
+        res = utils.svd(self.data, n_calc, method=method)
+        cache[method] = res
+        return res if n is None else res.truncate(min(n, res.rank))
+
     @classmethod
     def from_txt(cls,
                  fname,
@@ -332,6 +666,87 @@ class TimeResSpec:
         data = tmp[1:, 1:]
         return cls(freq, t, data, freq_unit=freq_unit, disp_freq_unit=disp_freq_unit)
 
+    def save_h5(self, fname, block_rows=1024, compression=None):
+        """
+        Saves the dataset in the native HDF5 format of skultrafast. The file
+        contains the axes, the data, the error, the mask, the name, the
+        display unit and, if present, the result of `fit_exp`.
+
+        Without compression, data and error are stored contiguously, so they
+        can be memory-mapped by `from_file`. They are written in blocks of
+        rows, hence memory-mapped datasets are never loaded completely.
+
+        Parameters
+        ----------
+        fname : str or Path
+            Filename (can include path)
+        block_rows : int
+            Number of rows written at once.
+        compression : str or None
+            h5py compression filter, e.g. 'gzip' or 'lzf'. Compressed data
+            can't be memory-mapped.
+        """
+        with h5py.File(fname, 'w') as f:
+            f.attrs['skultrafast_type'] = 'TimeResSpec'
+            self._save_to_group(f, block_rows, compression)
+
+    def _save_to_group(self, grp, block_rows=1024, compression=None):
+        grp.attrs['disp_freq_unit'] = self.disp_freq_unit
+        if getattr(self, 'name', None) is not None:
+            grp.attrs['name'] = self.name
+        grp['wavelengths'] = self.wavelengths
+        grp['t'] = self.t
+        write_h5_rows(grp, 'data', self.data, block_rows, compression)
+        if self.err is not None:
+            write_h5_rows(grp, 'err', self.err, block_rows, compression)
+        if np.ma.getmask(self.data) is not np.ma.nomask:
+            grp.create_dataset('mask', data=np.ma.getmaskarray(self.data),
+                               compression=compression)
+        res = getattr(self, 'fit_exp_result_', None)
+        if res is not None and not isinstance(res, TargetFitResult):
+            _save_fit_exp_result(grp.create_group('fit_exp_result'), res)
+
+    @classmethod
+    def from_file(cls, fname, mmap_mode='r', t_range=None) -> "TimeResSpec":
+        """
+        Loads a dataset saved by `save_h5`.
+
+        Parameters
+        ----------
+        fname : str or Path
+            Filename (can include path)
+        mmap_mode : {'r', 'r+', 'c', None}
+            By default, data and err are memory-mapped read-only, so only the
+            accessed parts are loaded from disk. Use 'r+' to write changes
+            of the arrays back into the file and 'c' for copy-on-write. If
+            None or if the file is compressed, the arrays are read into
+            memory.
+        t_range : (float, float) or None
+            If given, only the delay-times within the range are loaded.
+        """
+        with h5py.File(fname, 'r') as f:
+            _check_h5_type(f, 'TimeResSpec')
+            return cls._from_group(f, mmap_mode, t_range)
+
+    from_h5 = from_file
+
+    @classmethod
+    def _from_group(cls, grp, mmap_mode='r', t_range=None) -> "TimeResSpec":
+        rows = h5_rows_in_range(grp['t'][()], t_range)
+        wl = grp['wavelengths'][()]
+        t = grp['t'][rows]
+        data = h5_as_array(grp['data'], mmap_mode, rows)
+        err = h5_as_array(grp['err'], mmap_mode, rows) if 'err' in grp else None
+        if 'mask' in grp:
+            data = np.ma.MaskedArray(data, mask=grp['mask'][rows], copy=False)
+        name = grp.attrs.get('name', None)
+        disp_freq_unit = grp.attrs.get('disp_freq_unit', None)
+        ds = cls(wl, t, data, err, name=name, disp_freq_unit=disp_freq_unit,
+                 copy=False)
+        if 'fit_exp_result' in grp and t_range is None:
+            _load_fit_exp_result(grp['fit_exp_result'], ds)
+        return ds
+
     def save_txt(self, fname, freq_unit="wl"):
         """
         Saves the dataset as a text file.
@@ -408,6 +823,7 @@ class TimeResSpec:
             self.err[:, idx] = np.ma.masked
         self.data = np.ma.MaskedArray(self.data)
         self.data[:, idx] = np.ma.masked
+        self.invalidate_svd()
 
     def mask_freqs(self, freq_ranges, invert_sel=False, freq_unit=None):
         """
@@ -442,6 +858,7 @@ class TimeResSpec:
             self.err[:, idx] = np.ma.masked
         self.data = np.ma.MaskedArray(self.data)
         self.data[:, idx] = np.ma.masked
+        self.invalidate_svd()
 
     def cut_time(self, lower=-np.inf, upper=np.inf, invert_sel=False) -> "TimeResSpec":
         """
@@ -534,20 +951,23 @@ class TimeResSpec:
             self.err[idx, :].mask = True
         # self.t = np.ma.MaskedArray(self.t, idx)
         self.data.mask[:, idx] = True
+        self.invalidate_svd()
 
     def subtract_background(self, n: int = 10):
         """Subtracts the first n-spectra from the dataset"""
         self.data -= np.mean(self.data[:n, :], 0, keepdims=True)
 
-    def bin_freqs(self, n: int, freq_unit=None, use_err: bool = True) -> "TimeResSpec":
+    def bin_freqs(self, n: Union[int, np.ndarray], freq_unit=None,
+                  use_err: bool = True) -> "TimeResSpec":
         """
         Bins down the dataset by averaging over several transients.
 
         Parameters
         ----------
-        n : int
+        n : int or array
             The number of bins. The edges are calculated by
-            np.linspace(freq.min(), freq.max(), n+1).
+            np.linspace(freq.min(), freq.max(), n+1). Alternatively, the bin
+            edges in the `freq_unit`. Empty bins are dropped.
         freq_unit : 'nm', 'cm' or None
             Whether to calculate the bin-borders in frequency- of wavelength
             space. If `None`, it defaults to `self.disp_freq_unit`.
@@ -556,78 +976,146 @@ class TimeResSpec:
         Returns
         -------
         TimeResSpec
-            Binned down `TimeResSpec`
+            Binned down `TimeResSpec`. If the dataset has an error, the error
+            is propagated to the binned means.
         """
-        # We use the negative of the wavenumbers to make the array sorted
         if freq_unit is None:
             freq_unit = self.disp_freq_unit
-        arr = self.wavelengths if freq_unit == "nm" else -self.wavenumbers
-        # Slightly offset edges to include themselves.
-        edges = np.linspace(arr.min() - 0.002, arr.max() + 0.002, n + 1)
-        idx = np.searchsorted(arr, edges)
-        binned = np.empty((self.data.shape[0], n))
-        binned_wl = np.empty(n)
-        binned_err = np.empty_like(binned)
-
-        for i in range(n):
-            if self.err is None or not use_err:
-                weights = None
+        arr = self.wavelengths if freq_unit == "nm" else self.wavenumbers
+        if np.ndim(n) == 0:
+            # Slightly offset edges to include themselves.
+            edges = np.linspace(arr.min() - 0.002, arr.max() + 0.002, n + 1)
+        else:
+            edges = np.sort(n)
+        weights = None
+        if self.err is not None and use_err:
+            weights = 1 / self.err**2
+        b = bin_along(arr, self.data, edges, weights)
+        sel = b.nonempty
+        binned_err = None
+        if self.err is not None:
+            if use_err:
+                binned_err = 1 / np.sqrt(b.sum_weights[:, sel])
             else:
-                weights = 1 / self.err[:, idx[i]:idx[i + 1]] ** 2
-            vals = self.data[:, idx[i]:idx[i + 1]]
-            binned[:, i] = np.average(vals, 1, weights=weights)
-            if weights is not None:
-                binned_err[:, i] = np.average((vals - binned[:, i, None]) ** 2,
-                                              1,
-                                              weights=weights)
-            binned_wl[i] = np.mean(arr[idx[i]:idx[i + 1]])
-        if freq_unit == "cm":
-            binned_wl = -binned_wl
-        if self.err is None or not use_err:
-            weights = None
-
+                binned_err = np.sqrt(bin_along(arr, self.err**2, edges).mean[:, sel]
+                                     / b.count[sel])
         return TimeResSpec(
-            binned_wl,
+            b.x[sel],
             self.t,
-            binned,
+            b.mean[:, sel],
             err=binned_err,
             freq_unit=freq_unit,
             disp_freq_unit=self.disp_freq_unit,
         )
 
-    def bin_times(self, n, start_index=0) -> "TimeResSpec":
+    def bin_times(self,
+                  n,
+                  start_index=0,
+                  log_spaced=False,
+                  sigma: Optional[float] = 2.5,
+                  use_err=True) -> "TimeResSpec":
         """
         Bins down the dataset by binning `n` sequential spectra together.
 
         Parameters
         ----------
         n : int
-            How many spectra are binned together.
+            How many spectra are binned together. If `log_spaced`, the number
+            of logarithmically spaced bins instead.
         start_index : int
-            Determines the starting index of the binning
+            Determines the starting index of the binning. Earlier spectra are
+            dropped.
+        log_spaced : bool
+            If true, the spectra are binned into n logarithmically spaced
+            delay-time bins between the delay-time at `start_index`, which
+            must be positive, and the last delay-time. Empty bins are dropped,
+            hence spectra at early delay-times usually stay unbinned.
+        sigma : float or None
+            Values outside sigma standard deviations from the median of their
+            bin are ignored, see `sigma_clip`. If None, no values are ignored.
+        use_err : bool
+            If true and the dataset has an error, the spectra are weighted by
+            their inverse variance.
 
         Returns
         -------
         TimeResSpec
-            Binned down `TimeResSpec`
-        """
-
-        out = []
-        out_t = []
-        m = len(self.t)
-        for i in range(start_index, m, n):
-            end_idx = min(i + n, m)
-            out.append(
-                sigma_clip(self.data[i:end_idx, :], sigma=2.5, max_iter=1,
-                           axis=0).mean(0))
-            out_t.append(self.t[i:end_idx].mean())
-
-        new_data = np.array(out)
-        new_t = np.array(out_t)
-        out_ds = self.copy()
-        out_ds.t = new_t
-        out_ds.data = new_data
-        return out_ds
+            Binned down `TimeResSpec`. Its delay-times are the means of the
+            binned delay-times. The error is propagated from the error of the
+            dataset, if available, otherwise it is the standard error of the
+            mean of the binned values. For bins containing a single value, the
+            latter is replaced by the pooled standard deviation of the other
+            bins.
+        """
+        t = self.t[start_index:]
+        if log_spaced:
+            if t[0] <= 0:
+                raise ValueError('Log-spaced binning requires positive delay-times,'
+                                 ' choose start_index accordingly.')
+            edges = np.geomspace(t[0], t[-1], n + 1)
+            bounds = np.searchsorted(t, edges, 'left')
+            bounds[-1] = t.size
+            bounds = np.unique(bounds)
+        else:
+            bounds = np.r_[np.arange(0, t.size, n), t.size]
+        starts, lengths = bounds[:-1], np.diff(bounds)
+
+        data = self.data[start_index:]
+        if isinstance(data, np.ma.MaskedArray):
+            data = data.astype(float).filled(np.nan)
+        err = self.err[start_index:] if self.err is not None else None
+        new_data = np.empty((starts.size, data.shape[1]))
+        new_err = np.empty_like(new_data)
+        if err is None:
+            # Pooled variance of the bins with more than one value, per channel.
+            pooled_ss = np.zeros(data.shape[1])
+            pooled_dof = np.zeros(data.shape[1])
+            single = np.zeros(new_data.shape, dtype=bool)
+        # Bins of equal length are processed together as a 3d-array.
+        for length in np.unique(lengths):
+            sel = lengths == length
+            idx = starts[sel, None] + np.arange(length)
+            block = data[idx]
+            if sigma is not None:
+                mask = sigma_clip_stats(block, sigma=sigma, max_iter=1, axis=1)[3]
+            else:
+                mask = ~np.isfinite(block)
+            block = np.where(mask, 0, block)
+            if err is not None and use_err:
+                w = np.where(mask, 0, 1 / err[idx]**2)
+            else:
+                w = (~mask).astype(float)
+            sum_w = w.sum(1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = (w * block).sum(1) / sum_w
+                if err is not None:
+                    sq = (w * np.where(mask, 0, err[idx]))**2
+                    new_err[sel] = np.sqrt(sq.sum(1)) / sum_w
+                else:
+                    dev2 = np.where(mask, 0, (block - mean[:, None, :])**2)
+                    ss = dev2.sum(1)
+                    new_err[sel] = np.sqrt(ss / (sum_w-1) / sum_w)
+                    multi = sum_w > 1
+                    pooled_ss += np.where(multi, ss, 0).sum(0)
+                    pooled_dof += np.where(multi, sum_w - 1, 0).sum(0)
+                    single[sel] = sum_w == 1
+            new_data[sel] = mean
+        if err is None and single.any():
+            # A single value has no spread, use the noise of a single value
+            # estimated from the other bins instead, or from the differences
+            # of successive spectra if all bins are single values.
+            with np.errstate(invalid='ignore', divide='ignore'):
+                noise = np.sqrt(pooled_ss / pooled_dof)
+            if not np.all(pooled_dof > 0) and data.shape[0] > 1:
+                diff_noise = np.nanstd(np.diff(data, axis=0), axis=0) / np.sqrt(2)
+                noise = np.where(pooled_dof > 0, noise, diff_noise)
+            new_err = np.where(single, noise, new_err)
+        new_t = np.add.reduceat(t, starts) / lengths
+        if isinstance(self.data, np.ma.MaskedArray):
+            new_data = np.ma.masked_invalid(new_data)
+        return TimeResSpec(self.wavelengths, new_t, new_data, err=new_err,
+                           disp_freq_unit=self.disp_freq_unit,
+                           auto_plot=self.auto_plot, copy=False)
 
     def estimate_dispersion(self,
                             heuristic="abs",
@@ -696,31 +1184,31 @@ class TimeResSpec:
         self.disp_result_ = result
         return result
 
-    def interpolate_disp(self, polyfunc: Union[Callable, Iterable]) -> "TimeResSpec":
+    def interpolate_disp(self, polyfunc: Union[Callable, Iterable],
+                         kind='linear') -> "TimeResSpec":
         """
-        Correct for dispersion by linear interpolation .
+        Correct for dispersion by interpolation.
 
         Parameters
         ----------
         polyfunc : Union[Callable, Iterable]
             Function which takes wavenumbers and returns time-zeros.
+        kind : {'linear', 'cubic', 'akima'}
+            The kind of interpolation, see `zero_finding.shift_channels`.
 
         Returns
         -------
         TimeResSpec
             New TimeResSpec where the data is interpolated so that all channels
-            have the same delay point.
+            have the same delay point. The error is interpolated as well.
         """
         c = self.copy()
         if callable(polyfunc):
             zeros = polyfunc(self.wavenumbers)
         else:
             zeros = polyfunc
-        ntc = zero_finding.interpol(self, zeros)
-        tmp_tup = dv.tup(self.wavelengths, self.t, self.data)
-        ntc_err = zero_finding.interpol(tmp_tup, zeros)
-        c.data = ntc.data
-        c.err = ntc_err.data
+        c.data, c.err = zero_finding.shift_channels(self.t, self.data, zeros,
+                                                    err=self.err, kind=kind)
         return c
 
     def fit_exp(
@@ -735,6 +1223,7 @@ class TimeResSpec:
             use_error=False,
             fixed_names=None,
             from_t=None,
+            use_jac=True,
     ):
         """
         Fit a sum of exponentials to the dataset. This function assumes
@@ -769,6 +1258,36 @@ class TimeResSpec:
             Can be used to fix time-constants
         from_t: float or None
             Can be used to cut of early times.
+        use_jac : bool
+            If true, use the variable projection engine: the jacobian is
+            calculated analytically and unweighted data is compressed by a
+            SVD before fitting. See `Fitter.jac` and `Fitter.leastsq`.
+        """
+        f, lm_model = self._setup_fit_exp(x0, fix_sigma, fix_t0, fix_last_decay,
+                                          model_coh, lower_bound, use_error,
+                                          fixed_names, from_t, use_jac)
+        result = f.leastsq(lm_model, compress=use_jac)
+        result_tuple = FitExpResult(lm_model, result, f)
+        result_tuple.calculate_stats()
+        self.fit_exp_result_ = result_tuple
+        if verbose:
+            lmfit.fit_report(result)
+        return result_tuple
+
+    def _setup_fit_exp(self,
+                       x0,
+                       fix_sigma=True,
+                       fix_t0=True,
+                       fix_last_decay=True,
+                       model_coh=False,
+                       lower_bound=0.1,
+                       use_error=False,
+                       fixed_names=None,
+                       from_t=None,
+                       use_jac=True):
+        """
+        Creates the fitter and the lmfit model used by `fit_exp`, see there
+        for the parameters.
         """
         if from_t is None:
             ds = self
@@ -782,6 +1301,8 @@ class TimeResSpec:
 
         if fixed_names is None:
             fixed_names = list()
+        else:
+            fixed_names = list(fixed_names)
         if fix_sigma:
             fixed_names.append("w")
 
@@ -792,23 +1313,211 @@ class TimeResSpec:
             lower_bound=lower_bound,
             full_model=False,
             fixed_names=fixed_names,
+            use_jac=use_jac,
         )
         ridge_alpha = abs(self.data).max() * 1e-4
         f.lsq_method = "ridge"
-        fitter.alpha = ridge_alpha
-        result = lm_model.leastsq()
-        result_tuple = FitExpResult(lm_model, result, f)
-        result_tuple.calculate_stats()
-        self.fit_exp_result_ = result_tuple
-        if verbose:
-            lmfit.fit_report(result)
-        return result_tuple
+        f.alpha = ridge_alpha
+        return f, lm_model
+
+    def fit_target(self,
+                   model: Model,
+                   x0: Dict[str, float],
+                   t0=0.,
+                   w=0.1,
+                   y0=None,
+                   fix_t0=True,
+                   fix_sigma=True,
+                   fixed_names=(),
+                   model_coh=False,
+                   use_error=False,
+                   compress=True) -> TargetFitResult:
+        """
+        Fits a compartmental model directly to the dataset (target
+        analysis). The rates and yields of the model are fitted, while the
+        species associated spectra are solved linearly. Assumes the dataset
+        is already corrected for dispersion.
+
+        Parameters
+        ----------
+        model : Model
+            The kinetic model.
+        x0 : dict
+            Starting values of the rates and yields of the model, keyed by
+            their names.
+        t0, w : float
+            Starting values of the time-zero and the width of the system
+            response.
+        y0 : ndarray or None
+            Starting concentrations. If none, y0 = [1, 0, 0, ...].
+        fix_t0 : bool
+            If to fix the time-zero.
+        fix_sigma : bool
+            If to fix the width of the system response.
+        fixed_names : list of str
+            Model parameters which are fixed.
+        model_coh : bool
+            If coherent contributions should be modeled.
+        use_error : bool
+            If the errors are used to weight the residuals.
+        compress : bool
+            If unweighted data is compressed before fitting, see
+            `Fitter.leastsq`.
+
+        Returns
+        -------
+        TargetFitResult
+            The result, also saved in `target_result_`.
+        """
+        if use_error:
+            assert self.err is not None
+        self.target_result_ = _fit_target(self, self.err if use_error else None,
+                                          model, x0, t0, w, y0, fix_t0, fix_sigma,
+                                          fixed_names, model_coh, compress)
+        return self.target_result_
+
+    def _make_fit_exp_result(self, para, lmfit_res, kwargs) -> FitExpResult:
+        """
+        Builds the FitExpResult of a fit done elsewhere, e.g. in another
+        process, from the fitted parameters and the lmfit result. Sets
+        `fit_exp_result_`.
+        """
+        f, lm_model = self._setup_fit_exp(para, **kwargs)
+        f.res(para)
+        res = FitExpResult(lm_model, lmfit_res, f)
+        res.calculate_stats()
+        self.fit_exp_result_ = res
+        return res
+
+    def fit_exp_multistart(self,
+                           x0,
+                           n_starts=32,
+                           tau_bounds=None,
+                           method='lhs',
+                           max_workers=None,
+                           seed=None,
+                           rtol=1e-3,
+                           **kwargs) -> MultiStartResult:
+        """
+        Runs `fit_exp` from many starting values for the decay times and
+        groups the results by the minimum they converged to. The fits are
+        independent and run in parallel in a process pool.
+
+        Parameters
+        ----------
+        x0 : list of floats or array
+            Starting values as in `fit_exp`. The values of the free decay
+            times are replaced by the sampled starting values, fixed ones are
+            kept.
+        n_starts : int
+            For 'lhs', the number of fits. For 'grid', the number of grid
+            points per decay time.
+        tau_bounds : (float, float) or None
+            Lower and upper limit for the starting decay times, sampled on a
+            log-scale. Defaults to the `lower_bound` of the fit and the
+            largest delay time.
+        method : 'lhs', 'grid' or array
+            'lhs' uses a latin hypercube sample. 'grid' uses all ordered
+            combinations of a logarithmic grid. An array of shape
+            (n, number of free taus) is used as given.
+        max_workers : int or None
+            Number of processes, defaults to the number of cores. If 1, the
+            fits run in the current process. The processes are spawned, so
+            scripts using this have to be guarded by
+            ``if __name__ == '__main__'`` on all platforms.
+        seed : int or None
+            Seed of the latin hypercube sample.
+        rtol : float
+            Relative tolerance of the decay times, below which two fits are
+            considered to have found the same minimum.
+        **kwargs
+            Passed to `fit_exp`.
+
+        Returns
+        -------
+        MultiStartResult
+            The results ranked by chi-square. `fit_exp_result_` is set to
+            the best fit.
+        """
+        x0 = np.asarray(x0, dtype=float)
+        kwargs.pop('verbose', None)
+        n_tau = x0.size - 2
+        fixed = kwargs.get('fixed_names') or []
+        free = [i for i in range(n_tau) if 't%d' % i not in fixed]
+        if kwargs.get('fix_last_decay', True):
+            free = [i for i in free if i != n_tau - 1]
+        if len(free) == 0:
+            raise ValueError('No free decay times to sample.')
+        if tau_bounds is None:
+            tau_bounds = (kwargs.get('lower_bound', 0.1), self.t.max())
+        lo, hi = np.log10(tau_bounds)
+
+        if isinstance(method, str) and method == 'lhs':
+            from scipy.stats import qmc
+            sample = qmc.LatinHypercube(d=len(free), seed=seed).random(n_starts)
+            tau_starts = np.sort(10**(lo + (hi-lo) * sample), axis=1)
+        elif isinstance(method, str) and method == 'grid':
+            grid = np.geomspace(*tau_bounds, n_starts)
+            tau_starts = np.array(list(itertools.combinations(grid, len(free))))
+        elif isinstance(method, str):
+            raise ValueError("method must be 'lhs', 'grid' or an array")
+        else:
+            tau_starts = np.atleast_2d(np.asarray(method, dtype=float))
+            if tau_starts.shape[1] != len(free):
+                raise ValueError('Starting values must have one column per free tau')
+        starts = np.repeat(x0[None, :], len(tau_starts), 0)
+        starts[:, 2 + np.array(free)] = tau_starts
+
+        if max_workers == 1:
+            out = [_fit_exp_start(self, kwargs, x) for x in starts]
+        else:
+            # Forked workers can deadlock in numba's threading layer, if
+            # a parallel kernel was already called, hence spawn is used.
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers, mp_context=ctx,
+                                     initializer=_multistart_init,
+                                     initargs=(self.wavelengths, self.t, self.data,
+                                               self.err, kwargs)) as ex:
+                n_workers = max_workers or os.cpu_count() or 1
+                chunksize = max(1, len(starts) // (4*n_workers))
+                out = list(ex.map(_multistart_worker, starts, chunksize=chunksize))
+
+        end_para = np.full_like(starts, np.nan)
+        chisqr = np.full(len(starts), np.nan)
+        lmfit_res = [None] * len(starts)
+        for i, o in enumerate(out):
+            if o is not None:
+                end_para[i], lmfit_res[i] = o
+                chisqr[i] = lmfit_res[i].chisqr
+
+        # Group the fits by their sorted taus, best minimum first.
+        minimum_idx = np.full(len(starts), -1)
+        minima: List[np.ndarray] = []
+        for i in np.argsort(chisqr):
+            if np.isnan(chisqr[i]):
+                break
+            taus = np.sort(end_para[i, 2:])
+            for j, m in enumerate(minima):
+                if np.allclose(taus, np.sort(end_para[m, 2:]), rtol=rtol, atol=0):
+                    minimum_idx[i] = j
+                    break
+            else:
+                minimum_idx[i] = len(minima)
+                minima.append(i)
+        if len(minima) == 0:
+            raise RuntimeError('All fits failed.')
+
+        # Only the model at the found minima has to be calculated, no refit.
+        results = [self._make_fit_exp_result(end_para[i], lmfit_res[i], kwargs)
+                   for i in minima[::-1]][::-1]
+        return MultiStartResult(results, starts, end_para, chisqr, minimum_idx)
 
     def lifetime_density_map(self,
                              taus=None,
                              alpha=1e-4,
                              cv=True,
                              maxiter=30000,
+                             method='sklearn',
                              **kwargs):
         """Calculates the LDM from a dataset by regularized regression.
 
@@ -820,25 +1529,53 @@ class TimeResSpec:
         alpha : float
             The regularization factor.
         cv : bool
-            If to apply cross-validation, by default True.
+            If to select alpha for each channel, by default True. The 'path'
+            method uses generalized cross-validation on the regularization
+            path, 'sklearn' uses `ElasticNetCV`.
+        maxiter : int
+            Maximum number of iterations of the solver.
+        method : {'sklearn', 'path', 'tikhonov'}
+            'sklearn' fits the channels one by one with sklearn, see
+            `lifetimemap.start_ltm`. 'path' solves all channels at once,
+            which is much faster, see `lifetimemap.ltm_path`. With `cv`, it
+            selects alpha by generalized cross-validation and can hence
+            give a different regularization than 'sklearn'. 'tikhonov'
+            uses a l2-penalty instead of the elastic net, solved by a single
+            SVD, see `lifetimemap.ltm_tikhonov`. Its alpha is not comparable
+            with the alpha of the other methods.
         """
         if taus is None:
             dt = self.t[self.t_idx(0)] - self.t[self.t_idx(0) - 1]
             max_t = self.t.max()
             start = np.floor(np.log10(dt))
             end = np.ceil(np.log10(max_t))
-            taus = np.geomspace(start, end, 5 * (end - start))
-
-        result = lifetimemap.start_ltm(self,
-                                       taus,
-                                       use_cv=cv,
-                                       add_const=False,
-                                       alpha=alpha,
-                                       add_coh=False,
-                                       max_iter=30000,
-                                       **kwargs)
-        result = LDMResult(*result)
-        return result
+            taus = np.logspace(start, end, int(5 * (end - start)))
+
+        if method == 'path':
+            if not cv:
+                kwargs['alphas'] = [alpha]
+            path = lifetimemap.ltm_path(self, taus, add_const=False, add_coh=False,
+                                        max_iter=maxiter, **kwargs)
+            return LDMResult(None, path.coefs, path.fit, path.alpha, path)
+        elif method == 'tikhonov':
+            if not cv:
+                kwargs['alphas'] = [alpha]
+            path = lifetimemap.ltm_tikhonov(self, taus, add_const=False, add_coh=False,
+                                            **kwargs)
+            return LDMResult(None, path.coefs, path.fit, path.alpha, path)
+        elif method == 'sklearn':
+            if not cv:
+                kwargs['alpha'] = alpha
+            result = lifetimemap.start_ltm(self,
+                                           taus,
+                                           use_cv=cv,
+                                           add_const=False,
+                                           add_coh=False,
+                                           max_iter=maxiter,
+                                           **kwargs)
+            return LDMResult(*result)
+        else:
+            raise ValueError(f'Unknown method: {method}')
 
     def concat_datasets(self, other_ds):
         """
@@ -945,7 +1682,8 @@ class TimeResSpec:
         if callable(kind):
             tup = kind(filtered_ds.data, *args)
         elif kind == 'svd':
-            tup = filter.svd_filter(filtered_ds, args)
+            # Use self to profit from the cached decomposition.
+            tup = filter.svd_filter(self, args)
         elif kind == 'uniform':
             tup = filter.uniform_filter(filtered_ds, args)
         elif kind == "gaussian":
@@ -1042,6 +1780,7 @@ class PolTRSpec:
             lower_bound=0.1,
             use_error=False,
             fixed_names=None,
+            use_jac=True,
     ) -> FitExpResult:
         """
         Fit a sum of exponentials to the dataset. This function assumes
@@ -1074,6 +1813,10 @@ class PolTRSpec:
             Wether to use the error to weight the residuals
         fixed_names : list of str
             Can be used to fix names.
+        use_jac : bool
+            If true, use the variable projection engine: the jacobian is
+            calculated analytically and unweighted data is compressed by a
+            SVD before fitting. See `Fitter.jac` and `Fitter.leastsq`.
         """
         pa, pe = self.para, self.perp
         if not from_t is None:
@@ -1100,16 +1843,46 @@ class PolTRSpec:
             lower_bound=lower_bound,
             full_model=False,
             fixed_names=fixed_names,
+            use_jac=use_jac,
         )
         ridge_alpha = abs(all_data).max() * 1e-4
         f.lsq_method = "ridge"
-        fitter.alpha = ridge_alpha
-        result = lm_model.leastsq()
+        f.alpha = ridge_alpha
+        result = f.leastsq(lm_model, compress=use_jac)
 
         self.fit_exp_result_ = FitExpResult(lm_model, result, f)
         self.fit_exp_result_.calculate_stats()
         return self.fit_exp_result_
 
+    def fit_target(self,
+                   model: Model,
+                   x0: Dict[str, float],
+                   t0=0.,
+                   w=0.1,
+                   y0=None,
+                   fix_t0=True,
+                   fix_sigma=True,
+                   fixed_names=(),
+                   model_coh=False,
+                   use_error=False,
+                   compress=True) -> TargetFitResult:
+        """
+        Fits a compartmental model to both polarizations at once, the
+        concentrations are shared. The SAS of the result are the SAS
+        of the parallel and the perpendicular data, stacked along the
+        frequency axis. See `TimeResSpec.fit_target` for the parameters.
+        """
+        pa, pe = self.para, self.perp
+        all_data = np.hstack((pa.data, pe.data))
+        all_wls = np.hstack((pa.wavelengths, pe.wavelengths))
+        all_tup = dv.tup(all_wls, pa.t, all_data)
+        err = np.hstack((pa.err, pe.err)) if use_error else None
+        self.target_result_ = _fit_target(all_tup, err, model, x0, t0, w, y0,
+                                          fix_t0, fix_sigma, fixed_names,
+                                          model_coh, compress)
+        self.target_result_.pol_resolved = True
+        return self.target_result_
+
     def save_txt(self, fname, freq_unit="wl"):
         """
         Saves the dataset as a text file.
@@ -1127,6 +1900,31 @@ class PolTRSpec:
         self.perp.save_txt(fname.with_suffix(fname.suffix + '.perp.txt'), freq_unit)
         self.iso.save_txt(fname.with_suffix(fname.suffix + '.iso.txt'), freq_unit)
 
+    def save_h5(self, fname, block_rows=1024, compression=None):
+        """
+        Saves the dataset in the native HDF5 format of skultrafast, with
+        one group per polarisation. See `TimeResSpec.save_h5` for the
+        parameters. The result of the polarisation-resolved `fit_exp` is not
+        saved, only the results of the single datasets.
+        """
+        with h5py.File(fname, 'w') as f:
+            f.attrs['skultrafast_type'] = 'PolTRSpec'
+            for i in ['para', 'perp', 'iso']:
+                getattr(self, i)._save_to_group(f.create_group(i), block_rows,
+                                                compression)
+
+    @classmethod
+    def from_file(cls, fname, mmap_mode='r', t_range=None) -> 'PolTRSpec':
+        """
+        Loads a dataset saved by `save_h5`. See `TimeResSpec.from_file` for
+        the parameters.
+        """
+        with h5py.File(fname, 'r') as f:
+            _check_h5_type(f, 'PolTRSpec')
+            para, perp, iso = (TimeResSpec._from_group(f[i], mmap_mode, t_range)
+                               for i in ['para', 'perp', 'iso'])
+        return cls(para, perp, iso)
+
     def concat_datasets(self, other_ds: 'PolTRSpec'):
         new_ds = self.copy()
         for i in ['para', 'perp', 'iso']:
@@ -1644,7 +2442,7 @@ class TimeResSpecPlotter(PlotterMixin):
         OverviewPlot = namedtuple("OverviewPlot", "fig axs trans spec")
         return OverviewPlot(fig, axs, tr, sp)
 
-    def svd(self, n=5):
+    def svd(self, n=5, method='auto'):
         """
         Plot the SVD-components of the dataset.
 
@@ -1654,6 +2452,8 @@ class TimeResSpecPlotter(PlotterMixin):
             Determines the plotted SVD-components. If `n` is an int, it plots
             the first n components. If `n` is a list of ints, then every
             number is a SVD-component to be plotted.
+        method : str
+            SVD method, see `TimeResSpec.svd`.
         """
         is_nm = self.freq_unit == "nm"
         if is_nm:
@@ -1663,14 +2463,15 @@ class TimeResSpecPlotter(PlotterMixin):
         ds = self.dataset
         x = ds.wavelengths if is_nm else ds.wavenumbers
         fig, axs = plt.subplots(3, 1, figsize=(4, 5))
-        u, s, v = np.linalg.svd(ds.data)
-        axs[0].stem(s, use_line_collection=True)
-        axs[0].set_xlim(0, 11)
         try:
             len(n)
             comps = n
         except TypeError:
             comps = range(n)
+        res = ds.svd(max(max(comps, default=0) + 1, 11), method=method)
+        u, s, v = res.u, res.s, res.vt
+        axs[0].stem(s, use_line_collection=True)
+        axs[0].set_xlim(0, 11)
 
         for i in comps:
             axs[1].plot(ds.t, u.T[i], label="%d" % i)
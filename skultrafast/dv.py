@@ -5,6 +5,7 @@ import scipy.signal as sig
 from collections import namedtuple
 from scipy.constants import c, physical_constants
 from typing import Union, List
+from skultrafast import utils
 
 tup = namedtuple('tup','wl t data')
 
@@ -45,11 +46,8 @@ def smooth_spline(x, y, s):
     s = UnivariateSpline(x, y, s=s)
     return s(x)
 
-def svd_filter(d, n=6):
-    u, s, v = np.linalg.svd(d, full_matrices=0)
-    s[n:] = 0
-    f = np.dot(u, np.diag(s).dot(v))
-    return f
+def svd_filter(d, n=6, method='full'):
+    return utils.svd(d, n, method=method).reconstruct()
 
 def apply_spline(t, d, s=None):
     out = np.zeros_like(d)
@@ -82,21 +80,28 @@ def weighted_binner(n, wl, dat, std):
     return binned, binned_wl, binned_std
 
 
-def binner(n, wl, dat, func=np.mean):
+def binner(n, wl, dat, func=np.mean, weights=None):
     """
     Given wavelengths and data it bins the data into n-wavelenths.
-    Returns bdata and bwl
+    Returns bdata and bwl. The mean is calculated for all bins at once,
+    other functions are applied per bin. Empty bins are dropped. `weights`
+    are only supported for the mean.
 
     """
+    edges = np.linspace(wl.min(), wl.max(), n+1)
+    if func is np.mean:
+        b = utils.bin_along(wl, dat, edges, weights)
+        return b.mean[:, b.nonempty], b.x[b.nonempty]
+    if weights is not None:
+        raise ValueError('weights are only supported for func=np.mean')
     i = np.argsort(wl)
     wl = wl[i]
     dat = dat[:, i]
-    idx=np.searchsorted(wl,np.linspace(wl.min(),wl.max(),n+1))
-    binned=np.empty((dat.shape[0], n))
-    binned_wl=np.empty(n)
-    for i in range(n):
-        binned[:,i]=func(dat[:,idx[i]:idx[i+1]],1)
-        binned_wl[i]=np.mean(wl[idx[i]:idx[i+1]])
+    idx = np.searchsorted(wl, edges)
+    idx[-1] = wl.size
+    idx = idx[np.r_[True, np.diff(idx) > 0]]
+    binned = np.column_stack([func(dat[:, a:b], 1) for a, b in zip(idx, idx[1:])])
+    binned_wl = np.add.reduceat(wl, idx[:-1]) / np.diff(idx)
     return binned, binned_wl
 
 def fi(w, x) -> Union[List[int], int]:
@@ -294,32 +299,139 @@ def rebin(a, new_shape):
     else:
         return np.repeat(np.repeat(a, m/M, axis=0), n/N, axis=1)
 
-from scipy.sparse.linalg import svds
-def efa(dat, n, reverse=False):
+def _efa_basis(dat, n, n_basis):
+    """
+    Projects the rows of `dat` on its first `n_basis` right singular vectors.
+    The singular values of any set of rows are unchanged by the projection,
+    if `n_basis` is None or covers all components. Otherwise they are off by
+    at most the first dropped global singular value.
+    """
+    dat = np.asarray(np.ma.getdata(dat), dtype=float)
+    k = min(dat.shape)
+    n_basis = k if n_basis is None else min(max(n_basis, n), k)
+    if n_basis == k:
+        if dat.shape[1] == k:
+            return dat
+        res = utils.svd(dat, method='full')
+        return res.u * res.s
+    method = 'randomized' if n_basis < k // 4 else 'full'
+    res = utils.svd(dat, n_basis, method=method)
+    return res.u * res.s
+
+
+def _chunks(n, r):
+    """Row chunks so that a stack of (r, r) arrays stays small."""
+    step = max(1, 2**22 // (r*r))
+    return [(i, min(i + step, n)) for i in range(0, n, step)]
+
+
+def efa(dat, n, reverse=False, n_basis=None):
     """
     Doing evolving factor analyis.
+
+    The singular values of the growing windows are calculated from the
+    eigenvalues of their Gram matrices, which are updated by one rank-one
+    term per row.
+
+    Parameters
+    ----------
+    dat : array (n_t, n_wl)
+        The data.
+    n : int
+        Number of returned singular values.
+    reverse : bool
+        If False, row i contains the singular values of ``dat[:i+1]``
+        (forward EFA). If True, of ``dat[i:]`` (backward EFA).
+    n_basis : int or None
+        If given, the data is first projected on its first `n_basis`
+        singular vectors, which keeps the Gram matrices small. The values
+        are then off by at most the first dropped singular value. None
+        gives exact results.
+
+    Returns
+    -------
+    array (n_t, n)
+        The singular values in decreasing order. Windows with fewer than `n`
+        rows are padded with zeros.
     """
+    w = _efa_basis(dat, n, n_basis)
     if reverse:
-        data=dat[::-1, :]
-    else:
-        data=dat
-
-    out=np.zeros((data.shape[0], n))
-    for i in range(6, data.shape[0]):
-        sv = svds(data[:i, :], min(i,n))[1]
-        out[i, :] = sv
+        w = w[::-1]
+    r = w.shape[1]
+    out = np.zeros((w.shape[0], n))
+    gram = np.zeros((r, r))
+    for a, b in _chunks(w.shape[0], r):
+        grams = gram + np.cumsum(w[a:b, :, None] * w[a:b, None, :], axis=0)
+        ev = np.linalg.eigvalsh(grams)[:, ::-1][:, :n]
+        out[a:b, :ev.shape[1]] = np.sqrt(np.clip(ev, 0, None))
+        gram = grams[-1]
+    # Only the first i+1 singular values are non-zero.
+    out[np.arange(n)[None, :] > np.arange(w.shape[0])[:, None]] = 0
+    if reverse:
+        out = out[::-1]
     return out
 
-def moving_efa(dat, n, ncols, method='svd'):
-    out=np.zeros((dat.shape[0], n))
-    p = PCA()
-    for i in range(0, dat.shape[0]-n):
-        if method=='svd':
-            sv = np.linalg.svd(dat[i:i+ncols,:])[1][:n]
-        elif method=='pca':
-            p = p.fit(dat[i:i+ncols,:])
-            sv = p.explained_variance_ratio_[:n]
-        out[i,:] = sv
+
+def moving_efa(dat, n, ncols, method='svd', n_basis=None):
+    """
+    Doing evolving factor analysis with a moving window.
+
+    The Gram matrix of the window is updated by adding the outer product of
+    the incoming row and subtracting the one of the outgoing row. To avoid
+    accumulating rounding errors, it is recalculated at the start of each
+    chunk of windows.
+
+    Parameters
+    ----------
+    dat : array (n_t, n_wl)
+        The data.
+    n : int
+        Number of returned values.
+    ncols : int
+        Number of rows (delay times) in the window.
+    method : 'svd' or 'pca'
+        'svd' returns the singular values of the window. 'pca' returns the
+        explained variance ratios of the mean centered window.
+    n_basis : int or None
+        Number of global SVD components used for the projection, see `efa`.
+
+    Returns
+    -------
+    array (n_t, n)
+        Row i contains the values of the window starting at row i. Rows
+        without a full window are zero.
+    """
+    if method not in ('svd', 'pca'):
+        raise ValueError(f'Unknown method {method}')
+    w = _efa_basis(dat, n, n_basis)
+    n_win = w.shape[0] - ncols + 1
+    out = np.zeros((w.shape[0], n))
+    if n_win < 1:
+        return out
+    r = w.shape[1]
+    for a, b in _chunks(n_win, r):
+        first = w[a:a + ncols]
+        incoming, outgoing = w[a + ncols:b + ncols - 1], w[a:b - 1]
+        updates = (incoming[:, :, None] * incoming[:, None, :]
+                   - outgoing[:, :, None] * outgoing[:, None, :])
+        grams = np.concatenate(((first.T @ first)[None],
+                                first.T @ first + np.cumsum(updates, axis=0)))
+        if method == 'pca':
+            sums = first.sum(0) + np.concatenate(
+                (np.zeros((1, r)), np.cumsum(incoming - outgoing, axis=0)))
+            grams -= sums[:, :, None] * sums[:, None, :] / ncols
+        ev = np.linalg.eigvalsh(grams)[:, ::-1][:, :n]
+        out[a:b, :ev.shape[1]] = np.sqrt(np.clip(ev, 0, None))
+    # A window has at most ncols non-zero singular values.
+    out[:, ncols:] = 0
+    if method == 'pca':
+        # The total variance is taken from the unprojected data, using
+        # running sums over the windows.
+        d = np.asarray(np.ma.getdata(dat), dtype=float)
+        sq = np.concatenate(([0], np.cumsum((d**2).sum(1))))
+        sm = np.concatenate((np.zeros((1, d.shape[1])), np.cumsum(d, 0)))
+        total = (sq[ncols:] - sq[:-ncols]) - ((sm[ncols:] - sm[:-ncols])**2).sum(1) / ncols
+        out[:n_win] = out[:n_win]**2 / np.where(total > 0, total, 1)[:, None]
     return out
 
 from scipy.optimize import nnls
@@ -4,27 +4,32 @@ This module contains various filters and binning methods. All take
 a dv tup and return a tup.
 """
 
-from . import dv
+from . import dv, utils
 import numpy as np
 import scipy.ndimage as nd
 import scipy.signal as sig
 
-def svd_filter(tup, n=6):
+def svd_filter(tup, n=6, method='auto'):
     """
     Only use the first n-components.
 
     Parameters
     ----------
     tup:
-        data object.
+        data object. If it is a `TimeResSpec`, its cached decomposition is
+        used, see `TimeResSpec.svd`.
     n:
         number of svd components used.
+    method:
+        svd method, see `utils.svd`. 'auto' uses the method choosen by
+        `TimeResSpec.svd` or the full svd for other data objects.
     """
     wl, t, d = tup.wl, tup.t, tup.data
-    u, s, v = np.linalg.svd(d, full_matrices=0)
-    s[n:] = 0
-    f = np.dot(u, np.diag(s).dot(v))
-    return dv.tup(wl, t, f)
+    if hasattr(tup, 'svd'):
+        res = tup.svd(n, method=method)
+    else:
+        res = utils.svd(d, n, method='full' if method == 'auto' else method)
+    return dv.tup(wl, t, res.reconstruct())
 
 def wiener(tup, size=(3,3), noise=None):
     wl, t, d = tup.wl, tup.t, tup.data
@@ -74,27 +79,8 @@ def bin_channels(tup, n=200, method=np.mean):
     """
     Bin the data onto n-channels.
     """
-
-    def binner(n, wl, dat):
-        """
-        Given wavelengths and data it bins the data into n-wavelenths.
-        Returns bdata and bwl
-
-        """
-        i = np.argsort(wl)
-        wl = wl[i]
-        dat = dat[:, i]
-        idx = np.searchsorted(wl,np.linspace(wl.min(),wl.max(),n+1))
-        binned = np.empty((dat.shape[0], n))
-        binned_wl = np.empty(n)
-        for i in range(n):
-            binned[:,i] = method(dat[:,idx[i]:idx[i+1]],1)
-            binned_wl[i] = np.mean(wl[idx[i]:idx[i+1]])
-        return binned, binned_wl
-
-
     wl, t, d = tup.wl, tup.t, tup.data
-    binned_d, binned_wl = binner(n, wl, d)
+    binned_d, binned_wl = dv.binner(n, wl, d, method)
     return dv.tup(binned_wl, t, binned_d)
 
 def weighted_binner(n, wl, dat, std):
@@ -103,18 +89,7 @@ def weighted_binner(n, wl, dat, std):
     Returns bdata and bwl
 
     """
-    i = np.argsort(wl)
-    wl = wl[i]
-    dat = dat[:, i]
-    idx = np.searchsorted(wl,np.linspace(wl.min(),wl.max(),n+1))
-    binned = np.empty((dat.shape[0], n))
-    binned_wl = np.empty(n)
-    for i in range(n):
-        data = dat[:,idx[i]:idx[i+1]]
-        weights = 1/std[:,idx[i]:idx[i+1]]
-        binned[:,i] = np.average(data, 1, weights)
-        binned_wl[i] = np.mean(wl[idx[i]:idx[i+1]])
-    return binned, binned_wl
+    return dv.binner(n, wl, dat, weights=1/std)
 
 def _idx_range(arr, a, b):
     """Returns a boolean array which is True where arr is between
@@ -5,7 +5,7 @@ Module to fit the whole spektrum by peak functions.
 
 from __future__ import print_function
 from scipy.special import wofz
-from skultrafast.utils import sigma_clip
+from skultrafast.utils import sigma_clip_stats
 from . import unit_conversions
 
 import numpy as np
@@ -130,5 +130,5 @@ def bin_every_n(x, start_idx, n=10, reduction_func=lambda x: np.mean(x, 0)):
         x = x[:, None]
     for i in range(start_idx, x.shape[0], n):
         end_idx = min(i + n, x.shape[0])
-        out.append(sigma_clip(x[i:end_idx, :], sigma=2.5, axis=0).mean(0))
+        out.append(sigma_clip_stats(x[i:end_idx, :], sigma=2.5, axis=0)[0])
     return np.array(out)
\ No newline at end of file
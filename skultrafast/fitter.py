@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import numbers
 from typing import Callable, Tuple, cast
 
 import lmfit
@@ -7,7 +8,8 @@ import numpy as np
 import scipy.linalg as linalg
 
 from . import dv, zero_finding
-from .base_functions import _fold_exp, _fold_exp_and_coh
+from .base_functions import (_fold_exp, _fold_exp_and_coh, _fold_exp_grad,
+                             _coh_gaussian, _coh_gaussian_grad)
 
 posv = linalg.get_lapack_funcs(
     ('posv'
@@ -23,10 +25,14 @@ def direct_solve(a, b):
 alpha = 0.001
 
 
-def solve_mat(A, b_mat, method='ridge'):
+def solve_mat(A, b_mat, method='ridge', reg=None):
     """
     Returns the solution for the least squares problem |Ax - b_i|^2.
+    `reg` is the regularization parameter of the 'ridge', 'lasso' and
+    'enet' methods, it defaults to the module-level `alpha`.
     """
+    if reg is None:
+        reg = alpha
     if method == 'fast':
         #return linalg.solve(A.T.dot(A), A.T.dot(b_mat), sym_pos=True)
         return direct_solve(A.T.dot(A), A.T.dot(b_mat))
@@ -34,7 +40,7 @@ def solve_mat(A, b_mat, method='ridge'):
     elif method == 'ridge':
 
         X = np.dot(A.T, A)
-        X.flat[::A.shape[1] + 1] += alpha
+        X.flat[::A.shape[1] + 1] += reg
         Xy = np.dot(A.T, b_mat)
         #return linalg.solve(X, Xy, sym_pos=True, overwrite_a=True)
         return direct_solve(X, Xy)
@@ -53,14 +59,14 @@ def solve_mat(A, b_mat, method='ridge'):
     elif method == 'lasso':
         import sklearn.linear_model as lm
         s = lm.Lasso(fit_intercept=False)
-        s.alpha = alpha
+        s.alpha = reg
         s.fit(A, b_mat)
         return s.coef_.T
 
     elif method == 'enet':
         import sklearn.linear_model as lm
         s = lm.ElasticNet(fit_intercept=False, l1_ratio=0.2)
-        s.alpha = alpha
+        s.alpha = reg
         s.fit(A, b_mat)
         return s.coef_.T
 
@@ -68,6 +74,69 @@ def solve_mat(A, b_mat, method='ridge'):
         raise ValueError('Unknow lsq method, use ridge, qr, fast or lasso')
 
 
+def solve_mat_batched(A, b_mat, method='ridge', reg=None):
+    """
+    Solves the least squares problems |A_i x_i - b_i|^2 for all channels at
+    once, where every channel i has its own base.
+
+    Parameters
+    ----------
+    A : ndarray(N, M, K)
+        The base for every channel.
+    b_mat : ndarray(N, M)
+        The data.
+    method : str
+        The solver, see `solve_mat`. 'ridge', 'fast', 'cho' and 'qr' are
+        vectorized, the other methods loop over the channels.
+    reg : float or None
+        The regularization parameter, see `solve_mat`.
+
+    Returns
+    -------
+    x : ndarray(M, K)
+        The coefficients for every channel.
+    """
+    if reg is None:
+        reg = alpha
+    b_mat = np.asarray(b_mat)
+    A_ch = np.asarray(A).transpose(1, 0, 2)
+    if method in ('ridge', 'fast', 'cho'):
+        X = A_ch.transpose(0, 2, 1) @ A_ch
+        if method == 'ridge':
+            idx = np.arange(X.shape[-1])
+            X[:, idx, idx] += reg
+        Xy = np.einsum('ijk,ij->jk', A, b_mat)
+        try:
+            return np.linalg.solve(X, Xy[..., None])[..., 0]
+        except LinAlgError:
+            # At least one channel is singular, solve them one by one and
+            # use the minimum norm solution for the singular ones.
+            x = np.empty_like(Xy)
+            for i in range(X.shape[0]):
+                try:
+                    x[i] = np.linalg.solve(X[i], Xy[i])
+                except LinAlgError:
+                    x[i] = np.linalg.lstsq(X[i], Xy[i], rcond=None)[0]
+            return x
+    elif method == 'qr':
+        q, r = np.linalg.qr(A_ch)
+        qb = np.einsum('jik,ij->jk', q, b_mat)
+        # Back substitution for all channels at once.
+        diag = np.diagonal(r, axis1=1, axis2=2)
+        x = np.zeros_like(qb)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in range(qb.shape[1] - 1, -1, -1):
+                x[:, k] = (qb[:, k] - np.einsum('ij,ij->i', r[:, k, k + 1:],
+                                                x[:, k + 1:])) / diag[:, k]
+        tol = np.finfo(float).eps * max(A_ch.shape[1:]) * abs(diag).max(1)
+        for i in np.flatnonzero(abs(diag).min(1) <= tol):
+            x[i] = np.linalg.lstsq(A_ch[i], b_mat[:, i], rcond=None)[0]
+        return x
+    else:
+        return np.array([solve_mat(A_ch[i], b_mat[:, i], method, reg)
+                         for i in range(A_ch.shape[0])])
+
+
 class Fitter(object):
     """ The fit object, takes all the need data and allows to fit it.
 
@@ -97,6 +166,12 @@ class Fitter(object):
     model_disp : int
         Degree of the polynomial which models the dispersion. If 1,
         only a offset is modeled, which is very fast.
+
+    Attributes
+    ----------
+    alpha : float or None
+        Regularization used by the ridge method. If None, the module-level
+        `alpha` is used.
     """
 
     def __init__(self, tup, model_coh=False, model_disp=1):
@@ -109,9 +184,13 @@ class Fitter(object):
         self.model_coh = model_coh
         self.model_disp = model_disp
         self.lsq_method = 'ridge'
+        self.alpha = None
 
         self.num_exponentials = -1
         self.weights = None
+        self._gram = None
+        self._cho = None
+        self._aty = None
 
         if model_disp > 1:
             self.org = data[:]
@@ -141,18 +220,55 @@ class Fitter(object):
         if self._chk_for_disp_change(para):
             # Only calculate interpolated data if necessary:
             self.tn = np.poly1d(para[:self.model_disp])(self.disp_x)
-            tup = dv.tup(self.wl, self.t, self.org)
-            self.data = zero_finding.interpol(tup, self.tn)[2]
+            self.data = zero_finding.shift_channels(self.t, self.org, self.tn)[0]
             self.used_disp[:] = para[:self.model_disp]
 
         self.num_exponentials = self.last_para.size - self.model_disp - 1
         if self.model_disp <= 1:
             self._build_xvec(para)
-        self.x_vec = np.nan_to_num(self.x_vec)
-        self.c = solve_mat(self.x_vec, self.data, self.lsq_method)
+        self.c = self._solve_lin()
         self.model = np.dot(self.x_vec, self.c)
         self.c = self.c.T
 
+    def _solve_lin(self):
+        """
+        Solves the linear least squares problem for the current base.
+        For the normal equation based methods, the factorization of
+        x_vec.T @ x_vec and the product x_vec.T @ data are reused as long
+        as the base and the data do not change.
+        """
+        reg = self._ridge_alpha()
+        if self.lsq_method not in ('ridge', 'fast', 'cho'):
+            return solve_mat(self.x_vec, self.data, self.lsq_method, reg)
+        try:
+            cho = self._gram_factor(reg if self.lsq_method == 'ridge' else 0.)
+        except LinAlgError:
+            return solve_mat(self.x_vec, self.data, self.lsq_method, reg)
+        if self._aty is None or self._aty_data is not self.data:
+            self._aty = np.dot(self.x_vec.T, self.data)
+            self._aty_data = self.data
+        return linalg.cho_solve(cho, self._aty)
+
+    def _ridge_alpha(self):
+        """The regularization of the fitter, defaults to the module-level alpha."""
+        return alpha if self.alpha is None else self.alpha
+
+    def _gram_factor(self, reg=0.):
+        """
+        Returns the cholesky factorization of x_vec.T @ x_vec + reg*I.
+        The gram matrix is kept up to date by _build_xvec.
+        """
+        A = self.x_vec
+        if self._gram is None or self._gram.shape[0] != A.shape[1]:
+            self._gram = A.T @ A
+            self._cho = None
+        if self._cho is None or self._cho_reg != reg:
+            M = self._gram.copy()
+            M.flat[::M.shape[0] + 1] += reg
+            self._cho = linalg.cho_factor(M)
+            self._cho_reg = reg
+        return self._cho
+
     def _chk_for_disp_change(self, para):
         if self.model_disp > 1:
             if np.any(para[:self.model_disp] != self.used_disp):
@@ -162,40 +278,55 @@ class Fitter(object):
     def _build_xvec(self, para):
         """
         Build the base (the folded functions) for given parameters.
+
+        The base is cached: if only some decay times changed since the
+        last call, only their columns and the corresponding entries of
+        x_vec.T @ x_vec and x_vec.T @ data are recalculated. A change of x0
+        or w rebuilds everything.
         """
-        para = np.array(para)
+        para = np.array(para, dtype=float)
         if self.verbose:
             print(para)
 
-        try:
-            idx = (para != self._last)
-        except AttributeError:
-            #self._l
-            idx = [True] * len(para)
-
+        n_shared = self.model_disp + 1
         if self.model_disp == 1:
             x0, w, taus = para[0], para[1], para[2:]
-            tau_idx = idx[2:]
         else:
             x0, w, taus = 0., para[0], para[1:]
-            tau_idx = idx[1:]
+        n_cols = taus.size + 3 * bool(self.model_coh)
 
-        if any(idx[:2]) or self.model_disp or True:
+        last = getattr(self, '_xvec_para', None)
+        if (last is None or last.shape != para.shape
+                or self._xvec_t is not self.t
+                or self.x_vec.shape != (self.t.size, n_cols)
+                or np.any(para[:n_shared] != last[:n_shared])):
             if self.model_coh:
                 x_vec = np.zeros((self.t.size, self.num_exponentials + 3))
-                #print(taus)
                 a, b = _fold_exp_and_coh(self.t[:, None], w, x0, taus)
-                #print(a.shape, b.shape)
                 x_vec[:, -3:] = b[..., 0, :]
                 x_vec[:, :-3] = a[..., 0, :]
-
             else:
                 x_vec = _fold_exp(self.t[:, None], w, x0, taus).squeeze()
-            self.x_vec = np.nan_to_num(x_vec)
-            #self.x_vec /= np.max(self.x_vec, 0)
-            self._last = para.copy()
+            self.x_vec = np.nan_to_num(x_vec).reshape(self.t.size, n_cols)
+            self._xvec_t = self.t
+            self._gram = None
+            self._cho = None
+            self._aty = None
         else:
-            self.x_vec[:, tau_idx] = _fold_exp(self.t, w, x0, taus[tau_idx]).T
+            tau_idx = np.flatnonzero(taus != last[n_shared:])
+            if tau_idx.size > 0:
+                cols = _fold_exp(self.t[:, None], w, x0, taus[tau_idx])
+                self.x_vec[:, tau_idx] = np.nan_to_num(cols[:, 0, :])
+                if self._gram is not None:
+                    upd = self.x_vec.T @ self.x_vec[:, tau_idx]
+                    self._gram[:, tau_idx] = upd
+                    self._gram[tau_idx, :] = upd.T
+                if self._aty is not None and self._aty_data is self.data:
+                    self._aty[tau_idx] = np.dot(self.x_vec[:, tau_idx].T, self.data)
+                else:
+                    self._aty = None
+                self._cho = None
+        self._xvec_para = para
 
     def res(self, para):
         """
@@ -208,6 +339,118 @@ class Fitter(object):
             self.residuals *= self.weights
         return self.residuals.ravel()
 
+    def jac(self, para, idx=None):
+        """
+        Returns the analytic jacobian of `res` for given parameters.
+
+        Uses variable projection: the linear coefficients are eliminated
+        and only the derivatives of the basis with respect to the nonlinear
+        parameters are required. These are calculated analytically, hence no
+        finite differences are needed. The columns follow the order of `para`,
+        see make_model for its format. Only supported for `model_disp <= 1`.
+
+        Parameters
+        ----------
+        para : ndarray(N)
+            The parameters.
+        idx : list of int or None
+            If given, only calculate the columns belonging to these
+            parameters, e.g. only the varying parameters.
+        """
+        para = np.asarray(para, dtype=float)
+        if self.model_disp > 1:
+            raise NotImplementedError('The analytic jacobian requires model_disp <= 1')
+        last = getattr(self, 'last_para', None)
+        if (last is None or last.shape != para.shape or np.any(last != para)
+                or self.model.shape != self.data.shape):
+            self.make_model(para)
+        if idx is None:
+            idx = range(para.size)
+
+        if self.model_disp == 1:
+            x0, w, taus = para[0], para[1], para[2:]
+        else:
+            x0, w, taus = 0., para[0], para[1:]
+        w_idx = self.model_disp
+        n_exp = taus.size
+        t = self.t[:, None]
+        A = self.x_vec
+        _, d_tau, d_w, d_x0 = _fold_exp_grad(t, w, x0, taus)
+
+        # Derivative of the basis for each parameter
+        dA = np.zeros((para.size, ) + A.shape)
+        dA[w_idx, :, :n_exp] = d_w[:, 0, :]
+        if self.model_disp == 1:
+            dA[0, :, :n_exp] = d_x0[:, 0, :]
+        for i in range(n_exp):
+            dA[w_idx + 1 + i, :, i] = d_tau[:, 0, i]
+        if self.model_coh:
+            coh_dw, coh_dx0 = _coh_gaussian_grad(t, w, x0)
+            dA[w_idx, :, -3:] = coh_dw[:, 0, :]
+            if self.model_disp == 1:
+                dA[0, :, -3:] = coh_dx0[:, 0, :]
+        dA = np.nan_to_num(dA[list(idx)])
+
+        # The coefficients solve (A.T A + alpha) c = A.T y, so their
+        # derivative is given by (A.T A + alpha)^-1 (dA.T r - A.T dA c).
+        c = self.c.T
+        r = self.data - self.model
+        reg = self._ridge_alpha() if self.lsq_method == 'ridge' else 0.
+        cho = self._gram_factor(reg)
+        J = np.empty((len(dA), ) + self.data.shape)
+        for i in range(len(dA)):
+            dc = linalg.cho_solve(cho, dA[i].T @ r - (A.T @ dA[i]) @ c)
+            # d(A c) = dA c + A dc, done with a single matrix product.
+            np.dot(np.hstack((dA[i], A)), np.vstack((c, dc)), out=J[i])
+            if self.weights is not None:
+                J[i] *= self.weights
+        return J.reshape(J.shape[0], -1).T
+
+    def leastsq(self, mini, compress=True):
+        """
+        Runs `mini.leastsq`, where `mini` was created by `start_lmfit` with
+        `full_model=False`.
+
+        If `compress` is true and the data is unweighted, the fit is done on
+        `R.T`, where `R` is the triangular factor of the QR decomposition of
+        `data.T`. Since `data = R.T @ Q.T` with orthonormal `Q`, the norm of
+        the residuals is unchanged by the projection, but for
+        datasets with more channels than delay-points the number of residuals
+        is much smaller. Afterwards, the model, DAS and fit statistics are
+        recalculated for the full data.
+        """
+        data = self.data
+        n, m = data.shape
+        if (not compress or self.weights is not None or self.model_disp > 1
+                or m <= n or np.ma.isMaskedArray(data) or not np.isfinite(data).all()):
+            return mini.leastsq()
+
+        self.data = np.linalg.qr(data.T, mode='r').T
+        try:
+            result = mini.leastsq()
+        finally:
+            self.data = data
+        x = [p.value for p in result.params.values()]
+        redchi = result.redchi
+
+        # Recalculate the statistics of the result for the full residuals,
+        # following the definitions in lmfit.
+        result.residual = self.res(x)
+        result.ndata = result.residual.size
+        result.nfree = result.ndata - result.nvarys
+        result.chisqr = (result.residual**2).sum()
+        result.redchi = result.chisqr / max(1, result.nfree)
+        neg2_log_likel = result.ndata * np.log(result.chisqr / result.ndata)
+        result.aic = neg2_log_likel + 2 * result.nvarys
+        result.bic = neg2_log_likel + np.log(result.ndata) * result.nvarys
+        if result.covar is not None:
+            fac = result.redchi / redchi
+            result.covar *= fac
+            for p in result.params.values():
+                if p.stderr is not None:
+                    p.stderr *= np.sqrt(fac)
+        return result
+
     def full_res(self, para):
         """
         Return the residuals for given parameter modelling each
@@ -251,11 +494,9 @@ class Fitter(object):
 
         self._build_xmat(para[self.model_disp:], is_disp_changed)
 
-        for i in range(self.data.shape[1]):
-            A = self.xmat[:, i, :]
-            self.c[i, :] = solve_mat(A, self.data[:, i], self.lsq_method)
-
-        self.model = np.dot(self.xmat, self.c)
+        self.c = solve_mat_batched(self.xmat, self.data, self.lsq_method,
+                                   self._ridge_alpha())
+        self.model = np.einsum('ijk,jk->ij', self.xmat, self.c)
 
     def _build_xmat(self, para, is_disp_changed):
         """
@@ -292,7 +533,7 @@ class Fitter(object):
         new_num_exp = para.size - self.model_disp - 1
         if new_num_exp != self.num_exponentials:
             self.num_exponentials = new_num_exp
-            if self.model_disp:
+            if self.model_coh:
                 new_num_exp += 3
             n, m = self.data.shape
             self.xmat = np.empty((n, m, new_num_exp))
@@ -309,7 +550,8 @@ class Fitter(object):
                     lower_bound=0.3,
                     fix_long=True,
                     fix_disp=False,
-                    full_model=1):
+                    full_model=1,
+                    use_jac=False):
         p = lmfit.Parameters()
         for i in range(self.model_disp):
             p.add('p' + str(i), x0[i])
@@ -341,5 +583,168 @@ class Fitter(object):
             x = [k.value for k in p.values()]
             return self.full_res(x)
 
+        def jac(p):
+            x = [k.value for k in p.values()]
+            idx = [i for i, k in enumerate(p.values()) if k.vary]
+            return self.jac(x, idx)
+
         fun = full_res if full_model else res
+        if use_jac and not full_model:
+            # Only used by the leastsq method.
+            return lmfit.Minimizer(fun, p, Dfun=jac)
         return lmfit.Minimizer(fun, p)
+
+
+class TargetFitter(Fitter):
+    """
+    Fits a compartmental model directly to the data (target analysis).
+
+    Instead of exponential decays, the base consists of the concentrations
+    of the compartments of a `kinetic_model.Model`, convolved with the
+    gaussian system response. The concentrations are given by a single
+    eigendecomposition of the K-matrix per parameter set, which turns
+    them into a sum of exponentials, so the existing folded exponentials
+    are used for the convolution. The species associated spectra (SAS)
+    are solved linearly and are found at `self.c`.
+
+    Parameters
+    ----------
+    tup : tuple
+        wl, t, data
+    model : kinetic_model.Model
+        The kinetic model.
+    y0 : ndarray or None
+        Starting concentrations of the compartments, defaults to
+        [1, 0, 0, ...].
+    model_coh : bool
+        If coherent artifacts are added to the base.
+    """
+
+    def __init__(self, tup, model, y0=None, model_coh=False):
+        super().__init__(tup, model_coh=model_coh, model_disp=1)
+        self.kin_model = model
+        self.compartments = model.get_compartments()
+        self.param_names = [str(p) for p in model.get_params()]
+        self.yield_names = [
+            str(t.qu_yield) for t in model.transitions
+            if not isinstance(t.qu_yield, numbers.Number)
+        ]
+        self.mat_func = model.build_mat_func()
+        n = len(self.compartments)
+        if y0 is None:
+            y0 = np.zeros(n)
+            y0[0] = 1
+        self.y0 = np.asarray(y0, dtype=float)
+        if self.y0.shape != (n, ):
+            raise ValueError('y0 must have one entry per compartment')
+
+    def concentrations(self, para):
+        """
+        Returns the concentrations of the compartments, convolved with the
+        system response.
+
+        Parameters
+        ----------
+        para : ndarray(N)
+            para has the form [x0, w, p_1, ... p_N], where p are the
+            parameters of the model in the order of `param_names`.
+
+        Returns
+        -------
+        ndarray(n_t, n_compartments)
+        """
+        x0, w = para[0], para[1]
+        K = np.array(self.mat_func(*para[2:]), dtype=float)
+        lam, vecs = np.linalg.eig(K)
+        if (np.any(abs(lam.imag) > 1e-8 * abs(lam).max())
+                or np.linalg.cond(vecs) > 1e10):
+            # Complex eigenvalues or a defective K-matrix, e.g. due to equal
+            # rates, are not representable by folded exponentials.
+            return self._concentrations_expm(K, x0, w)
+        lam, vecs = lam.real, vecs.real
+        a = np.linalg.solve(vecs, self.y0)
+        taus = np.full_like(lam, np.inf)
+        np.divide(-1, lam, out=taus, where=lam < 0)
+        decays = _fold_exp(self.t[:, None], w, x0, taus)[:, 0, :]
+        return (decays * a) @ vecs.T
+
+    def _concentrations_expm(self, K, x0, w):
+        """
+        Convolved concentrations for any K-matrix, using matrix exponentials.
+
+        With the gaussian system response g, the convolution of
+        ``expm(K*t) @ y0`` is ``expm(K*t) @ M(t)``, where ``M(t)`` is the
+        integral of ``g(u) * expm(-K*u) @ y0`` up to ``t``. Since g is
+        negligible beyond 6 w, M is integrated numerically on a fine grid.
+        """
+        from .kinetic_model import expm_batched
+        t = self.t - x0
+        out = np.zeros((t.size, K.shape[0]))
+        if w <= 0:
+            pos = t >= 0
+            out[pos] = expm_batched(K * t[pos, None, None]) @ self.y0
+            return out
+        u = np.linspace(-6 * w, 6 * w, 2001)
+        g = np.exp(-(u / w)**2) / (w * np.sqrt(np.pi))
+        integrand = (expm_batched(-K * u[:, None, None]) @ self.y0) * g[:, None]
+        steps = (integrand[1:] + integrand[:-1]) * (np.diff(u)[:, None] / 2)
+        M = np.concatenate((np.zeros((1, K.shape[0])), np.cumsum(steps, axis=0)))
+        inside = t > u[0]
+        M_t = np.column_stack([np.interp(t[inside], u, col) for col in M.T])
+        out[inside] = (expm_batched(K * t[inside, None, None]) @ M_t[:, :, None])[..., 0]
+        return out
+
+    def _build_xvec(self, para):
+        para = np.array(para, dtype=float)
+        self.num_exponentials = len(self.compartments)
+        last = getattr(self, '_xvec_para', None)
+        if (last is not None and last.shape == para.shape
+                and self._xvec_t is self.t and np.all(last == para)):
+            return
+        x_vec = self.concentrations(para)
+        if self.model_coh:
+            coh = _coh_gaussian(self.t[:, None], para[1], para[0])[:, 0, :]
+            x_vec = np.hstack((x_vec, coh))
+        self.x_vec = np.nan_to_num(x_vec)
+        self._xvec_para = para
+        self._xvec_t = self.t
+        self._gram = None
+        self._cho = None
+        self._aty = None
+
+    def jac(self, para, idx=None):
+        raise NotImplementedError('No analytic jacobian for target models')
+
+    def start_lmfit(self, x0, t0=0., w=0.1, fix_t0=True, fix_w=True,
+                    fixed_names=()):
+        """
+        Returns the lmfit.Minimizer for the target model.
+
+        Parameters
+        ----------
+        x0 : dict
+            Starting values of the model parameters, keyed by name.
+        t0, w : float
+            Starting values of the time-zero and the width of the system
+            response.
+        fix_t0, fix_w : bool
+            If to fix the time-zero and the width.
+        fixed_names : list of str
+            Names of model parameters which are not fitted.
+        """
+        missing = set(self.param_names) - set(x0)
+        if missing:
+            raise ValueError('No starting values for %s' % ', '.join(sorted(missing)))
+        p = lmfit.Parameters()
+        p.add('p0', t0, vary=not fix_t0)
+        p.add('w', w, min=0, vary=not fix_w)
+        for name in self.param_names:
+            p.add(name, x0[name], min=0, vary=name not in fixed_names)
+            if name in self.yield_names:
+                p[name].max = 1
+
+        def res(p):
+            x = [k.value for k in p.values()]
+            return self.res(x)
+
+        return lmfit.Minimizer(res, p)
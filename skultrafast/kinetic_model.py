@@ -71,12 +71,20 @@ class Model(object):
         self.mat = mat
         return mat
     
-    def build_mat_func(self):
+    def get_params(self):
+        """
+        Returns the free parameters of the model as sympy symbols, first the
+        rates and then the yields. This is also the order of the arguments
+        of the function returned by `build_mat_func`.
+        """
         # Use dict as an ordered set
-        rates = {t.rate: None for t in self.transitions}.keys()
-        yields = (t.qu_yield for t in self.transitions 
-                  if not isinstance(t.qu_yield, numbers.Number))        
-        params = list(rates) + list(yields)
+        rates = {t.rate: None for t in self.transitions}
+        yields = {t.qu_yield: None for t in self.transitions
+                  if not isinstance(t.qu_yield, numbers.Number)}
+        return list(rates) + list(yields)
+
+    def build_mat_func(self):
+        params = self.get_params()
         K = self.build_matrix()
         K_func = sympy.lambdify(params, K)
         return K_func
@@ -95,18 +103,88 @@ class Model(object):
             eqs.append(sympy.Eq(sympy.diff(funcs[i]), row.sum()))
         print(eqs)
 
+    def _get_trans_func(self):
+        """
+        Returns the compiled K-matrix as a function of the rates in the
+        order of `get_symbols` and the indices of their first occurrence.
+        The function is cached until the transitions change.
+        """
+        key = tuple(map(id, self.transitions))
+        if getattr(self, '_trans_func_key', None) != key:
+            symbols = get_symbols(self.transitions)
+            unique = list(dict.fromkeys(symbols))
+            first_idx = [symbols.index(s) for s in unique]
+            func = sympy.lambdify(unique, self.build_matrix())
+            self._trans_func = func, first_idx
+            self._trans_func_key = key
+        return self._trans_func
+
     def get_trans(self, y0, taus, t):
         """
-        Return the solution
+        Return the solution of the model for the starting concentrations
+        y0, the rates of the transitions, taus, at times t.
+
+        The K-matrix is diagonalized once and all time points are evaluated
+        at once. For defective matrices, e.g. equal rates in a sequential
+        model, a batched matrix exponential is used instead.
+
+        Returns
+        -------
+        ndarray(len(t), n_compartments)
         """
-        symbols = get_symbols(self.transitions)
-        k = np.array(self.mat.subs(zip(symbols, taus))).astype('float')
-        o = np.zeros((len(t), k.shape[0]))
+        func, first_idx = self._get_trans_func()
+        k = np.array(func(*np.asarray(taus, dtype=float)[first_idx]), dtype=float)
+        y0 = np.asarray(y0, dtype=float).reshape(k.shape[0])
+        t = np.asarray(t, dtype=float)
+
+        lam, vecs = np.linalg.eig(k)
+        if np.linalg.cond(vecs) < 1e8:
+            a = np.linalg.solve(vecs, y0)
+            o = (np.exp(np.multiply.outer(t, lam)) * a) @ vecs.T
+            return o.real
+        else:
+            return expm_batched(k[None, :, :] * t[:, None, None]) @ y0
+
+
+# Coefficients of the (13, 13) Pade approximant, see Higham (2005).
+_pade13 = (64764752532480000., 32382376266240000., 7771770303897600.,
+           1187353796428800., 129060195264000., 10559470521600.,
+           670442572800., 33522128640., 1323241920., 40840800., 960960.,
+           16380., 182., 1.)
 
-        for i in range(t.shape[0]):
-            o[i, :] = la.expm(k * t[i]).dot(y0)[:, 0]
 
-        return o
+def expm_batched(A):
+    """
+    Matrix exponential of a stack of matrices, calculated by a (13, 13) Pade
+    approximant with scaling and squaring. All matrices are treated at once.
+
+    Parameters
+    ----------
+    A : ndarray(m, n, n)
+        The matrices.
+
+    Returns
+    -------
+    ndarray(m, n, n)
+    """
+    b = _pade13
+    with np.errstate(divide='ignore'):
+        norm = abs(A).sum(-2).max(-1)
+        s = np.maximum(0, np.ceil(np.log2(norm / 5.371920351148152))).astype(int)
+    A = A / (2.**s)[:, None, None]
+    ident = np.eye(A.shape[-1])
+    A2 = A @ A
+    A4 = A2 @ A2
+    A6 = A4 @ A2
+    U = A @ (A6 @ (b[13]*A6 + b[11]*A4 + b[9]*A2)
+             + b[7]*A6 + b[5]*A4 + b[3]*A2 + b[1]*ident)
+    V = (A6 @ (b[12]*A6 + b[10]*A4 + b[8]*A2)
+         + b[6]*A6 + b[4]*A4 + b[2]*A2 + b[0]*ident)
+    E = np.linalg.solve(V - U, V + U)
+    for i in range(s.max(initial=0)):
+        sq = s > i
+        E[sq] = E[sq] @ E[sq]
+    return E
 
 
 def get_comparments(list_trans):
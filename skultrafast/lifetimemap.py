@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import attr
+import numba
 import numpy as np
-from typing import Tuple, List, Iterable
+from typing import Tuple, List, Iterable, Optional
 from sklearn import linear_model as lm
 from skultrafast.base_funcs.base_functions_np import _fold_exp, _coh_gaussian
 
@@ -94,3 +96,270 @@ def start_ltm_multi(tup, taus, w=0.1, alpha=0.001, **kwargs):
     fit = mod.predict(X)
     coefs = mod.coef_
     return mod, coefs, fit, None
+
+
+@attr.s(auto_attribs=True)
+class LTMPath:
+    """Result of `ltm_path`."""
+    alphas: np.ndarray
+    """The regularization path, decreasing"""
+    coef_path: np.ndarray
+    """Coefficients for all alphas, shape (n_alphas, n_basis, n_channels)"""
+    intercept_path: np.ndarray
+    """Intercepts for all alphas, shape (n_alphas, n_channels)"""
+    gcv: np.ndarray
+    """Generalized cross-validation score, shape (n_alphas, n_channels)"""
+    best_idx: np.ndarray
+    """Index of the selected alpha of each channel"""
+    coefs: np.ndarray
+    """Coefficients at the selected alphas, shape (n_basis, n_channels)"""
+    fit: np.ndarray
+    """The fit at the selected alphas"""
+
+    @property
+    def alpha(self) -> np.ndarray:
+        """The selected alpha of each channel"""
+        return self.alphas[self.best_idx]
+
+
+def ltm_path(tup,
+             taus,
+             w=0.1,
+             add_coh=False,
+             add_const=False,
+             alphas=None,
+             n_alphas=50,
+             l1_ratio=0.98,
+             max_iter=10000,
+             tol=1e-4) -> LTMPath:
+    """Calculates the lifetime density map for a whole regularization path
+    and selects the alpha of each channel by generalized cross-validation
+    (GCV).
+
+    Solves the same elastic net problem as `start_ltm`, but for all channels
+    at once: the Gram matrix of the basis is calculated once and the
+    coordinate descent runs in parallel over the channels, warm-started from
+    the solution of the previous alpha. The degrees of freedom for the GCV
+    are estimated by the number of non-zero coefficients.
+
+    Parameters
+    ----------
+    tup : datatuple
+        tuple with wl, t, data
+    taus : list of floats
+        Used to build the basis vectors.
+    w, add_coh, add_const :
+        See `start_ltm`. Without a constant, an intercept is fitted.
+    alphas : array or None
+        The regularization factors. If None, `n_alphas` logarithmically
+        spaced values from the smallest alpha giving all zero coefficients
+        down to 1e-3 of it are used.
+    n_alphas : int
+        Length of the automatic path.
+    l1_ratio : float
+        Mixing of the l1 and the l2 penalty as in sklearn's `ElasticNet`.
+    max_iter : int
+        Maximum number of coordinate descent sweeps per alpha.
+    tol : float
+        Tolerance of the duality gap, as in sklearn.
+
+    Returns
+    -------
+    LTMPath
+        The path, the GCV scores and the solution at the selected alphas.
+    """
+    X = _make_base(tup, taus, w=w, add_const=add_const, add_coh=add_coh)
+    Y = np.asarray(tup.data, dtype=float)
+    n = X.shape[0]
+    fit_intercept = not add_const
+    if fit_intercept:
+        x_mean, y_mean = X.mean(0), Y.mean(0)
+        Xc, Yc = X - x_mean, Y - y_mean
+    else:
+        x_mean, y_mean = np.zeros(X.shape[1]), np.zeros(Y.shape[1])
+        Xc, Yc = X, Y
+    G = Xc.T @ Xc
+    Q = Xc.T @ Yc
+    yy = np.einsum('ij,ij->j', Yc, Yc)
+
+    if alphas is None:
+        alpha_max = np.abs(Q).max() / (n*l1_ratio)
+        alphas = np.geomspace(alpha_max, alpha_max * 1e-3, n_alphas)
+    alphas = np.sort(np.atleast_1d(alphas))[::-1]
+
+    B = np.zeros_like(Q)
+    coef_path = np.empty((alphas.size, ) + Q.shape)
+    gcv = np.empty((alphas.size, Q.shape[1]))
+    for i, alpha in enumerate(alphas):
+        _enet_cd_gram(G, Q, yy, B, n * alpha * l1_ratio, n * alpha * (1-l1_ratio),
+                      max_iter, tol)
+        coef_path[i] = B
+        rss = yy - 2 * np.einsum('ij,ij->j', B, Q) + np.einsum('ij,ij->j', B, G @ B)
+        df = (B != 0).sum(0) + fit_intercept
+        with np.errstate(divide='ignore'):
+            gcv[i] = np.maximum(rss, 0) / n / (1 - df/n)**2
+    intercept_path = y_mean - np.einsum('j,ajk->ak', x_mean, coef_path)
+    best = np.argmin(gcv, 0)
+    ch = np.arange(Q.shape[1])
+    coefs = coef_path[best, :, ch].T
+    fit = X @ coefs + intercept_path[best, ch]
+    return LTMPath(alphas, coef_path, intercept_path, gcv, best, coefs, fit)
+
+
+@attr.s(auto_attribs=True)
+class TikhonovPath(LTMPath):
+    """Result of `ltm_tikhonov`. The gcv attribute contains the GCV-curve."""
+    residual_norm: np.ndarray
+    """Norm of the residuals, shape (n_alphas, n_channels)"""
+    solution_norm: np.ndarray
+    """Norm of the coefficients, shape (n_alphas, n_channels). Together with
+    the residual norm, it gives the L-curve."""
+
+
+def ltm_tikhonov(tup,
+                 taus,
+                 w=0.1,
+                 add_coh=False,
+                 add_const=False,
+                 alphas=None,
+                 n_alphas=50,
+                 select='gcv') -> TikhonovPath:
+    """Calculates Tikhonov-regularized lifetime density maps,
+
+        min ||y - X b||^2 + alpha ||b||^2,
+
+    for all channels and all alphas in closed form from a single SVD of the
+    basis X = U S V^T. The solutions are b = V diag(f/s) U^T y with the filter
+    factors f = s^2 / (s^2 + alpha).
+
+    Parameters
+    ----------
+    tup : datatuple
+        tuple with wl, t, data
+    taus : list of floats
+        Used to build the basis vectors.
+    w, add_coh, add_const :
+        See `start_ltm`. Without a constant, an intercept is fitted.
+    alphas : array or None
+        The regularization factors. If None, `n_alphas` logarithmically
+        spaced values between the largest and the smallest squared singular
+        value of the basis, at most 1e10 apart, are used.
+    n_alphas : int
+        Length of the automatic path.
+    select : {'gcv', 'lcurve'}
+        How the alpha of each channel is selected: by the minimum of the
+        generalized cross-validation or by the corner of the L-curve, the
+        point of maximum curvature.
+
+    Returns
+    -------
+    TikhonovPath
+        The path, the GCV- and L-curves and the solution at the selected
+        alphas.
+    """
+    X = _make_base(tup, taus, w=w, add_const=add_const, add_coh=add_coh)
+    Y = np.asarray(tup.data, dtype=float)
+    n = X.shape[0]
+    fit_intercept = not add_const
+    if fit_intercept:
+        x_mean, y_mean = X.mean(0), Y.mean(0)
+        Xc, Yc = X - x_mean, Y - y_mean
+    else:
+        x_mean, y_mean = np.zeros(X.shape[1]), np.zeros(Y.shape[1])
+        Xc, Yc = X, Y
+    U, s, Vt = np.linalg.svd(Xc, full_matrices=False)
+    UtY = U.T @ Yc
+    # Part of the data outside of the column space of the basis.
+    rest = np.maximum(np.einsum('ij,ij->j', Yc, Yc) - np.einsum('ij,ij->j', UtY, UtY), 0)
+
+    if alphas is None:
+        alphas = np.geomspace(s[0]**2, max(s[-1]**2, s[0]**2 * 1e-10), n_alphas)
+    alphas = np.sort(np.atleast_1d(alphas))[::-1]
+
+    f = s**2 / (s**2 + alphas[:, None])
+    coef_path = np.einsum('ij,aj,jk->aik', Vt.T, f / s, UtY)
+    intercept_path = y_mean - np.einsum('j,ajk->ak', x_mean, coef_path)
+    res_norm = np.sqrt(rest + np.einsum('aj,jk->ak', (1-f)**2, UtY**2))
+    sol_norm = np.sqrt(np.einsum('aj,jk->ak', (f / s)**2, UtY**2))
+    dof = n - f.sum(1) - fit_intercept
+    gcv = n * res_norm**2 / dof[:, None]**2
+
+    if select == 'gcv':
+        best = np.argmin(gcv, 0)
+    elif select == 'lcurve':
+        best = _lcurve_corner(np.log(res_norm), np.log(sol_norm))
+    else:
+        raise ValueError(f'Unknown selection: {select}')
+    ch = np.arange(Y.shape[1])
+    coefs = coef_path[best, :, ch].T
+    fit = X @ coefs + intercept_path[best, ch]
+    return TikhonovPath(alphas, coef_path, intercept_path, gcv, best, coefs, fit,
+                        res_norm, sol_norm)
+
+
+def _lcurve_corner(rho, eta):
+    """Index of the maximum curvature of the L-curves (rho, eta) along the
+    first axis, which has decreasing alphas. Hence the sign of the curvature
+    is flipped relative to the usual parametrization."""
+    d_rho, d_eta = np.gradient(rho, axis=0), np.gradient(eta, axis=0)
+    dd_rho, dd_eta = np.gradient(d_rho, axis=0), np.gradient(d_eta, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kappa = (dd_rho*d_eta - d_rho*dd_eta) / (d_rho**2 + d_eta**2)**1.5
+    return np.argmax(np.nan_to_num(kappa, nan=-np.inf), 0)
+
+
+@numba.njit(parallel=True, cache=True)
+def _enet_cd_gram(G, Q, yy, B, l1, l2, max_iter, tol):
+    """Coordinate descent for the elastic net using the Gram matrix G, the
+    correlations Q and the squared norms yy of all channels. B contains the
+    starting values and is updated in place. Parallel over the channels.
+
+    As in sklearn, the duality gap is checked when the largest relative
+    change of a coefficient is below tol and the iteration stops if the gap
+    is below tol * yy. After each sweep over all coefficients, only the
+    non-zero ones are updated until they converge."""
+    p, m = Q.shape
+    for c in numba.prange(m):
+        b = B[:, c].copy()
+        q = Q[:, c].copy()
+        # r = q - G b, the correlation of the residual with the basis
+        r = q.copy()
+        for j in range(p):
+            if b[j] != 0:
+                for k in range(p):
+                    r[k] -= G[j, k] * b[j]
+        active_only = False
+        for _ in range(max_iter):
+            max_delta = 0.
+            max_b = 0.
+            for j in range(p):
+                if active_only and b[j] == 0:
+                    continue
+                z = r[j] + G[j, j] * b[j]
+                new = np.sign(z) * max(abs(z) - l1, 0.) / (G[j, j] + l2)
+                delta = new - b[j]
+                if delta != 0:
+                    for k in range(p):
+                        r[k] -= G[j, k] * delta
+                    b[j] = new
+                    max_delta = max(max_delta, abs(delta))
+                max_b = max(max_b, abs(new))
+            converged = max_delta <= tol * max_b
+            if converged and not active_only:
+                if _enet_gap(b, r, q, yy[c], l1, l2) <= tol * yy[c]:
+                    break
+            active_only = converged and not active_only
+        B[:, c] = b
+
+
+@numba.njit(cache=True)
+def _enet_gap(b, r, q, yy, l1, l2):
+    """Duality gap of the elastic net, see sklearn's
+    enet_coordinate_descent_gram."""
+    b_q = b @ q
+    r_norm2 = yy - b_q - b @ r
+    dual_norm = np.abs(r - l2*b).max()
+    const = l1 / dual_norm if dual_norm > l1 else 1.
+    gap = 0.5 * r_norm2 * (1 + const**2)
+    gap += l1 * np.abs(b).sum() - const*yy + const*b_q + 0.5 * l2 * (1 + const**2) * (b@b)
+    return gap
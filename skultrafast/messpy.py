@@ -9,11 +9,12 @@ from scipy.ndimage import gaussian_filter1d
 from scipy.stats import trim_mean
 from typing import Callable, Literal, Tuple, Union, Optional, no_type_check, Dict
 import h5py
+import scipy.fft
 
 from skultrafast.dataset import TimeResSpec, PlotterMixin, PolTRSpec
 from skultrafast.twoD_dataset import TwoDim
 from skultrafast import plot_helpers as ph
-from skultrafast.utils import sigma_clip, gauss_step, poly_bg_correction
+from skultrafast.utils import sigma_clip_stats, gauss_step, poly_bg_correction
 from skultrafast.dv import make_fi, subtract_background
 from skultrafast.unit_conversions import THz2cm
 
@@ -55,12 +56,10 @@ class MessPy2File:
             n_ir_cwl = data_file['wl_Remote IR 32x2'].shape[0]
             para_idx = np.repeat(np.array([False, True], dtype='bool'), n_ir_cwl)
 
-        dpm = sigma_clip(d[para_idx, ...], axis=0, sigma=sigma, max_iter=10)
-        dsm = sigma_clip(d[~para_idx, ...], axis=0, sigma=sigma, max_iter=10)
-        dp = dpm.mean(0)
-        dps = dpm.std(0)
-        ds = dsm.mean(0)
-        dss = dsm.std(0)
+        dp, dps, _, _ = sigma_clip_stats(d[para_idx, ...], axis=0, sigma=sigma,
+                                         max_iter=10)
+        ds, dss, _, _ = sigma_clip_stats(d[~para_idx, ...], axis=0, sigma=sigma,
+                                         max_iter=10)
 
         para = TimeResSpec(wls, t, dp[0, :, 0, ...], freq_unit='nm', disp_freq_unit='nm')
         perp = TimeResSpec(wls, t, ds[0, :, 0, ...], freq_unit='nm', disp_freq_unit='nm')
@@ -86,10 +85,8 @@ class MessPy2File:
         wli = 1e7 / wli
         d = data_file['data_Remote IR 32x2'][min_scans:max_scans]
         print(d.shape)
-        dp = sigma_clip(d[1::2, ...], axis=0, sigma=sigma)
-        dpm = dp.mean(0)
-        ds = sigma_clip(d[0::2, ...], axis=0, sigma=sigma)
-        dsm = ds.mean(0)
+        dpm = sigma_clip_stats(d[1::2, ...], axis=0, sigma=sigma)[0]
+        dsm = sigma_clip_stats(d[0::2, ...], axis=0, sigma=sigma)[0]
 
         if subtract_background:
             dsm -= dsm[:, :10, ...].mean(1, keepdims=True)
@@ -128,6 +125,119 @@ class MessPy2File:
         return both
 
 
+class ScanAverager:
+    def __init__(self, sigma: float = 3, n_warmup: int = 5):
+        """
+        Averages scans one at a time, without keeping them in memory. The
+        first `n_warmup` scans are collected to initialize the median and the
+        median absolute deviation (MAD) of every point. Afterwards, each new
+        value further away than `sigma` times the scale from the median is
+        rejected, as are nans. The scale is the larger of the robust standard
+        deviation, 1.4826 MAD, and the standard deviation of the accepted
+        values, which guards against a vanishing MAD of few or quantized
+        scans. The median and the MAD are tracked approximately by
+        stochastic approximation, while the mean and variance of the
+        accepted values are updated with Welford's algorithm.
+
+        Parameters
+        ----------
+        sigma : float
+            Rejection threshold in units of the scale.
+        n_warmup : int
+            Number of scans used for the initialization, at least 3.
+
+        Attributes
+        ----------
+        median, mad : ndarray
+            Running estimates of the median and the MAD of all values. Only
+            available after the warm-up.
+        n_scans : int
+            Number of added scans.
+        """
+        if n_warmup < 3:
+            raise ValueError('n_warmup must be at least 3')
+        self.sigma = sigma
+        self.n_warmup = n_warmup
+        self.n_scans = 0
+        self._buffer = []
+
+    def add(self, scan: np.ndarray):
+        """Adds a single scan."""
+        scan = np.asarray(scan, dtype=float)
+        self.n_scans += 1
+        if self._buffer is not None:
+            self._buffer.append(scan)
+            if len(self._buffer) == self.n_warmup:
+                self._stats, self.median, self.mad = self._warm_up()
+                self._buffer = None
+            return
+
+        n = self.n_scans
+        dev = scan - self.median
+        count, _, m2 = self._stats
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.fmax(1.4826 * self.mad, np.sqrt(m2 / (count-1)))
+            accept = np.abs(dev) <= self.sigma * scale
+            # Robbins-Monro steps towards the median of the values and the
+            # median of their absolute deviations.
+            step = np.where(np.isfinite(scan), 2 * scale / n, 0)
+            self.median += step * np.sign(np.nan_to_num(dev))
+            self.mad += step * np.sign(np.nan_to_num(np.abs(dev) - self.mad))
+        self._stats = _welford(scan, accept, *self._stats)
+
+    def _warm_up(self):
+        data = np.stack(self._buffer, -1)
+        median = np.nanmedian(data, -1)
+        # The MAD of few samples is biased low, corrected as in Croux and
+        # Rousseeuw (1992).
+        n = np.isfinite(data).sum(-1)
+        mad = np.nanmedian(np.abs(data - median[..., None]), -1) * n / (n-0.8)
+        stats = np.zeros((3,) + median.shape)
+        for scan in self._buffer:
+            with np.errstate(invalid='ignore'):
+                accept = np.abs(scan - median) <= self.sigma * 1.4826 * mad
+            stats = _welford(scan, accept, *stats)
+        return stats, median, mad
+
+    def _current_stats(self):
+        if self._buffer is None:
+            return self._stats
+        if len(self._buffer) >= 3:
+            return self._warm_up()[0]
+        # Too few scans for the outlier rejection, just skip the nans.
+        stats = np.zeros((3,) + self._buffer[0].shape)
+        for scan in self._buffer:
+            stats = _welford(scan, np.isfinite(scan), *stats)
+        return stats
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of accepted values."""
+        return self._current_stats()[0]
+
+    @property
+    def mean(self) -> np.ndarray:
+        """Mean of the accepted values."""
+        return self._current_stats()[1]
+
+    @property
+    def std(self) -> np.ndarray:
+        """Standard deviation of the accepted values."""
+        count, _, m2 = self._current_stats()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(m2 / (count-1))
+
+
+def _welford(x, accept, count, mean, m2):
+    """Updates count, mean and the sum of squared deviations with the
+    accepted values of x."""
+    count = count + accept
+    delta = np.where(accept, x - mean, 0)
+    mean = mean + np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+    m2 = m2 + np.where(accept, delta * (x-mean), 0)
+    return count, mean, m2
+
+
 class MessPyFile:
     def __init__(
         self,
@@ -213,80 +323,154 @@ class MessPyFile:
             sub_data = self.data
         else:
             sub_data = self.data[..., min_scan:max_scan]
-        num_wls = self.data.shape[0]
-        t = self.t
         if disp_freq_unit is None:
             disp_freq_unit = "nm" if self.wl.shape[0] > 32 else "cm"
         kwargs = dict(disp_freq_unit=disp_freq_unit)
 
         if not self.is_pol_resolved:
-            data = sigma_clip(sub_data, sigma=sigma, max_iter=max_iter, axis=-1)
-            mean = data.mean(-1)
-            std = data.std(-1)
-            err = std / np.sqrt((~data.mask).sum(-1))
+            mean, std, count, _ = sigma_clip_stats(sub_data, sigma=sigma,
+                                                   max_iter=max_iter, axis=-1)
+            err = std / np.sqrt(count)
 
             if self.valid_channel in [0, 1]:
                 mean = mean[..., self.valid_channel]
-                std = std[..., self.valid_channel]
                 err = err[..., self.valid_channel]
-
-                out = {}
-
-                if num_wls > 1:
-                    for i in range(num_wls):
-                        ds = TimeResSpec(self.wl[:, i], t, mean[i, ..., :], err[i, ...],
-                                         **kwargs)
-                        out[self.pol_first_scan + str(i)] = ds
-                else:
-                    out = TimeResSpec(self.wl[:, 0], t, mean[0, ...], err[0, ...],
-                                      **kwargs)
-                return out
+                return self._make_datasets(kwargs, mean, err)
             else:
                 raise NotImplementedError("TODO")
 
         elif self.is_pol_resolved and self.valid_channel in [0, 1]:
             assert self.pol_first_scan in ["para", "perp"]
-            data1 = sigma_clip(sub_data[..., self.valid_channel, ::2],
-                               sigma=sigma,
-                               max_iter=max_iter,
-                               axis=-1)
-            mean1 = data1.mean(-1)
-            std1 = data1.std(-1, ddof=1)
-            err1 = std1 / np.sqrt(np.ma.count(data1, -1))
-
-            data2 = sigma_clip(sub_data[..., self.valid_channel, 1::2],
-                               sigma=sigma,
-                               max_iter=max_iter,
-                               axis=-1)
-            mean2 = data2.mean(-1)
-            std2 = data2.std(-1, ddof=1)
-            err2 = std2 / np.sqrt(np.ma.count(data2, -1))
-
-            out = {}
-            for i in range(num_wls):
-                wl, t = self.wl[:, i], self.t
-                if self.pol_first_scan == "para":
-                    para = mean1[i, ...]
-                    para_err = err1[i, ...]
-                    perp = mean2[i, ...]
-                    perp_err = err2[i, ...]
-                elif self.pol_first_scan == "perp":
-                    para = mean2[i, ...]
-                    para_err = err2[i, ...]
-                    perp = mean1[i, ...]
-                    perp_err = err1[i, ...]
-
-                para_ds = TimeResSpec(wl, t, para, para_err, **kwargs)
-                perp_ds = TimeResSpec(wl, t, perp, perp_err, **kwargs)
-                out["para" + str(i)] = para_ds
-                out["perp" + str(i)] = perp_ds
-                iso = 1/3*para + 2/3*perp
-                out["iso" + str(i)] = TimeResSpec(wl, t, iso, **kwargs)
+            mean1, std1, count1, _ = sigma_clip_stats(
+                sub_data[..., self.valid_channel, ::2],
+                sigma=sigma,
+                max_iter=max_iter,
+                axis=-1,
+                ddof=1)
+            err1 = std1 / np.sqrt(count1)
+
+            mean2, std2, count2, _ = sigma_clip_stats(
+                sub_data[..., self.valid_channel, 1::2],
+                sigma=sigma,
+                max_iter=max_iter,
+                axis=-1,
+                ddof=1)
+            err2 = std2 / np.sqrt(count2)
+
+            out = self._make_datasets(kwargs, mean1, err1, mean2, err2)
             self.av_scans_ = out
             return out
         else:
             raise NotImplementedError("Iso correction not supported yet.")
 
+    def _make_datasets(self, kwargs, mean1, err1, mean2=None, err2=None):
+        """
+        Builds the TimeResSpec of the averaged scans, see `average_scans`. The
+        arrays have the shape (cwl, t, pixel). If the second arrays are given,
+        they contain the scans with the second polarisation.
+        """
+        num_wls, t = mean1.shape[0], self.t
+        if mean2 is None:
+            if num_wls == 1:
+                return TimeResSpec(self.wl[:, 0], t, mean1[0, ...], err1[0, ...],
+                                   **kwargs)
+            out = {}
+            for i in range(num_wls):
+                ds = TimeResSpec(self.wl[:, i], t, mean1[i, ..., :], err1[i, ...],
+                                 **kwargs)
+                out[self.pol_first_scan + str(i)] = ds
+            return out
+
+        out = {}
+        for i in range(num_wls):
+            wl = self.wl[:, i]
+            if self.pol_first_scan == "para":
+                para = mean1[i, ...]
+                para_err = err1[i, ...]
+                perp = mean2[i, ...]
+                perp_err = err2[i, ...]
+            elif self.pol_first_scan == "perp":
+                para = mean2[i, ...]
+                para_err = err2[i, ...]
+                perp = mean1[i, ...]
+                perp_err = err1[i, ...]
+
+            para_ds = TimeResSpec(wl, t, para, para_err, **kwargs)
+            perp_ds = TimeResSpec(wl, t, perp, perp_err, **kwargs)
+            out["para" + str(i)] = para_ds
+            out["perp" + str(i)] = perp_ds
+            iso = 1/3*para + 2/3*perp
+            out["iso" + str(i)] = TimeResSpec(wl, t, iso, **kwargs)
+        return out
+
+    def stream_average(self,
+                       scans=None,
+                       sigma=3,
+                       n_warmup=5,
+                       every=1,
+                       min_scan=0,
+                       max_scan=None,
+                       disp_freq_unit=None):
+        """
+        Averages the scans one at a time with online outlier rejection, see
+        `ScanAverager`. Yields the intermediate averages, hence it can be
+        used to monitor a running measurement. For polarization resolved
+        measurements, the function assumes that the polarisation switches
+        every scan.
+
+        Parameters
+        ----------
+        scans : iterable of arrays or None
+            The scans, each of shape (cwl, t, pixel, channel). If None, the
+            scans in the file are used.
+        sigma : float
+            Values further away than sigma times the robust standard
+            deviation from the running median are rejected.
+        n_warmup : int
+            Number of scans used to initialize the median and the MAD.
+        every : int
+            Yield an average every `every` scans. The average of all scans is
+            always yielded at the end.
+        min_scan, max_scan : int or None
+            Only used if `scans` is None. Limits the used scans from the file.
+        disp_freq_unit : 'nm', 'cm' or None
+            Sets `disp_freq_unit` of the created datasets.
+
+        Yields
+        ------
+        dict or TimeResSpec
+            The averaged datasets, structured as in `average_scans`.
+        """
+        if self.valid_channel not in [0, 1]:
+            raise NotImplementedError("Only a single valid channel is supported.")
+        if self.is_pol_resolved:
+            assert self.pol_first_scan in ["para", "perp"]
+        if scans is None:
+            scans = np.moveaxis(self.data[..., min_scan:max_scan], -1, 0)
+        if disp_freq_unit is None:
+            disp_freq_unit = "nm" if self.wl.shape[0] > 32 else "cm"
+        kwargs = dict(disp_freq_unit=disp_freq_unit)
+
+        n_pol = 2 if self.is_pol_resolved else 1
+        avgs = [ScanAverager(sigma=sigma, n_warmup=n_warmup) for _ in range(n_pol)]
+
+        def make_out():
+            stats = []
+            for a in avgs:
+                if a.n_scans > 0:
+                    stats += [a.mean, a.std / np.sqrt(a.count)]
+                else:
+                    stats += [np.full_like(stats[0], np.nan)] * 2
+            return self._make_datasets(kwargs, *stats)
+
+        i = -1
+        for i, scan in enumerate(scans):
+            avgs[i % n_pol].add(np.asarray(scan)[..., self.valid_channel])
+            if (i+1) % every == 0:
+                yield make_out()
+        if i >= 0 and (i+1) % every != 0:
+            yield make_out()
+
     def recalculate_wavelengths(self, dispersion, center_ch=None, offset=0):
         """Recalculates the wavelengths, assuming linear dispersion.
         Currently assumes that the wavelength set by spectrometer is stored
@@ -461,16 +645,26 @@ class MessPyPlotter(PlotterMixin):
         ph.lbl_spec(ax)
 
 
+def _read_datasets(grp: h5py.Group, names, dtype=None) -> np.ndarray:
+    """Reads the datasets `names` of a group, which must have the same shape,
+    directly into one preallocated array. Uses the dtype of the first dataset
+    if dtype is None."""
+    first = grp[names[0]]
+    out = np.empty((len(names), *first.shape), dtype=dtype or first.dtype)
+    for k, name in enumerate(names):
+        grp[name].read_direct(out, dest_sel=np.s_[k])
+    return out
+
+
+def _scan_names(grp: h5py.Group):
+    """Returns the names of the scans in a group, sorted by number."""
+    return [str(s) for s in sorted(int(s) for s in grp.keys() if s != 'mean')]
+
+
 def _get_group_arr(grp: h5py.Group):
-    """Get array from group of datasets, assuming they are named 0, 1, 2, ... 
+    """Get array from group of datasets, assuming they are named 0, 1, 2, ...
     and have the same shape"""
-    keys = list(grp.keys())
-    n = len(keys)
-    dim = grp[keys[0]].shape
-    out = np.zeros((n, *dim))
-    for i in range(n):
-        out[i, ...] = grp[str(i)][:].astype(np.float32)
-    return out
+    return _read_datasets(grp, [str(i) for i in range(len(grp))], np.float32)
 
 
 @attr.define
@@ -522,30 +716,56 @@ class Messpy25File:
         return para_means, perp_means, 2/3*perp_means + 1/3*para_means
 
     def get_all_ifr(self):
+        """
+        Returns all interferogram scans as a dict of dicts, ``ifr[name][str(i)]``
+        being a float32 array of shape (n_scans, n_probe_wn, n_t1) for
+        waiting time i.
+        """
         ifr = {}
         for name, l in self.h5_file['ifr_data'].items():
             ifr[name] = {}
             for i in range(self.t2.size):
-                li = []
-                scans = [int(s) for s in l[str(i)].keys() if s != 'mean']
-                scans.sort()
-                for scan in scans:
-                    li.append(self.h5_file[f'ifr_data/{name}/{str(i)}/{scan}'][:])
-                ifr[name][str(i)] = li
+                grp = l[str(i)]
+                ifr[name][str(i)] = _read_datasets(grp, _scan_names(grp), np.float32)
         return ifr
 
-    def ifr_means_and_stderr(self):
-        ifr = self.get_all_ifr()
+    def ifr_means_and_stderr(self, block: int = 64):
+        """
+        Calculates the mean and standard error of the interferogram scans
+        for every waiting time. The scans are read in blocks of `block`
+        scans, so all scans are never in memory at once.
+
+        Returns
+        -------
+        means, stderr : dict of lists
+            ``means[name][i]`` is the mean over the scans of waiting time i.
+        """
         means = {}
         stderr = {}
-        for name in ifr:
-            for i in ifr[name]:
-                means[name] = []
-                stderr[name] = []
-                for i in range(self.t2.size):
-                    means[name].append(np.mean(ifr[name][str(i)], 0))
-                    stderr[name].append(
-                        np.std(ifr[name][str(i)], 0) / np.sqrt(len(ifr[name][str(i)])))
+        for name, l in self.h5_file['ifr_data'].items():
+            means[name] = []
+            stderr[name] = []
+            for i in range(self.t2.size):
+                grp = l[str(i)]
+                scans = _scan_names(grp)
+                shape = grp[scans[0]].shape
+                buf = np.empty((min(block, len(scans)), *shape), dtype=np.float32)
+                n, mean, m2 = 0, np.zeros(shape), np.zeros(shape)
+                for start in range(0, len(scans), block):
+                    names = scans[start:start + block]
+                    b = buf[:len(names)]
+                    for k, sn in enumerate(names):
+                        grp[sn].read_direct(b, dest_sel=np.s_[k])
+                    # Merge the statistics of the block, Chan et al.
+                    nb = len(names)
+                    mb = b.mean(0, dtype=float)
+                    m2b = ((b - mb)**2).sum(0)
+                    delta = mb - mean
+                    m2 += m2b + delta**2 * n * nb / (n+nb)
+                    mean += delta * nb / (n+nb)
+                    n += nb
+                means[name].append(mean)
+                stderr[name].append(np.sqrt(m2 / n) / np.sqrt(n))
         return means, stderr
 
     def get_ifr(self, probe_filter=None, bg_correct=None, ch_shift: int = 0):
@@ -566,16 +786,11 @@ class Messpy25File:
             The interferograms for paralllel, perpendicular and isotropic polarisation.
             The shape of each array is (n_t2, n_probe_wn, n_t1).
         """
-        ifr = {}
-        for name, l in self.h5_file['ifr_data'].items():
-            ifr[name] = []
-            for i in range(self.t2.size):
-                ifr[name].append(l[str(i)]['mean'])
         para = self.is_para_array
         perp = "Probe2" if self.is_para_array == "Probe1" else "Probe1"
-
-        para_means = np.stack(ifr[para], 0)
-        perp_means = np.stack(ifr[perp], 0)
+        names = [f'{i}/mean' for i in range(self.t2.size)]
+        para_means = _read_datasets(self.h5_file['ifr_data'][para], names, float)
+        perp_means = _read_datasets(self.h5_file['ifr_data'][perp], names, float)
         if probe_filter is not None:
             para_means = gaussian_filter1d(para_means, probe_filter, 1, mode='nearest')
             perp_means = gaussian_filter1d(perp_means, probe_filter, 1, mode='nearest')
@@ -624,23 +839,21 @@ class Messpy25File:
         means = self.get_ifr(probe_filter=probe_filter,
                              bg_correct=bg_correct,
                              ch_shift=ch_shift)
-        data = {pol: means[i] for i, pol in enumerate(['para', 'perp', 'iso'])}
-        out = {}
-        for k, v in data.items():
-            v[:, :, 0] *= 0.5
-            if window_fcn is not None:
-                v = v * window_fcn(v.shape[2] * 2)[None, None, v.shape[2]:]
-            sig = np.fft.rfft(v, axis=2, n=v.shape[2] * upsample).real
-            self.pump_wn = THz2cm(
-                np.fft.rfftfreq(upsample * v.shape[2],
-                                (self.t1[1] - self.t1[0]))) + self.rot_frame
-            if ch_shift >= 0:
-                probe_wn = self.probe_wn[ch_shift:]
-            elif ch_shift < 0:
-                probe_wn = self.probe_wn[:ch_shift]
-            ds = TwoDim(self.t2, self.pump_wn, probe_wn, sig)
-            out[k] = ds
-        return out
+        # All polarisations and waiting times are transformed at once.
+        v = np.stack(means, 0)
+        n_t1 = v.shape[3]
+        v[..., 0] *= 0.5
+        if window_fcn is not None:
+            v *= window_fcn(n_t1 * 2)[n_t1:]
+        sig = scipy.fft.rfft(v, axis=3, n=n_t1 * upsample, workers=-1).real
+        self.pump_wn = THz2cm(np.fft.rfftfreq(upsample * n_t1,
+                                              (self.t1[1] - self.t1[0]))) + self.rot_frame
+        if ch_shift >= 0:
+            probe_wn = self.probe_wn[ch_shift:]
+        elif ch_shift < 0:
+            probe_wn = self.probe_wn[:ch_shift]
+        return {pol: TwoDim(self.t2, self.pump_wn, probe_wn, sig[i])
+                for i, pol in enumerate(['para', 'perp', 'iso'])}
 
     def make_model_fitfiles(self, path, name, probe_filter=None, bg_correct=None):
         """
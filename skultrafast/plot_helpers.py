@@ -11,6 +11,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import skultrafast.dv as dv
 from skultrafast.unit_conversions import fs2cm
+from skultrafast.utils import svd
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from matplotlib.colors import Normalize, SymLogNorm
 import matplotlib.cbook as cbook
@@ -53,8 +54,11 @@ freq_unit = 'nm'
 line_width = 1
 
 
-def plot_singular_values(dat):
-    u, s, v = np.linalg.svd(dat)
+def plot_singular_values(dat, n=None, method='full'):
+    _plot_singular_values(svd(dat, n, method=method).s)
+
+
+def _plot_singular_values(s):
     plt.vlines(np.arange(len(s)), 0, s, lw=3)
     plt.plot(np.arange(len(s)), s, 'o')
 
@@ -120,13 +124,17 @@ def make_dual_axis(ax: plt.Axes = None, axis='x', unit='nm', minor_ticks=True):
         sub_axis.set_label('Wavenumber [1/cm]')
 
 
-def plot_svd_components(tup, n=4, from_t=None):
+def plot_svd_components(tup, n=4, from_t=None, method='full'):
     wl, t, d = tup.wl, tup.t, tup.data
     if from_t:
         idx = dv.fi(t, from_t)
         t = t[idx:]
         d = d[idx:, :]
-    u, s, v = np.linalg.svd(d)
+    if hasattr(tup, 'svd') and not from_t:
+        res = tup.svd(max(n, 30), method=method)
+    else:
+        res = svd(d, max(n, 30), method=method)
+    u, s, v = res.u, res.s, res.vt
     ax1: plt.Axes = plt.subplot(311)
     ax1.set_xlim(-1, t.max())
 
@@ -141,7 +149,7 @@ def plot_svd_components(tup, n=4, from_t=None):
         ax2.plot(wl, v[i])
     ax1.legend()
     plt.subplot(313)
-    plot_singular_values(d)
+    _plot_singular_values(s)
     plt.tight_layout()
 
 
@@ -1,14 +1,23 @@
 """
 Module to import and work with files generated by QuickControl from phasetech.
 """
+import json
+import multiprocessing
+import os
+import warnings
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Callable, Dict, Iterable, List, Optional, Sized, Tuple, Union
 
 import attr
+import h5py
 import numpy as np
+import scipy.fft
 from scipy.constants import speed_of_light
 from scipy.ndimage import gaussian_filter1d
 
+from skultrafast.data_io import read_scan
 from skultrafast.dataset import PolTRSpec, TimeResSpec
 from skultrafast.twoD_dataset import TwoDim
 from skultrafast.utils import poly_bg_correction, inbetween
@@ -45,6 +54,110 @@ def parse_str(s: str):
         return s
 
 
+@attr.s(auto_attribs=True)
+class ScanCache:
+    """
+    Binary cache of parsed scan files, stored in a compressed HDF5 file next
+    to the info file. Each entry is valid as long as the names, sizes and
+    modification times of its scan files are unchanged.
+    """
+    fname: Path
+    """Path of the cache file"""
+
+    enabled: bool = True
+    """Set to False if the cache can't be written"""
+
+    @staticmethod
+    def _signature(files: List[Path]) -> str:
+        stats = [(f.name, f.stat().st_mtime_ns, f.stat().st_size) for f in files]
+        return json.dumps(stats)
+
+    def load(self, key: str, files: List[Path]) -> Optional[np.ndarray]:
+        """Returns the cached array for key, None if missing or stale."""
+        if not self.enabled or not self.fname.exists():
+            return None
+        try:
+            with h5py.File(self.fname, 'r') as f:
+                if key in f and f[key].attrs['files'] == self._signature(files):
+                    return f[key][()]
+        except OSError:
+            pass
+        return None
+
+    def store(self, key: str, files: List[Path], arr: np.ndarray):
+        """Stores the array for key, replacing an old entry."""
+        if not self.enabled:
+            return
+        try:
+            with h5py.File(self.fname, 'a') as f:
+                if key in f:
+                    del f[key]
+                f.create_dataset(key, data=arr, compression='gzip', shuffle=True)
+                f[key].attrs['files'] = self._signature(files)
+        except OSError as e:
+            warnings.warn(f'Could not write scan cache {self.fname}: {e}')
+            self.enabled = False
+
+
+# Starting the worker processes takes a few tenths of a second, smaller sets
+# of files are parsed in the current process.
+_POOL_MIN_BYTES = 16 * 2**20
+
+
+def read_scans(files: List[Path],
+               cache: Optional[ScanCache] = None,
+               key: Optional[str] = None,
+               max_workers: Optional[int] = None) -> np.ndarray:
+    """
+    Reads scan files of equal shape into one array of shape (n_files, ...).
+    Since the parsing by `data_io.read_scan` holds the GIL, larger sets of
+    files are parsed in a pool of up to `max_workers` processes, which
+    defaults to the number of CPUs. The workers are spawned, so scripts
+    using it need an ``if __name__ == '__main__'`` guard. If a cache is
+    given, the result is taken from or written to it under `key`.
+    """
+    if cache is not None:
+        arr = cache.load(key, files)
+        if arr is not None:
+            return arr
+    n_workers = min(max_workers or os.cpu_count() or 1, len(files))
+    if n_workers > 1 and sum(f.stat().st_size for f in files) >= _POOL_MIN_BYTES:
+        # Forked workers can deadlock with the threads of numba or BLAS.
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(n_workers, mp_context=ctx) as ex:
+            arr = np.stack(list(ex.map(read_scan, files)))
+    else:
+        arr = np.stack([read_scan(f) for f in files])
+    if cache is not None:
+        cache.store(key, files, arr)
+    return arr
+
+
+class ScanStore(Mapping):
+    """
+    Read-only mapping from the waiting time index to the scans of that
+    waiting time, an array of shape (n_scans, n_rows, n_cols). The scans are
+    only read when accessed and are not kept in memory.
+    """
+
+    def __init__(self, files: Dict[int, List[Path]], which: str,
+                 cache: Optional[ScanCache] = None, max_workers: Optional[int] = None):
+        self.files = files
+        self.which = which
+        self.cache = cache
+        self.max_workers = max_workers
+
+    def __getitem__(self, t: int) -> np.ndarray:
+        return read_scans(self.files[t], self.cache, '%s_T%02d' % (self.which, t + 1),
+                          self.max_workers)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+
 @attr.s(auto_attribs=True)
 class QCFile:
     """
@@ -86,6 +199,22 @@ class QCBaserTimeRes(QCFile):
     wavelength: np.ndarray = attr.ib()
     """Wavelength data calculated from given grating and mono wavelength"""
 
+    use_cache: bool = True
+    """If True, the parsed scan files are cached next to the info file, see `ScanCache`."""
+
+    max_workers: Optional[int] = None
+    """Number of processes used to parse the scan files, see `read_scans`."""
+
+    @property
+    def scan_cache(self) -> Optional[ScanCache]:
+        """The cache of the parsed scan files, None if `use_cache` is False."""
+        if not self.use_cache:
+            return None
+        return ScanCache(self.path / (self.prefix + '_scans.h5'))
+
+    def _scan_files(self, pattern: str) -> List[Path]:
+        return sorted(self.path.glob(self.prefix + pattern))
+
     @wavelength.default
     def calc_wl(self, disp=None):
         if disp is None:
@@ -116,13 +245,13 @@ class QC1DSpec(QCBaserTimeRes):
 
     @par_data.default
     def _load_par(self):
-        par_scan_files = self.path.glob(self.prefix + '*_PAR*.scan')
-        return np.array([np.loadtxt(p)[:-1, 1:] for p in par_scan_files])
+        files = self._scan_files('*_PAR*.scan')
+        return read_scans(files, self.scan_cache, 'PAR', self.max_workers)[:, :-1, 1:]
 
     @per_data.default
     def _load_per(self):
-        per_scan_files = self.path.glob(self.prefix + '*_PER*.scan')
-        return np.array([np.loadtxt(p)[:-1, 1:] for p in per_scan_files])
+        files = self._scan_files('*_PER*.scan')
+        return read_scans(files, self.scan_cache, 'PER', self.max_workers)[:, :-1, 1:]
 
     @t.default
     def _t_default(self):
@@ -148,17 +277,18 @@ class QC2DSpec(QCBaserTimeRes):
     t2: np.ndarray = attr.ib()
     """t2, the inter-pulse delays between pump pulses"""
 
-    par_data: Dict = attr.ib()
-    """Data for parallel polarization"""
+    par_data: Mapping = attr.ib()
+    """Data for parallel polarization. Maps the waiting time index to the
+    scans, which are read on access, see `ScanStore`."""
 
-    per_data: Dict = attr.ib()
-    """Data for perpendicular polarization"""
+    per_data: Mapping = attr.ib()
+    """Data for perpendicular polarization, see `par_data`"""
 
-    par_spec: Optional[Dict] = None
-    """Resulting 2D spectra for parallel polarization"""
+    par_spec: Optional[np.ndarray] = None
+    """Resulting 2D spectra for parallel polarization, shape (n_t, n_pump, n_probe)"""
 
-    per_spec: Optional[Dict] = None
-    """Resulting 2D spectra for perpendicular polarization"""
+    per_spec: Optional[np.ndarray] = None
+    """Resulting 2D spectra for perpendicular polarization, shape (n_t, n_pump, n_probe)"""
 
     probe_filter: Optional[float] = None
     """Size of the filter applied to the spectral axis. 'None' is no filtering"""
@@ -196,53 +326,67 @@ class QC2DSpec(QCBaserTimeRes):
         step = self.info['Step Size (fs)']
         return np.arange(0.0, end + 1, step) / 1000.
 
-    def _loader(self, which: str):
-        data_dict: Dict[int, np.ndarray] = {}
-
+    def _loader(self, which: str) -> ScanStore:
+        files: Dict[int, List[Path]] = {}
         for t in range(len(self.t)):
             T = '_T%02d' % (t+1)
-            pol_scans = self.path.glob(self.prefix + T + f'_{which}*.scan')
-            data = []
-            for s in pol_scans:
-
-                d = np.loadtxt(s)
-                self.t2 = d[1:, 0]
-                data.append(d)
-            if len(data) > 0:
-                d = np.array(data)
-                data_dict[t] = d
+            pol_scans = self._scan_files(T + f'_{which}*.scan')
+            if len(pol_scans) > 0:
+                files[t] = pol_scans
             else:
-                self.t = self.t[:t + 1]
+                self.t = self.t[:t]
                 break
-        return data_dict
+        if files:
+            self.t2 = read_scan(files[0][0])[1:, 0]
+        return ScanStore(files, which, self.scan_cache, self.max_workers)
 
     def switch_pol(self):
         self.par_data, self.per_data = self.per_data, self.par_data
         self.par_spec, self.per_spec = self.per_spec, self.par_spec
 
-    def calc_spec(self):
-        par_dict: Dict[int, np.ndarray] = {}
-        perp_dict: Dict[int, np.ndarray] = {}
+    def calc_spec(self, complex_spec: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates the 2D spectra of both polarizations for all waiting
+        times. After averaging the scans, all spectra are processed at once:
+        filtering, background correction, apodization and the FFT along t2.
+
+        Parameters
+        ----------
+        complex_spec : bool
+            If True, return the complex spectra, e.g. for phasing. Otherwise
+            only the real part.
+
+        Returns
+        -------
+        par_spec, per_spec : ndarray
+            Arrays of shape (n_t, n_pump, n_probe). Also saved in `par_spec`
+            and `per_spec`.
+        """
+        n_t = len(self.par_data)
+        first = self.par_data[0]
+        means = np.empty((2, n_t) + first.shape[1:])
         for i, data in enumerate((self.par_data, self.per_data)):
-            for t in data:
-                d = np.nanmean(data[t], 0)
-                d = d[:-1, 1:]
-
-                if self.probe_filter is not None:
-                    d = gaussian_filter1d(d, self.probe_filter, -1, mode='nearest')
-                if self.bg_correct:
-                    poly_bg_correction(self.wavelength, d,
-                                       self.bg_correct[0], self.bg_correct[1])
-                d[0, :] *= 0.5
-                if self.win_function is not None:
-                    win = self.win_function(2 * len(self.t2))
-                else:
-                    win = np.ones(2 * len(self.t2))
-                spec = np.fft.rfft(d * win[len(self.t2):, None],
-                                   axis=0,
-                                   n=self.upsampling * len(self.t2))
-                (par_dict, perp_dict)[i][t] = spec.real
-        return par_dict, perp_dict
+            for t in range(n_t):
+                scans = first if i == 0 and t == 0 else data[t]
+                means[i, t] = np.nanmean(scans, 0)
+        d = means[..., :-1, 1:]
+        if self.probe_filter is not None:
+            d = gaussian_filter1d(d, self.probe_filter, -1, mode='nearest')
+        else:
+            d = np.ascontiguousarray(d)
+        if self.bg_correct:
+            # Works inplace on the reshaped view.
+            poly_bg_correction(self.wavelength, d.reshape(-1, d.shape[-1]),
+                               self.bg_correct[0], self.bg_correct[1])
+        n_t2 = d.shape[-2]
+        d[..., 0, :] *= 0.5
+        if self.win_function is not None:
+            d *= self.win_function(2 * n_t2)[n_t2:, None]
+        spec = scipy.fft.rfft(d, axis=-2, n=self.upsampling * n_t2, workers=-1)
+        if not complex_spec:
+            spec = spec.real
+        self.par_spec, self.per_spec = spec[0], spec[1]
+        return spec[0], spec[1]
 
     @par_data.default
     def _load_par(self):
@@ -262,8 +406,9 @@ class QC2DSpec(QCBaserTimeRes):
     def make_ds(self) -> Dict[str, TwoDim]:
         par, perp = self.calc_spec()
         self.pump_freq = self._calc_freqs()
-        par_arr = np.dstack(list(par.values())).T
-        per_arr = np.dstack(list(perp.values())).T
+        # TwoDim expects (t, probe, pump), the transposes are only views.
+        par_arr = par.transpose(0, 2, 1)
+        per_arr = perp.transpose(0, 2, 1)
         iso = (2*per_arr + par_arr) / 3
 
         d = {
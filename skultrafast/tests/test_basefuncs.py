@@ -52,6 +52,37 @@ def test_compare_fold_funcs():
     np.testing.assert_array_almost_equal(y1, y3, 3)
 
 
+@pytest.mark.parametrize('mod', [bnp, bnb])
+def test_fold_exp_grad(mod):
+    taus = np.array([1., 20.])
+    t_array = np.subtract.outer(np.linspace(-2, 50, 300), np.linspace(-1, 3, 4))
+    w, tz, eps = 0.3, 0.2, 1e-6
+    y, dtau, dw, dtz = mod._fold_exp_grad(t_array, w, tz, taus)
+    np.testing.assert_array_almost_equal(y, mod._fold_exp(t_array, w, tz, taus))
+    num_dw = (mod._fold_exp(t_array, w + eps, tz, taus) -
+              mod._fold_exp(t_array, w - eps, tz, taus)) / (2 * eps)
+    num_dtz = (mod._fold_exp(t_array, w, tz + eps, taus) -
+               mod._fold_exp(t_array, w, tz - eps, taus)) / (2 * eps)
+    num_dtau = (mod._fold_exp(t_array, w, tz, taus + eps) -
+                mod._fold_exp(t_array, w, tz, taus - eps)) / (2 * eps)
+    np.testing.assert_array_almost_equal(dw, num_dw, 5)
+    np.testing.assert_array_almost_equal(dtz, num_dtz, 5)
+    np.testing.assert_array_almost_equal(dtau, num_dtau, 5)
+
+
+@pytest.mark.parametrize('mod', [bnp, bnb])
+def test_coh_gaussian_grad(mod):
+    t_array = np.subtract.outer(np.linspace(-1, 1, 301), np.linspace(0, 0.2, 3))
+    w, tz, eps = 0.2, 0.05, 1e-7
+    dw, dtz = mod._coh_gaussian_grad(t_array, w, tz)
+    num_dw = (mod._coh_gaussian(t_array, w + eps, tz) -
+              mod._coh_gaussian(t_array, w - eps, tz)) / (2 * eps)
+    num_dtz = (mod._coh_gaussian(t_array, w, tz + eps) -
+               mod._coh_gaussian(t_array, w, tz - eps)) / (2 * eps)
+    np.testing.assert_allclose(dw, num_dw, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(dtz, num_dtz, rtol=1e-5, atol=1e-5)
+
+
 @pytest.mark.skip
 def test_compare_coh_funcs():
     t_array = np.subtract.outer(np.linspace(-4, 4, 300), np.linspace(3, 3, 400))
@@ -1,4 +1,5 @@
 """Here we mostly test if it works at all."""
+import pytest
 from skultrafast.dataset import TimeResSpec, PolTRSpec
 from skultrafast.data_io import load_example
 import numpy as np
@@ -48,6 +49,109 @@ def test_fitter():
     out = ds.fit_exp(x0)
 
 
+def test_fitter_cache():
+    from skultrafast.fitter import Fitter
+    p = np.array([0.1, 0.12, 1.3, 30, 1000])
+    f = Fitter((wl, t, data), model_coh=True)
+    f.res(p)
+    for i in [2, 3, 3, 0]:
+        p[i] *= 1.01
+        f2 = Fitter((wl, t, data), model_coh=True)
+        assert_almost_equal(f.res(p), f2.res(p))
+        assert_almost_equal(f.x_vec, f2.x_vec)
+
+
+def test_fitter_full_model():
+    from skultrafast.fitter import Fitter, solve_mat
+    p = np.array([0.1, 0.2, 0.12, 1.3, 30, 1000])
+    f = Fitter((wl, t, data), model_coh=True, model_disp=2)
+    for method in ['ridge', 'fast', 'qr']:
+        f.lsq_method = method
+        res = f.full_res(p)
+        assert res.shape == (data.size, )
+        for i in [0, 400]:
+            c = solve_mat(f.xmat[:, i], data[:, i],
+                          method if method != 'qr' else 'cho')
+            assert_almost_equal(f.c[i], c, 5)
+
+
+def test_solve_mat_batched_singular():
+    from skultrafast.fitter import solve_mat_batched
+    A = np.random.rand(50, 10, 3)
+    A[:, 4, 1] = 0
+    b = np.random.rand(50, 10)
+    for method in ['ridge', 'fast', 'qr']:
+        x = solve_mat_batched(A, b, method)
+        assert np.all(np.isfinite(x))
+        ref = np.linalg.lstsq(A[:, 4], b[:, 4], rcond=None)[0]
+        assert_almost_equal(x[4], ref, 3)
+        ref = np.linalg.lstsq(A[:, 0], b[:, 0], rcond=None)[0]
+        assert_almost_equal(x[0], ref, 3)
+
+
+def test_fitter_jac_numeric():
+    from skultrafast.fitter import Fitter
+    p = np.array([0.05, 0.12, 1.3, 30, 1000])
+    for coh in [False, True]:
+        f = Fitter((wl, t, data), model_coh=coh)
+        J = f.jac(p)
+        for i in range(p.size):
+            eps = 1e-6 * p[i]
+            dp = np.zeros_like(p)
+            dp[i] = eps
+            num = (f.res(p + dp) - f.res(p - dp)) / (2*eps)
+            np.testing.assert_allclose(J[:, i], num, rtol=1e-4,
+                                       atol=1e-5 * abs(num).max())
+
+
+def test_fitter_jac():
+    ds = TimeResSpec(wl, t, data)
+    x0 = [0.1, 0.1, 1, 1000]
+    out1 = ds.fit_exp(x0, use_jac=False)
+    out2 = ds.fit_exp(x0, use_jac=True)
+    p1, p2 = out1.lmfit_res.params, out2.lmfit_res.params
+    for name in p1:
+        assert_almost_equal(p1[name].value, p2[name].value, 3)
+    assert_almost_equal(out1.lmfit_res.redchi, out2.lmfit_res.redchi)
+
+
+def test_fit_exp_multistart():
+    ds = TimeResSpec(wl, t, data)
+    x0 = [0.1, 0.1, 1, 10, 1000]
+    res = ds.fit_exp_multistart(x0, n_starts=4, max_workers=2, seed=0)
+    assert res.starts.shape == (4, 5)
+    assert np.all(res.minimum_idx >= 0)
+    chisqr = [r.lmfit_res.chisqr for r in res.results]
+    assert chisqr == sorted(chisqr)
+    assert ds.fit_exp_result_ is res.best
+    assert_almost_equal(res.best.lmfit_res.chisqr, np.nanmin(res.chisqr), 3)
+    res = ds.fit_exp_multistart(x0, n_starts=3, method='grid', max_workers=1)
+    assert len(res.starts) == 3
+    res.summary()
+
+
+def test_fit_exp_many():
+    from skultrafast import fitter
+    from skultrafast.dataset import fit_exp_many, FitExpResult
+    module_alpha = fitter.alpha
+    dss = [TimeResSpec(wl, t, data * (i+1)) for i in range(3)]
+    x0 = [[0.1, 0.1, 1, 1000]] * 3
+    x0[1] = [0.1, 0.1, np.nan, 1000]  # fails
+    calls = []
+    for executor in ['thread', 'process']:
+        out = dict(fit_exp_many(dss, x0, executor=executor, max_workers=2,
+                                callback=lambda *a: calls.append(a)))
+        assert sorted(out) == [0, 1, 2]
+        assert isinstance(out[1], Exception)
+        assert isinstance(out[2], FitExpResult)
+        assert dss[2].fit_exp_result_ is out[2]
+        ref = dss[0].fit_exp(x0[0])
+        assert_almost_equal(out[0].lmfit_res.chisqr / ref.lmfit_res.chisqr, 1)
+    assert len(calls) == 6
+    # The regularization is set per fitter, not module-wide.
+    assert fitter.alpha == module_alpha
+
+
 def test_error_calc():
     ds = TimeResSpec(wl, t, data)
     x0 = [0.1, 0.1, 1, 1000]
@@ -101,6 +205,205 @@ def test_sas():
     out.make_sas(m2, {'qy1': 0.5})
 
 
+def test_get_trans():
+    from scipy.linalg import expm
+    from skultrafast.kinetic_model import Model
+    m = Model()
+    m.add_transition('A', 'B', 'k1')
+    m.add_transition('B', 'zero', 'k2')
+    tt = np.linspace(0, 20, 50)
+    y0 = np.array([[1.], [0.]])
+    for rates in [(1., 0.2), (0.5, 0.5)]:  # the second one is defective
+        K = np.array(m.build_mat_func()(*rates), float)
+        ref = np.array([expm(K * ti) @ y0[:, 0] for ti in tt])
+        assert_almost_equal(m.get_trans(y0, rates, tt), ref)
+
+
+def test_fit_target():
+    from scipy.linalg import expm
+    from skultrafast.kinetic_model import Model
+    m = Model()
+    m.add_transition('A', 'B', 'k1')
+    m.add_transition('B', 'zero', 'k2', 'qy')
+    tt = np.linspace(-1, 50, 300)
+    wls = np.linspace(400, 600, 100)
+    K = np.array(m.build_mat_func()(1 / 2., 1 / 15., 0.7), float)
+    C = np.array([expm(K * ti) @ [1, 0] if ti > 0 else [0, 0] for ti in tt])
+    S = np.vstack((np.exp(-(wls-450)**2 / 500), -np.exp(-(wls-520)**2 / 800)))
+    ds = TimeResSpec(wls, tt, C @ S)
+    x0 = {'k1': 1., 'k2': 0.2, 'qy': 0.7}
+    res = ds.fit_target(m, x0, w=0.01, fixed_names=['qy'])
+    assert ds.target_result_ is res
+    assert_almost_equal(res.lmfit_res.params['k1'].value, 0.5, 3)
+    assert_almost_equal(res.lmfit_res.params['k2'].value, 1 / 15., 3)
+    assert_almost_equal(res.sas, S, 2)
+    assert_almost_equal(res.concentrations[tt > 1], C[tt > 1], 3)
+    pres = PolTRSpec(ds, ds).fit_target(m, x0, w=0.01, fixed_names=['qy'])
+    assert pres.sas.shape == (2, 2 * wls.size)
+
+    # Equal rates give a defective K-matrix, which uses matrix exponentials.
+    f = res.fitter
+    para = np.array([0.1, 0.3, 0.2, 0.2, 0.7])
+    near = para + [0, 0, 0, 1e-5, 0]
+    assert_almost_equal(f.concentrations(para), f.concentrations(near), 3)
+    res = ds.fit_target(m, {'k1': 0.3, 'k2': 0.3, 'qy': 0.7}, w=0.01,
+                        fixed_names=['qy'])
+    assert_almost_equal(sorted([res.lmfit_res.params['k1'].value,
+                                res.lmfit_res.params['k2'].value]),
+                        [1 / 15., 0.5], 3)
+
+
+def test_h5_roundtrip(tmp_path):
+    ds = TimeResSpec(wl, t, data, err=0.1 * data, name='test',
+                     disp_freq_unit='cm')
+    ds.mask_freqs([(500, 550)])
+    fname = tmp_path / 'ds.h5'
+    ds.save_h5(fname, block_rows=100)
+    for mode in ['r', None]:
+        ds2 = TimeResSpec.from_h5(fname, mmap_mode=mode)
+        assert isinstance(np.ma.getdata(ds2.data), np.memmap) == (mode == 'r')
+        assert_almost_equal(ds2.wavelengths, ds.wavelengths)
+        assert_almost_equal(ds2.t, ds.t)
+        assert_almost_equal(ds2.data, ds.data)
+        assert_almost_equal(ds2.err, ds.err)
+        assert np.all(ds2.data.mask == ds.data.mask)
+        assert ds2.name == 'test' and ds2.disp_freq_unit == 'cm'
+    ds3 = ds2.cut_time(-1, 1)
+    assert ds3.data.shape[0] < ds2.data.shape[0]
+
+
+def test_h5_fit_result_and_partial(tmp_path):
+    ds = TimeResSpec(wl, t, data)
+    ds.fit_exp([-0.0, 0.1, 5, 50, 1000], fix_last_decay=True)
+    fname = tmp_path / 'ds.h5'
+    ds.save_h5(fname, compression='gzip')
+    ds2 = TimeResSpec.from_file(fname)
+    assert not isinstance(ds2.data, np.memmap)
+    res, res2 = ds.fit_exp_result_, ds2.fit_exp_result_
+    assert_almost_equal(res2.fitter.last_para, res.fitter.last_para)
+    assert_almost_equal(res2.fitter.model, res.fitter.model)
+    assert res2.lmfit_res.chisqr == res.lmfit_res.chisqr
+    ds3 = TimeResSpec.from_file(fname, t_range=(0, 10))
+    assert ds3.t.min() >= 0 and ds3.t.max() <= 10
+    assert_almost_equal(ds3.data, ds.data[(t >= 0) & (t <= 10)])
+
+    pol = PolTRSpec(ds, ds.copy())
+    pol.save_h5(fname)
+    pol2 = PolTRSpec.from_file(fname)
+    assert_almost_equal(pol2.iso.data, pol.iso.data)
+    assert pol2.para.fit_exp_result_ is not None
+    with pytest.raises(ValueError):
+        TimeResSpec.from_file(fname)
+
+
+def test_bin_times():
+    ds = TimeResSpec(wl, t, data, err=np.full_like(data, 0.2))
+    out = ds.bin_times(4, sigma=None)
+    assert_almost_equal(out.data[0], data[:4].mean(0))
+    assert_almost_equal(out.t, [t[i:i + 4].mean() for i in range(0, t.size, 4)])
+    assert_almost_equal(out.err[:-1], 0.1)
+    out = ds.bin_times(20, ds.t_idx(0.5), log_spaced=True)
+    assert out.t.size <= 20 and out.t[-1] > 0.8 * t[-1]
+    assert np.all(np.diff(out.t) > 0)
+    with pytest.raises(ValueError):
+        ds.bin_times(20, log_spaced=True)
+
+    rng = np.random.default_rng(0)
+    t_lin = np.linspace(0.1, 10, 61)
+    ds = TimeResSpec(wl[:200], t_lin, rng.normal(0, 0.3, (61, 200)))
+    out = ds.bin_times(4, sigma=None)
+    assert np.all(np.isfinite(out.err))
+    assert abs(out.err[:-1].mean() - 0.15) < 0.02
+    assert abs(out.err[-1].mean() - 0.3) < 0.02
+    out = ds.bin_times(10, log_spaced=True, sigma=None)
+    assert np.all(np.isfinite(out.err))
+    assert np.all(np.isfinite(ds.bin_times(1).err))
+
+
+
+def test_svd_cache():
+    ds = TimeResSpec(wl, t, data)
+    u, s, vt = np.linalg.svd(data, full_matrices=False)
+    res = ds.svd(5)
+    assert_almost_equal(res.s, s[:5])
+    assert ds.svd(3).u.base is res.u.base
+    filtered = ds.apply_filter('svd', 3)
+    assert_almost_equal(filtered.data, (u[:, :3] * s[:3]) @ vt[:3])
+    ds.data *= 2
+    assert_almost_equal(ds.svd(3).s, 2 * s[:3])
+    assert_almost_equal(ds.svd(3, method='randomized').s, 2 * s[:3])
+    ds.data[:] = 3 * data
+    ds.invalidate_svd()
+    assert_almost_equal(ds.svd(3).s, 3 * s[:3])
+    ds.mask_freqs([(400, 450)])
+    assert ds._svd_cache is None
+
+@pytest.mark.parametrize('kind', ['linear', 'cubic', 'akima'])
+def test_interpolate_disp(kind):
+    from scipy.interpolate import Akima1DInterpolator, CubicSpline
+    ds = TimeResSpec(wl, t, data, err=np.ones_like(data))
+    tn = np.linspace(-0.3, 0.4, wl.size)
+    out = ds.interpolate_disp(tn, kind=kind)
+    for j in [0, 100, wl.size - 1]:
+        q = t + tn[j]
+        if kind == 'linear':
+            ref = np.interp(q, t, data[:, j])
+        else:
+            cls = CubicSpline if kind == 'cubic' else Akima1DInterpolator
+            ref = cls(t, data[:, j])(np.clip(q, t[0], t[-1]))
+        assert_almost_equal(out.data[:, j], ref)
+    assert np.all(out.err <= 1) and np.all(out.err >= np.sqrt(0.5) - 1e-12)
+
+    from skultrafast.zero_finding import shift_channels
+    err = np.linspace(1, 2, t.size)[:, None] * np.ones_like(data)
+    d, e = shift_channels(t, data, np.full(wl.size, -5.), err=err, kind=kind)
+    early = t - 5 < t[0]
+    assert_almost_equal(d[early], np.broadcast_to(data[0], d[early].shape))
+    assert_almost_equal(e[early], np.broadcast_to(err[0], e[early].shape))
+    with pytest.raises(ValueError):
+        shift_channels(t[::-1], data, tn, kind=kind)
+
+
+def test_lifetime_density_map():
+    ds = TimeResSpec(wl, t, data).bin_freqs(20)
+    taus = np.logspace(-1, 3, 20)
+    kw = dict(alpha=1e-3, cv=False, tol=1e-8, maxiter=100000)
+    res = ds.lifetime_density_map(taus, method='path', **kw)
+    ref = ds.lifetime_density_map(taus, **kw)
+    assert_almost_equal(res.fit, ref.fit, 4)
+    res = ds.lifetime_density_map(taus, method='path')
+    assert res.path.gcv.shape == (50, 20)
+    assert_almost_equal(res.alpha, res.path.alphas[np.argmin(res.path.gcv, 0)])
+
+
+def test_lifetime_density_map_tikhonov():
+    from sklearn.linear_model import Ridge
+    from skultrafast.lifetimemap import _make_base
+    ds = TimeResSpec(wl, t, data).bin_freqs(20)
+    taus = np.logspace(-1, 3, 20)
+    res = ds.lifetime_density_map(taus, method='tikhonov')
+    assert res.path.gcv.shape == res.path.residual_norm.shape == (50, 20)
+    assert_almost_equal(res.alpha, res.path.alphas[np.argmin(res.path.gcv, 0)])
+    X = _make_base(ds, taus, add_coh=False)
+    ridge = Ridge(alpha=res.alpha[3]).fit(X, ds.data[:, 3])
+    np.testing.assert_allclose(res.coefs[:, 3], ridge.coef_, rtol=1e-4)
+    res = ds.lifetime_density_map(taus, method='tikhonov', select='lcurve')
+    assert res.coefs.shape == (20, 20)
+
+
+def test_bin_freqs():
+    ds = TimeResSpec(wl, t, data, err=0.1 + 0 * data)
+    out = ds.bin_freqs(10)
+    assert out.wavelengths.size == 10
+    # Equal errors: the error of the mean is err/sqrt(n)
+    n = np.round((0.1 / out.err[0])**2)
+    assert n.sum() == wl.size
+    edges = np.linspace(ds.wavenumbers.min(), ds.wavenumbers.max() + 2000, 15)
+    out = ds.bin_freqs(edges, freq_unit='cm')
+    assert out.wavenumbers.size < 14
+    assert np.all(np.isfinite(out.data))
+
+
 def test_merge():
     ds = TimeResSpec(wl, t, data)
     nds = ds.merge_nearby_channels(10)
@@ -1,4 +1,8 @@
-from skultrafast.messpy import Messpy25File
+import numpy as np
+from numpy.testing import assert_almost_equal
+
+from skultrafast import data_io
+from skultrafast.messpy import MessPyFile, Messpy25File, ScanAverager
 
 
 def test_messpy_v1():
@@ -7,3 +11,63 @@ def test_messpy_v1():
 
 def test_2d_loader():
     pass
+
+
+def test_scan_averager():
+    rng = np.random.default_rng(0)
+    scans = rng.normal(size=(100, 20, 10))
+    scans[rng.random(scans.shape) < 0.02] = 100
+    scans[3, 0, 0] = np.nan
+    avg = ScanAverager(sigma=3, n_warmup=10)
+    avg.add(scans[0])
+    assert_almost_equal(avg.mean, scans[0])
+    for s in scans[1:]:
+        avg.add(s)
+    assert avg.n_scans == 100
+    assert avg.count[0, 0] < 100 and avg.count.min() > 85
+    assert (100 - avg.count).sum() >= (scans == 100).sum()
+    assert np.abs(avg.mean).max() < 0.5
+    assert_almost_equal(avg.std.mean(), 1, 1)
+
+
+def test_stream_average():
+    p = data_io.get_example_path('messpy')
+    mf = MessPyFile(p, is_pol_resolved=True, pol_first_scan='perp', valid_channel=1)
+    ref = mf.average_scans()
+    outs = list(mf.stream_average(every=4))
+    assert len(outs) == 4
+    assert set(outs[-1]) == set(ref)
+    diff = outs[-1]['para0'].data - ref['para0'].data
+    assert np.median(np.abs(diff)) < 1e-3 * np.abs(ref['para0'].data).max()
+
+
+def test_messpy25_pipeline(tmp_path):
+    import h5py
+    rng = np.random.default_rng(0)
+    n_t2, n_wn, n_t1, n_scans = 3, 16, 20, 7
+    t1 = np.arange(n_t1) * 0.02
+    scans = rng.normal(size=(2, n_t2, n_scans, n_wn, n_t1)).astype(np.float32)
+    with h5py.File(tmp_path / 'test.h5', 'w') as f:
+        f['t1'] = t1
+        f['t1'].attrs['rot_frame'] = 2000.
+        f['t2'] = np.arange(n_t2, dtype=float)
+        f['wn'] = np.linspace(2000, 2100, n_wn)
+        for p, name in enumerate(['Probe1', 'Probe2']):
+            for i in range(n_t2):
+                for k in range(n_scans):
+                    f[f'ifr_data/{name}/{i}/{k}'] = scans[p, i, k]
+                f[f'ifr_data/{name}/{i}/mean'] = scans[p, i].mean(0)
+    mp = Messpy25File(h5py.File(tmp_path / 'test.h5', 'r'))
+    means, stderr = mp.ifr_means_and_stderr(block=3)
+    assert_almost_equal(means['Probe2'][1], scans[1, 1].mean(0), 6)
+    assert_almost_equal(stderr['Probe1'][2], scans[0, 2].std(0) / np.sqrt(n_scans), 6)
+    ifr = mp.get_all_ifr()
+    assert_almost_equal(ifr['Probe1']['1'], scans[0, 1])
+
+    out = mp.make_two_d(upsample=2, ch_shift=0)
+    v = scans[0].mean(1)
+    v[..., 0] *= 0.5
+    v = v * np.hanning(2 * n_t1)[n_t1:]
+    assert_almost_equal(out['para'].spec2d, np.fft.rfft(v, n=2 * n_t1).real, 5)
+    assert out['iso'].spec2d.shape == (n_t2, n_wn, n_t1 + 1)
+    assert_almost_equal(mp.pump_wn, out['iso'].pump_wn)
@@ -1,9 +1,13 @@
+import os
 import pytest
 import tempfile
 import zipfile
 import zipfile_deflate64
 from pathlib import Path
 
+import numpy as np
+
+from skultrafast import quickcontrol
 from skultrafast.quickcontrol import QC1DSpec, QC2DSpec, parse_str, QCFile
 from skultrafast.data_io import get_example_path, get_twodim_dataset
 
@@ -51,3 +55,95 @@ def test_2d(datadir2d):
     infos = list(Path(datadir2d).glob('*320.info'))
     ds = QC2DSpec(infos[0])
     ds.make_ds()
+
+
+def test_1d_scan_cache(datadir, tmp_path, monkeypatch):
+    for f in Path(datadir).iterdir():
+        (tmp_path / f.name).write_bytes(f.read_bytes())
+    fname = tmp_path / '20201029#07'
+    files = sorted(tmp_path.glob('*_PAR*.scan'))
+    ref = np.array([np.loadtxt(p)[:-1, 1:] for p in files])
+    qc = QC1DSpec(fname=fname)
+    np.testing.assert_array_equal(qc.par_data, ref)
+    assert (tmp_path / '20201029#07_scans.h5').exists()
+
+    def fail(fname):
+        raise AssertionError('scan file parsed')
+
+    with monkeypatch.context() as m:
+        m.setattr(quickcontrol, 'read_scan', fail)
+        np.testing.assert_array_equal(QC1DSpec(fname=fname).par_data, ref)
+    st = files[0].stat()
+    os.utime(files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with monkeypatch.context() as m:
+        m.setattr(quickcontrol, 'read_scan', fail)
+        with pytest.raises(AssertionError):
+            QC1DSpec(fname=fname)
+    np.testing.assert_array_equal(QC1DSpec(fname=fname, use_cache=False).per_data,
+                                  qc.per_data)
+
+    monkeypatch.setattr(quickcontrol, '_POOL_MIN_BYTES', 0)
+    qc = QC1DSpec(fname=fname, use_cache=False, max_workers=2)
+    np.testing.assert_array_equal(qc.par_data, ref)
+
+
+def test_read_scan_corrupted(tmp_path):
+    d = np.arange(12.).reshape(3, 4)
+    fname = tmp_path / 'a.scan'
+    np.savetxt(fname, d, delimiter='\t')
+    np.testing.assert_array_equal(quickcontrol.read_scan(fname), d)
+    # Parsing stops at the bad value after 8 values, a multiple of the columns.
+    lines = fname.read_text().splitlines()
+    fname.write_text('\n'.join(lines[:2] + ['x' + lines[2]]) + '\n')
+    with pytest.raises(ValueError):
+        quickcontrol.read_scan(fname)
+
+
+@pytest.fixture
+def qc2d_dir(tmp_path):
+    """A small synthetic QuickControl 2D experiment with 3 waiting times."""
+    rng = np.random.default_rng(0)
+    info = {'MONO1 Grating': 'Grating 2: 75 l/mm', 'MONO1 Wavelength': 4800,
+            'Waiting Time Delays': '150.000000,300.000000,600.000000',
+            'Waiting Time Delay Units': 'fs', 'Final Delay (fs)': 2000,
+            'Step Size (fs)': 20, 'Rotating Frame (Scanned)': 1900}
+    with open(tmp_path / 'exp.info', 'w') as f:
+        for k, v in info.items():
+            f.write(f'{k}\t{v}\n')
+    t2 = np.arange(0, 2001, 20.)
+    for T in range(1, 4):
+        for pol in ['PAR', 'PER']:
+            for scan in range(1, 4):
+                d = np.column_stack((np.r_[0, t2], rng.normal(size=(t2.size + 1, 128))))
+                np.savetxt(tmp_path / f'exp_T{T:02d}_{pol}{scan}.scan', d, delimiter='\t')
+    return tmp_path
+
+
+def test_2d_lazy_loader(qc2d_dir):
+    qc = QC2DSpec(qc2d_dir / 'exp.info')
+    assert len(qc.par_data) == 3 and qc.t.size == 3
+    files = sorted(qc2d_dir.glob('exp_T02_PER*.scan'))
+    np.testing.assert_array_equal(qc.per_data[1], [np.loadtxt(p) for p in files])
+    np.testing.assert_array_equal(QC2DSpec(qc2d_dir / 'exp.info').per_data[1],
+                                  qc.per_data[1])
+    ds = qc.make_ds()
+    assert ds['iso'].spec2d.shape == (3, 128, qc.pump_freq.size)
+
+
+def test_2d_calc_spec(qc2d_dir):
+    from scipy.ndimage import gaussian_filter1d
+    from skultrafast.utils import poly_bg_correction
+    qc = QC2DSpec(qc2d_dir / 'exp.info', probe_filter=1.5, bg_correct=(10, 10))
+    par, per = qc.calc_spec()
+    for t in range(3):
+        d = np.nanmean(qc.per_data[t], 0)[:-1, 1:]
+        d = gaussian_filter1d(d, 1.5, -1, mode='nearest')
+        poly_bg_correction(qc.wavelength, d, 10, 10)
+        d[0, :] *= 0.5
+        win = np.hamming(2 * len(qc.t2))[len(qc.t2):, None]
+        ref = np.fft.rfft(d * win, axis=0, n=2 * len(qc.t2))
+        np.testing.assert_allclose(per[t], ref.real, atol=1e-12)
+    cpar, cper = qc.calc_spec(complex_spec=True)
+    np.testing.assert_allclose(cper[2].imag, ref.imag, atol=1e-12)
+    ds = qc.make_ds()
+    np.testing.assert_allclose(ds['iso'].spec2d, (2*per + par).transpose(0, 2, 1)[:, ::-1] / 3)
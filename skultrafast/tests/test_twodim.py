@@ -1,10 +1,11 @@
 from pathlib import Path
+import numpy as np
 from numpy.testing import assert_almost_equal
 import pytest
 
 from skultrafast.data_io import get_twodim_dataset
 from skultrafast.quickcontrol import QC2DSpec
-from skultrafast.twoD_dataset import TwoDim
+from skultrafast.twoD_dataset import CLSResult, TwoDim
 
 
 @pytest.fixture(scope='session')
@@ -139,3 +140,155 @@ def test_plot_trans(two_d_processed: TwoDim):
 def test_gaussfit(two_d_processed: TwoDim):
     fr = two_d_processed.fit_gauss()
     fr.plot_cls()
+
+
+def test_h5_roundtrip(tmp_path):
+    t = np.linspace(0, 10, 7)
+    pump, probe = np.linspace(2100, 2200, 9), np.linspace(2080, 2220, 11)
+    spec2d = np.random.default_rng(0).normal(size=(t.size, probe.size, pump.size))
+    ds = TwoDim(t, pump, probe, spec2d, info={'sample': 'x', 'path': Path('a')})
+    ds.cls_result_ = CLSResult(wt=t, slopes=t, slope_errors=None,
+                               intercepts=t, intercept_errors=t,
+                               lines=[np.ones((3, 4))] * t.size)
+    fname = tmp_path / 'ds.h5'
+    ds.save_h5(fname, compression='gzip')
+    ds2 = TwoDim.from_file(fname)
+    assert_almost_equal(ds2.spec2d, ds.spec2d)
+    assert_almost_equal(ds2.pump_wn, pump)
+    assert ds2.info == {'sample': 'x', 'path': 'a'}
+    assert_almost_equal(ds2.cls_result_.lines[2], ds.cls_result_.lines[2])
+    assert ds2.cls_result_.slope_errors is None
+    ds3 = TwoDim.from_file(fname, t_range=(2, 5))
+    assert_almost_equal(ds3.spec2d, ds.spec2d[(t >= 2) & (t <= 5)])
+
+
+def make_tilted_2d(n_t=4, seed=0):
+    pu, pr = np.linspace(2100, 2200, 40), np.linspace(2080, 2220, 70)
+    t = np.linspace(0.5, 10, n_t)
+    P, U = np.meshgrid(pr, pu, indexing='ij')
+    spec2d = []
+    for c in 0.6 * np.exp(-t / 3) + 0.1:
+        x, y = P - 2150 - c * (U-2150), U - 2150
+        spec2d.append(-np.exp(-x**2 / 72 - y**2 / 450) + 0.5 * np.exp(-(x-15)**2 / 72 - y**2 / 450))
+    noise = np.random.default_rng(seed).normal(size=(n_t, pr.size, pu.size))
+    return TwoDim(t, pu, pr, np.array(spec2d) + 0.003*noise)
+
+
+def test_cls_vectorized():
+    import lmfit
+    from numpy.polynomial import Polynomial
+    ds = make_tilted_2d()
+    spec = ds.spec2d[ds.t_idx(2)].T
+    for method in ['com', 'quad', 'fit']:
+        res = ds.single_cls(2, method=method)
+        for pu, pos in zip(res.pump_wn, res.max_pos):
+            s = spec[ds.pump_idx(pu)]
+            sel = abs(ds.probe_wn - ds.probe_wn[np.argmin(s)]) < 9
+            x, y = ds.probe_wn[sel], s[sel]
+            if method == 'com':
+                ref = np.average(x, weights=y)
+            elif method == 'quad':
+                ref = Polynomial.fit(x, y, 2).deriv().roots()[0]
+            else:
+                mod = lmfit.models.GaussianModel()
+                mod.set_param_hint('center', min=x.min(), max=x.max())
+                ref = mod.fit(y, x=x, sigma=3, center=np.average(x, weights=y),
+                              amplitude=np.trapz(y, x)).params['center'].value
+            assert_almost_equal(pos, ref, 3)
+    res = ds.cls(max_workers=1, method='fit')
+    assert np.all(np.diff(res.slopes) < 0)
+    res_pool = ds.cls(max_workers=2, method='fit')
+    assert_almost_equal(res_pool.slopes, res.slopes)
+
+
+def test_bg_correct_projection():
+    ds = make_tilted_2d()
+    ds.spec2d += ((ds.probe_wn[:, None] - 2100) / 50)**2
+    out = ds.copy()
+    out.background_correction((2120, 2180))
+    w = np.random.default_rng(1).uniform(0.5, 2, ds.spec2d.shape)
+    out_w = ds.copy()
+    out_w.background_correction((2120, 2180), weights=w)
+    bg = ~((ds.probe_wn >= 2120) & (ds.probe_wn <= 2180))
+    x = ds.probe_wn
+    for ti, pi in [(0, 0), (1, 20), (3, 39)]:
+        s = ds.spec2d[ti, :, pi]
+        p = np.polyfit(x[bg], s[bg], 3)
+        assert_almost_equal(out.spec2d[ti, :, pi], s - np.polyval(p, x))
+        p = np.polyfit(x[bg], s[bg], 3, w=w[ti, bg, pi])
+        assert_almost_equal(out_w.spec2d[ti, :, pi], s - np.polyval(p, x))
+
+
+def test_line_profiles():
+    from scipy.interpolate import RegularGridInterpolator
+    ds = make_tilted_2d()
+    rng = np.random.default_rng(2)
+    probe, pump = rng.uniform(2070, 2230, 50), rng.uniform(2090, 2210, 50)
+    prof = ds.line_profiles(probe, pump)
+    for i, t in enumerate(ds.t):
+        ref = RegularGridInterpolator((ds.probe_wn, ds.pump_wn), ds.spec2d[i],
+                                      bounds_error=False)(np.column_stack((probe, pump)))
+        assert_almost_equal(prof[i], ref)
+    assert_almost_equal(ds.line_profiles(probe, pump, t=ds.t[2]), prof[2])
+
+    res_all = ds.diag_and_antidiag(None, offset=2., p=2150.)
+    res = ds.diag_and_antidiag(ds.t[1], offset=2., p=2150.)
+    assert res_all.diag.shape == (ds.t.size, ds.probe_wn.size)
+    assert_almost_equal(res_all.antidiag[1], res.antidiag)
+    ref = ds.get_interpolator()(np.column_stack((np.full(ds.probe_wn.size, ds.t[1]), ds.probe_wn,
+                                                 res.diag_coords)))
+    assert_almost_equal(res.diag, ref)
+
+    intp = ds.get_interpolator()
+    assert ds.get_interpolator() is intp
+    ds.spec2d = ds.spec2d * 2
+    assert ds.get_interpolator() is not intp
+    assert_almost_equal(ds.diag_and_antidiag(ds.t[1], offset=2., p=2150.).diag, 2 * res.diag)
+    # The cache also works if the interpolator holds a copy of the values.
+    from scipy.interpolate import RegularGridInterpolator
+    ds._make_int = lambda: RegularGridInterpolator(
+        (ds.t, ds.probe_wn, ds.pump_wn), ds.spec2d.astype(np.float64), bounds_error=False)
+    ds.spec2d = ds.spec2d.astype(np.float32)
+    intp = ds.get_interpolator()
+    assert intp.values is not ds.spec2d
+    assert ds.get_interpolator() is intp
+
+
+def test_fit_das_varpro():
+    import lmfit
+    from skultrafast.base_functions import _fold_exp
+    rng = np.random.default_rng(3)
+    t = np.r_[np.linspace(-0.5, 1, 10), np.geomspace(1.2, 50, 30)]
+    pu, pr = np.linspace(2100, 2200, 12), np.linspace(2080, 2220, 14)
+    das = rng.normal(size=(2, pr.size, pu.size))
+    noise = 0.05 * rng.normal(size=(t.size, pr.size, pu.size))
+    basis = _fold_exp(t[:, None], 0.15, 0.1, np.array([2., 15.]))[:, 0, :]
+    ds = TwoDim(t, pu, pr, np.einsum('tk,kpq->tpq', basis, das) + noise)
+
+    res = ds.fit_das([1., 10.], w=0.1, t0=0.)
+    assert_almost_equal(res.taus, [2, 15], 0)
+    assert abs(res.minimizer.params['w'].value - 0.15) < 0.01
+    assert_almost_equal(res.model.spec2d + res.residuals, ds.spec2d)
+
+    # Without IRF, compare with a plain fit of the uncompressed data.
+    late = ds.select_t_range(1)
+    res = late.fit_das([1., 10.])
+    params = lmfit.Parameters()
+    params.add('tau0', 1.)
+    params.add('tau1', 10.)
+    ref = lmfit.minimize(lambda p: late.fit_taus(np.array([p['tau0'].value,
+                                                           p['tau1'].value]))[2].ravel(),
+                         params)
+    assert_almost_equal(res.taus, [ref.params['tau0'].value, ref.params['tau1'].value], 4)
+    assert_almost_equal(res.minimizer.chisqr, ref.chisqr, 6)
+    assert res.minimizer.ndata == ref.ndata
+    assert_almost_equal(res.minimizer.redchi / ref.redchi, 1, 4)
+    assert_almost_equal(res.minimizer.bic, ref.bic, 2)
+    for name in ('tau0', 'tau1'):
+        assert_almost_equal(res.minimizer.params[name].stderr / ref.params[name].stderr,
+                            1, 2)
+    fixed = late.fit_das([15.], fix_last_decay=True)
+    assert fixed.minimizer.nvarys == 0
+    assert_almost_equal(fixed.taus, [15.])
+    res_svd = late.fit_das([1., 10.], n_svd=4)
+    assert_almost_equal(res_svd.taus, res.taus, 2)
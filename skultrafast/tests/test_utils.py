@@ -1,4 +1,5 @@
-from skultrafast.utils import pfid_r4, pfid_r6, simulate_binning
+from skultrafast.utils import (bin_along, pfid_r4, pfid_r6, sigma_clip, sigma_clip_stats,
+                               simulate_binning, svd)
 import numpy as np
 import pytest
 
@@ -24,5 +25,107 @@ def test_simulate_binning():
     precise_sum = np.sin(many)
 
 
+@pytest.mark.parametrize('axis', [0, 1, -1])
+def test_sigma_clip_stats(axis):
+    rng = np.random.default_rng(0)
+    x = rng.standard_t(3, size=(20, 30, 40))
+    x[0, 0, :5] = np.nan
+    x[1, 1, :] = np.nan
+    mean, std, count, mask = sigma_clip_stats(x, sigma=2.5, axis=axis, ddof=1)
+    clipped = sigma_clip(x, sigma=2.5, axis=axis)
+    assert np.all(clipped.mask == mask)
+    assert np.all(count == (~mask).sum(axis))
+    xm = np.ma.MaskedArray(x, mask)
+    np.testing.assert_allclose(mean, xm.mean(axis).filled(np.nan))
+    np.testing.assert_allclose(std, xm.std(axis, ddof=1).filled(np.nan))
 
+    # Reference of the iterative clipping, MAD-variant along the given axis
+    xr = np.ma.masked_invalid(x)
+    for _ in range(5):
+        med = np.ma.median(xr, axis, keepdims=True)
+        mad = 1.4826 * np.ma.median(abs(xr - med), axis, keepdims=True)
+        xr = np.ma.masked_where(abs(xr - med) > 2.5*mad, xr)
+    mask = sigma_clip_stats(x, sigma=2.5, axis=axis, use_mad=True)[3]
+    assert np.all(np.ma.getmaskarray(xr) == mask)
 
+
+def test_bin_along():
+    rng = np.random.default_rng(0)
+    x = rng.permutation(np.r_[np.linspace(0, 10, 50), np.linspace(20, 30, 5)])
+    data, w = rng.normal(size=(2, 3, x.size))
+    w = abs(w)
+    edges = np.linspace(-1, 30, 20)
+    b = bin_along(x, data, edges, w)
+    assert b.count.sum() == x.size
+    for i in range(edges.size - 1):
+        last = i == edges.size - 2
+        sel = (x >= edges[i]) & ((x < edges[i + 1]) | (last & (x == edges[-1])))
+        assert b.count[i] == sel.sum()
+        if not sel.any():
+            assert np.all(np.isnan(b.mean[:, i]))
+            continue
+        mean = np.average(data[:, sel], 1, w[:, sel])
+        np.testing.assert_allclose(b.mean[:, i], mean)
+        np.testing.assert_allclose(b.var[:, i],
+                                   np.average((data[:, sel] - mean[:, None])**2, 1,
+                                              w[:, sel]))
+        np.testing.assert_allclose(b.x[i], x[sel].mean())
+
+    from skultrafast.dv import binner
+    mean, bx = binner(19, x, data, weights=w)
+    b = bin_along(x, data, np.linspace(x.min(), x.max(), 20), w)
+    np.testing.assert_allclose(mean, b.mean[:, b.nonempty])
+    median, _ = binner(19, x, data, func=np.median)
+    assert median.shape == mean.shape
+    with pytest.raises(ValueError):
+        binner(19, x, data, func=np.median, weights=w)
+
+
+@pytest.mark.parametrize('method', ['full', 'randomized', 'arpack'])
+@pytest.mark.parametrize('shape', [(300, 80), (80, 300)])
+def test_svd(method, shape):
+    rng = np.random.default_rng(1)
+    a = rng.normal(size=(shape[0], 5)) @ np.diag([50, 20, 10, 5, 2.]) @ rng.normal(size=(5, shape[1]))
+    a += rng.normal(size=shape) * 0.01
+    u_ref, s_ref, vt_ref = np.linalg.svd(a, full_matrices=False)
+    res = svd(a, 5, method=method)
+    assert res.u.shape == (shape[0], 5) and res.vt.shape == (5, shape[1])
+    np.testing.assert_allclose(res.s, s_ref[:5], rtol=1e-6)
+    np.testing.assert_allclose(abs(np.sum(res.u * u_ref[:, :5], 0)), 1, rtol=1e-6)
+    np.testing.assert_allclose(res.reconstruct(3), (u_ref[:, :3] * s_ref[:3]) @ vt_ref[:3],
+                               atol=1e-8)
+
+
+def test_efa():
+    from skultrafast.dv import efa, moving_efa
+    rng = np.random.default_rng(2)
+    t = np.arange(60)
+    conc = np.stack((np.exp(-t/10), 1 - np.exp(-t/10), (t > 30) * 1.))
+    a = conc.T @ rng.normal(size=(3, 40)) + rng.normal(size=(60, 40)) * 0.01
+    fw = efa(a, 4)
+    bw = efa(a, 4, reverse=True)
+    mv = moving_efa(a, 4, 8)
+    pca = moving_efa(a, 4, 8, method='pca')
+
+    def sv(x):
+        out = np.zeros(4)
+        s = np.linalg.svd(x, compute_uv=False)[:4]
+        out[:s.size] = s
+        return out
+
+    for i in [0, 3, 20, 59]:
+        np.testing.assert_allclose(fw[i], sv(a[:i+1]), rtol=1e-6)
+        np.testing.assert_allclose(bw[i], sv(a[i:]), rtol=1e-6)
+    for i in [0, 25, 52]:
+        win = a[i:i+8]
+        np.testing.assert_allclose(mv[i], np.linalg.svd(win, compute_uv=False)[:4], rtol=1e-8)
+        s = np.linalg.svd(win - win.mean(0), compute_uv=False)
+        np.testing.assert_allclose(pca[i], (s**2 / (s**2).sum())[:4], rtol=1e-6)
+    assert np.all(mv[53:] == 0)
+    # The optional projection disturbs the values at most by the first
+    # dropped singular value.
+    s_dropped = np.linalg.svd(a, compute_uv=False)[14]
+    assert np.all(abs(efa(a, 4, n_basis=14) - fw) <= s_dropped)
+    assert np.all(abs(moving_efa(a, 4, 8, n_basis=14) - mv) <= s_dropped)
+    # Windows smaller than n are padded with zeros.
+    np.testing.assert_allclose(moving_efa(a, 4, 2)[10], sv(a[10:12]), atol=1e-8)
@@ -1,10 +1,15 @@
 from collections import defaultdict
 from lmfit.minimizer import MinimizerResult
+import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 from typing import Dict, Iterable, List, Literal, Optional, Tuple, Union, Any
 
 import attr
+import h5py
 import lmfit
 import matplotlib.pyplot as plt
 import numpy as np
@@ -15,9 +20,11 @@ from scipy.stats import linregress
 from statsmodels.api import OLS, WLS, add_constant
 
 from skultrafast import dv, plot_helpers
+from skultrafast.data_io import h5_as_array, h5_rows_in_range, write_h5_rows
 from skultrafast.dataset import TimeResSpec
 from skultrafast.twoD_plotter import TwoDimPlotter
 from skultrafast.utils import inbetween, LinRegResult
+from skultrafast.base_functions import _fold_exp_grad
 from skultrafast.base_funcs.lineshapes import gauss2d, two_gauss2D_shared, two_gauss2D
 
 PathLike = Union[str, bytes, os.PathLike]
@@ -162,6 +169,248 @@ class GaussResult(FFCFResult):
     """TwoDim object with the fit data, useful for plotting"""
 
 
+def _das_basis(t, taus, irf=None):
+    """
+    Returns the exponential basis of `TwoDim.fit_das`, shape (n_t, n_tau),
+    and its derivatives with respect to each decay time and, if `irf` is
+    given as (w, t0), to w and t0.
+    """
+    if irf is None:
+        A = np.exp(-t[:, None] / taus)
+        dtau = A * t[:, None] / taus**2
+        dA = []
+    else:
+        w, t0 = irf
+        A, dtau, dw, dt0 = (a[:, 0, :] for a in _fold_exp_grad(t[:, None], w, t0, taus))
+        dA = [dw, dt0]
+    # Each decay time only changes its own column.
+    dA_tau = []
+    for j in range(taus.size):
+        d = np.zeros_like(A)
+        d[:, j] = dtau[:, j]
+        dA_tau.append(d)
+    return A, dA_tau + dA
+
+
+def _bilinear_weights(x_grid, y_grid, x, y):
+    """
+    Sparse matrix W, so that ``W @ A.ravel()`` is the bilinear interpolation
+    of A, an array of shape (x_grid.size, y_grid.size), at the points (x, y).
+    Also returns a boolean array, which is False for points outside the grid.
+    """
+    from scipy.sparse import csr_matrix
+    valid = ((x >= x_grid[0]) & (x <= x_grid[-1]) & (y >= y_grid[0])
+             & (y <= y_grid[-1]))
+    ix = np.clip(np.searchsorted(x_grid, x, side='right') - 1, 0, x_grid.size - 2)
+    iy = np.clip(np.searchsorted(y_grid, y, side='right') - 1, 0, y_grid.size - 2)
+    fx = np.clip((x - x_grid[ix]) / (x_grid[ix + 1] - x_grid[ix]), 0, 1)
+    fy = np.clip((y - y_grid[iy]) / (y_grid[iy + 1] - y_grid[iy]), 0, 1)
+    rows = np.repeat(np.arange(x.size), 4)
+    cols = np.stack(((ix) * y_grid.size + iy, ix * y_grid.size + iy + 1,
+                     (ix+1) * y_grid.size + iy, (ix+1) * y_grid.size + iy + 1), 1).ravel()
+    vals = np.stack(((1-fx) * (1-fy), (1-fx) * fy, fx * (1-fy), fx * fy), 1).ravel()
+    W = csr_matrix((vals, (rows, cols)), shape=(x.size, x_grid.size * y_grid.size))
+    return W, valid
+
+
+def _masked_trapz(y, x, mask):
+    """`np.trapz` of every row of y over the contiguous region given by mask."""
+    pair = mask[:, 1:] & mask[:, :-1]
+    return np.sum(pair * (y[:, 1:] + y[:, :-1]) / 2 * np.diff(x), 1)
+
+
+def _masked_quad_vertex(x, y, mask):
+    """
+    Fits a parabola to every row of y, only using the points in mask, and
+    returns the positions of the vertices. All rows are solved at once.
+    """
+    n = mask.sum(1)
+    c = (mask * x).sum(1) / np.maximum(n, 1)
+    xs = x - c[:, None]
+    scale = np.sqrt((mask * xs**2).sum(1) / np.maximum(n, 1))
+    scale[scale == 0] = 1
+    xs = xs / scale[:, None]
+    V = np.stack((np.ones_like(xs), xs, xs**2), -1) * mask[..., None]
+    A = np.einsum('sik,sil->skl', V, V)
+    b = np.einsum('sik,si->sk', V, np.where(mask, y, 0))
+    coef = np.einsum('skl,sl->sk', np.linalg.pinv(A), b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vertex = -coef[:, 1] / (2 * coef[:, 2])
+    vertex[n < 3] = np.nan
+    return c + scale * vertex
+
+
+def _batched_gauss_fit(x, y, mask, amp, center, sigma, center_bounds=None,
+                       linear=False, max_iter=200, ftol=1e-12):
+    """
+    Levenberg-Marquardt fit of a gaussian (plus a line if `linear`) to every
+    row of y at once. The gaussian is parametrized as lmfit's
+    `GaussianModel`. Only points in mask are used.
+
+    Returns the center and its standard error, scaled by the reduced
+    chi-square as done by lmfit.
+    """
+    n_s = y.shape[0]
+    n_p = 5 if linear else 3
+    p = np.zeros((n_s, n_p))
+    p[:, 0], p[:, 1], p[:, 2] = amp, center, sigma
+    y = np.where(mask, y, 0)
+    w = mask.astype(float)
+    c0 = 1 / np.sqrt(2 * np.pi)
+
+    def resid_jac(p):
+        a, c, sig = p[:, :1], p[:, 1:2], p[:, 2:3]
+        d = x - c
+        e = np.exp(-d**2 / (2 * sig**2)) * c0 / sig
+        g = a * e
+        J = np.stack((e, g * d / sig**2, g * (d**2 / sig**3 - 1 / sig)), -1)
+        if linear:
+            g = g + p[:, 3:4] * x + p[:, 4:5]
+            J = np.concatenate((J, np.broadcast_to(x[:, None], J.shape[:2] + (1,)),
+                                np.ones(J.shape[:2] + (1,))), -1)
+        return (g - y) * w, J * w[..., None]
+
+    def clip(p):
+        p[:, 2] = np.maximum(p[:, 2], 1e-12)
+        if center_bounds is not None:
+            p[:, 1] = np.clip(p[:, 1], *center_bounds)
+        return p
+
+    r, J = resid_jac(p)
+    cost = (r**2).sum(1)
+    lam = np.full(n_s, 1e-3)
+    active = mask.sum(1) > n_p
+    for i in range(max_iter):
+        if not active.any():
+            break
+        JtJ = np.einsum('sik,sil->skl', J, J)
+        Jtr = np.einsum('sik,si->sk', J, r)
+        D = np.diagonal(JtJ, axis1=1, axis2=2)
+        A = JtJ + (lam[:, None] * (D + 1e-12 * D.max(1, keepdims=True)))[:, :, None] * np.eye(n_p)
+        with np.errstate(all='ignore'):
+            step = np.linalg.solve(A[active], -Jtr[active][..., None])[..., 0]
+        p_new = p.copy()
+        p_new[active] += np.nan_to_num(step)
+        p_new = clip(p_new)
+        r_new, J_new = resid_jac(p_new)
+        cost_new = (r_new**2).sum(1)
+        better = active & (cost_new < cost)
+        converged = better & (cost - cost_new <= ftol * cost)
+        p[better], r[better], J[better] = p_new[better], r_new[better], J_new[better]
+        lam = np.where(better, lam / 3, lam * 2)
+        cost = np.where(better, cost_new, cost)
+        active &= ~converged & (lam < 1e10)
+
+    JtJ = np.einsum('sik,sil->skl', J, J)
+    nfree = mask.sum(1) - n_p
+    err = np.full(n_s, np.nan)
+    ok = nfree > 0
+    with np.errstate(all='ignore'):
+        cov = np.linalg.pinv(JtJ[ok])
+        err[ok] = np.sqrt(cov[:, 1, 1] * cost[ok] / nfree[ok])
+    center = p[:, 1]
+    center[~ok] = np.nan
+    return center, err
+
+
+def _cls_peak_positions(spec, pr, pr_range, method):
+    """
+    Determines the position of the minimum of each pump slice along the
+    probe axis. spec has the shape (n_pump, n_probe). See `TwoDim.single_cls`.
+    """
+    pr_min = pr[np.argmin(spec, 1)]
+    if not isinstance(pr_range, tuple):
+        mask = (pr < pr_min[:, None] + pr_range) & (pr > pr_min[:, None] - pr_range)
+    else:
+        mask = np.broadcast_to(inbetween(pr, pr_range[0], pr_range[1]), spec.shape)
+    ws = np.where(mask, spec, 0)
+    cen_of_m = ws @ pr / ws.sum(1)
+    ones = np.ones_like(cen_of_m)
+    if method == 'com':
+        return cen_of_m, ones
+    elif method == 'quad':
+        return _masked_quad_vertex(pr, spec, mask), ones
+    elif method == 'log_quad':
+        i2 = spec < spec.min(1, keepdims=True) * 0.1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_s = np.log(-np.where(i2, spec, -1))
+        return _masked_quad_vertex(pr, log_s, mask & i2), ones
+    elif method in ('fit', 'skew_fit'):
+        amp = _masked_trapz(spec, pr, mask)
+        bounds = None
+        if method == 'fit':
+            x_in = np.where(mask, pr, np.nan)
+            bounds = (np.nanmin(x_in, 1), np.nanmax(x_in, 1))
+        return _batched_gauss_fit(pr, spec, mask, amp, cen_of_m, 3., bounds,
+                                  linear=method == 'skew_fit')
+    else:
+        raise ValueError(f'Unknown method {method}')
+
+
+def _single_cls(spec2d_t, pu, pr, pr_range=9.0, pu_range=7.0, mode='neg',
+                method='com') -> SingleCLSResult:
+    """Does the work of `TwoDim.single_cls` for one 2D spectrum."""
+    spec = spec2d_t.T
+    if mode == 'pos':
+        spec = -spec
+    pu_max = pu[np.argmin(np.min(spec, 1))]
+    if not isinstance(pu_range, tuple):
+        pu_idx = (pu < pu_max + pu_range) & (pu > pu_max - pu_range)
+    else:
+        pu_idx = inbetween(pu, pu_range[0], pu_range[1])
+    x = pu[pu_idx] - pu[pu_idx].mean()
+    y, yerr = _cls_peak_positions(spec[pu_idx, :], pr, pr_range, method)
+    all_err_valid = np.isfinite(yerr).all()
+    if all_err_valid:
+        r = WLS(y, add_constant(x), weights=1 / yerr**2).fit()
+    else:
+        r = OLS(y, add_constant(x)).fit()
+
+    return SingleCLSResult(pump_wn=x + pu[pu_idx].mean(),
+                           max_pos=y,
+                           max_pos_err=yerr,
+                           slope=r.params[0],
+                           reg_result=r,
+                           recentered_pump_wn=x,
+                           linear_fit=r.predict())
+
+
+_cls_state: tuple = ()
+
+
+def _cls_init(shm_name, shape, dtype, pu, pr, cls_args):
+    global _cls_state
+    shm = shared_memory.SharedMemory(name=shm_name)
+    spec2d = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    # The shared memory object must stay alive as long as the array is used.
+    _cls_state = (shm, spec2d, pu, pr, cls_args)
+
+
+def _cls_worker(i):
+    shm, spec2d, pu, pr, cls_args = _cls_state
+    return _single_cls(spec2d[i], pu, pr, **cls_args)
+
+
+def _cls_parallel(spec2d, pu, pr, n_workers, cls_args) -> List[SingleCLSResult]:
+    """Runs `_single_cls` for all waiting times in a process pool, which
+    accesses spec2d via shared memory."""
+    shm = shared_memory.SharedMemory(create=True, size=spec2d.nbytes)
+    try:
+        shared = np.ndarray(spec2d.shape, dtype=spec2d.dtype, buffer=shm.buf)
+        shared[:] = spec2d
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_cls_init,
+                                 initargs=(shm.name, spec2d.shape, spec2d.dtype, pu, pr,
+                                           cls_args)) as ex:
+            chunksize = max(1, spec2d.shape[0] // (4*n_workers))
+            res = list(ex.map(_cls_worker, range(spec2d.shape[0]), chunksize=chunksize))
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return res
+
+
 @attr.s(auto_attribs=True)
 class TwoDim:
     """
@@ -186,9 +435,14 @@ class TwoDim:
     plot: 'TwoDimPlotter' = attr.Factory(TwoDimPlotter, True)  # typing: Ignore
     "Plot object offering plotting methods"
     interpolator_: Optional[RegularGridInterpolator] = None  # typing: Ignore
-    "Contains the interpolator for the 2d-spectra"
+    "Contains the interpolator for the 2d-spectra, see `get_interpolator`"
     exp_fit_result_: Optional[ExpFit2DResult] = None
     "Contains the result of the exponential fit"
+    _line_weights: Dict = attr.ib(factory=dict, init=False, repr=False, eq=False)
+    "Cache of the interpolation weights used by `line_profiles`"
+    _interpolator_src: Optional[np.ndarray] = attr.ib(default=None, init=False, repr=False,
+                                                      eq=False)
+    "The `spec2d` array the interpolator was built from"
 
     def _make_int(self):
         intp = RegularGridInterpolator((self.t, self.probe_wn, self.pump_wn),
@@ -196,6 +450,58 @@ class TwoDim:
                                        bounds_error=False)
         return intp
 
+    def get_interpolator(self) -> RegularGridInterpolator:
+        """
+        Returns a linear interpolator of the data over (t, probe, pump). It is
+        rebuild if `spec2d` or one of the axes was replaced since the last
+        call. Inplace changes of `spec2d` are seen by the interpolator, unless
+        scipy had to copy the values when building it.
+        """
+        intp = self.interpolator_
+        axes = (self.t, self.probe_wn, self.pump_wn)
+        if (intp is None or self._interpolator_src is not self.spec2d
+                or any(g.shape != a.shape or np.any(g != a) for g, a in zip(intp.grid, axes))):
+            self.interpolator_ = self._make_int()
+            self._interpolator_src = self.spec2d
+        return self.interpolator_
+
+    def line_profiles(self, probe: np.ndarray, pump: np.ndarray,
+                      t: Optional[float] = None) -> np.ndarray:
+        """
+        Bilinear interpolation of the spectra at the points (probe, pump),
+        e.g. along a diagonal. The interpolation weights only depend on the
+        points, they are calculated once and then applied to all waiting
+        times as one sparse matrix product.
+
+        Parameters
+        ----------
+        probe, pump : array (n)
+            Coordinates of the points.
+        t : float or None
+            If given, only the spectrum nearest to t is interpolated.
+
+        Returns
+        -------
+        array (n_t, n) or (n)
+            The interpolated values, nan outside of the data.
+        """
+        probe, pump = np.asarray(probe, dtype=float), np.asarray(pump, dtype=float)
+        key = hash((self.probe_wn.tobytes(), self.pump_wn.tobytes(), probe.tobytes(),
+                    pump.tobytes()))
+        if key not in self._line_weights:
+            if len(self._line_weights) > 32:
+                self._line_weights.clear()
+            self._line_weights[key] = _bilinear_weights(self.probe_wn, self.pump_wn, probe,
+                                                        pump)
+        W, valid = self._line_weights[key]
+        n = self.probe_wn.size * self.pump_wn.size
+        if t is None:
+            out = (W @ self.spec2d.reshape(-1, n).T).T
+        else:
+            out = W @ self.spec2d[self.t_idx(t)].reshape(n)
+        out[..., ~valid] = np.nan
+        return out
+
     def __attrs_post_init__(self):
         n, m, k = self.t.size, self.probe_wn.size, self.pump_wn.size
         if self.spec2d.shape != (n, m, k):
@@ -211,7 +517,7 @@ class TwoDim:
         self.pump_wn = self.pump_wn[i1]
         i2 = np.argsort(self.probe_wn)
         self.probe_wn = self.probe_wn[i2]
-        self.spec2d = self.spec2d[:, :, i1][:, i2, :]
+        self.spec2d = np.ascontiguousarray(self.spec2d[:, :, i1][:, i2, :])
 
     def copy(self) -> 'TwoDim':
         """
@@ -354,97 +660,37 @@ class TwoDim:
                         recentered_pump_wn
                         linear_fit
         """
-        pu = self.pump_wn
-        pr = self.probe_wn
-        spec = self.spec2d[self.t_idx(t), :, :].T
-        if mode == 'pos':
-            spec = -spec
-        pu_max = pu[np.argmin(np.min(spec, 1))]
-        if not isinstance(pu_range, tuple):
-            pu_idx = (pu < pu_max + pu_range) & (pu > pu_max - pu_range)
-        else:
-            pu_idx = inbetween(pu, pu_range[0], pu_range[1])
-        x = pu[pu_idx] - pu[pu_idx].mean()
-        spec = spec[pu_idx, :]
-        l = []
-        for s in spec:
-            m = np.argmin(s)
-            if not isinstance(pr_range, tuple):
-                pr_max = pr[m]
-                pr_idx = (pr < pr_max + pr_range) & (pr > pr_max - pr_range)
-            else:
-                pr_idx = inbetween(pr, pr_range[0], pr_range[1])
-            cen_of_m = np.average(pr[pr_idx], weights=s[pr_idx])
-            if method == 'fit':
-                mod = lmfit.models.GaussianModel()
-                mod.set_param_hint('center', min=pr[pr_idx].min(), max=pr[pr_idx].max())
-                amp = np.trapz(s[pr_idx], pr[pr_idx])
-                result = mod.fit(s[pr_idx],
-                                 sigma=3,
-                                 center=cen_of_m,
-                                 amplitude=amp,
-                                 x=pr[pr_idx])
-                val, err = (result.params['center'].value, result.params['center'].stderr)
-                if err is None:
-                    err = np.nan
-                l.append((val, err))
-            elif method == 'quad':
-                p: Polynomial = Polynomial.fit(pr[pr_idx], s[pr_idx], 2)  # type: ignore
-                l.append((p.deriv().roots()[0], 1))
-            elif method == 'log_quad':
-                s_min = s[m]
-                i2 = (s < s_min * 0.1)
-                p = Polynomial.fit(pr[pr_idx & i2], np.log(-s[pr_idx & i2]),
-                                   2)  # type: ignore
-                l.append((p.deriv().roots()[0], 1))
-            elif method == 'skew_fit':
-                mod = lmfit.models.GaussianModel() + lmfit.models.LinearModel()
-                amp = np.trapz(s[pr_idx], pr[pr_idx])
-                result = mod.fit(s[pr_idx],
-                                 sigma=3,
-                                 center=cen_of_m,
-                                 amplitude=amp,
-                                 x=pr[pr_idx],
-                                 slope=0,
-                                 intercept=0)
-                val, err = (result.params['center'].value, result.params['center'].stderr)
-                if err is None:
-                    err = np.nan
-                l.append((val, err))
-
-            else:
-                l.append((cen_of_m, 1))
-
-        y, yerr = np.array(l).T
-        all_err_valid = np.isfinite(yerr).all()
-        if all_err_valid:
-            r = WLS(y, add_constant(x), weights=1 / yerr**2).fit()
-        else:
-            r = OLS(y, add_constant(x)).fit()
-        
-        ret = SingleCLSResult(pump_wn=x + pu[pu_idx].mean(),
-                        max_pos=y,
-                        max_pos_err=yerr,
-                        slope=r.params[0],
-                        reg_result=r,
-                        recentered_pump_wn=x,
-                        linear_fit=r.predict())
-        
-        self.single_cls_result_ = ret
-
-        return ret
+        res = _single_cls(self.spec2d[self.t_idx(t)], self.pump_wn, self.probe_wn,
+                          pr_range, pu_range, mode, method)
+        self.single_cls_result_ = res
+        return res
 
-    def cls(self, **cls_args) -> CLSResult:
+    def cls(self, max_workers: Optional[int] = None, **cls_args) -> CLSResult:
         """Calculates the CLS for all 2d-spectra. The arguments are given
-        to the single cls function. Returns as `CLSResult`."""
+        to the single cls function. Returns as `CLSResult`.
+
+        Parameters
+        ----------
+        max_workers : int or None
+            Number of processes, defaults to the number of cores. If 1, the
+            spectra are analysed in the current process. The workers get
+            the data via shared memory and only receive the index of the
+            waiting time. The processes are spawned, so scripts using them
+            have to be guarded by ``if __name__ == '__main__'``.
+        **cls_args
+            Passed to `single_cls`.
+        """
         slopes, slope_errs = [], []
         lines = []
         intercept = []
         intercept_errs = []
-        import joblib
-        with joblib.Parallel(n_jobs=-1) as p:
-            res: List[SingleCLSResult] = p(
-                joblib.delayed(self.single_cls)(t, **cls_args) for t in self.t)
+        n_workers = max_workers or os.cpu_count() or 1
+        if n_workers == 1 or self.t.size < 2:
+            res = [_single_cls(s, self.pump_wn, self.probe_wn, **cls_args)
+                   for s in self.spec2d]
+        else:
+            res = _cls_parallel(self.spec2d, self.pump_wn, self.probe_wn, n_workers,
+                                cls_args)
         for c in res:
             r = c.reg_result
             slopes.append(r.params[1])
@@ -462,7 +708,7 @@ class TwoDim:
         return ret
 
     def diag_and_antidiag(self,
-                          t: float,
+                          t: Optional[float],
                           offset: Optional[float] = None,
                           p: Optional[float] = None) -> DiagResult:
         """
@@ -470,27 +716,27 @@ class TwoDim:
 
         Parameters
         ----------
-        t: float
+        t: float or None
             Waiting time of the 2d-spectra from which the data is extracted.
+            If None, the diagonals of all waiting times are extracted.
         offset: float
             Offset of the diagonal, if none, it will we determined by the going through the signal
-            minimum.
+            minimum. If `t` is None, the minimum of all spectra is used.
         p: float
             The point where the anti-diagonal crosses the diagonal. If none, it also goes through
             the signal minimum.
 
         Returns
         -------
-        CLSResult
-            Contains the diagonals, coordinates and points.
+        DiagResult
+            Contains the diagonals, coordinates and points. If `t` is None,
+            diag and antidiag have the shape (n_t, n_probe).
         """
-
-        spec_i = self.t_idx(t)
-
-        if self.interpolator_ is None:
-            self.interpolator_ = self._make_int()
-
-        d = self.spec2d[spec_i, ...].T
+        if t is None:
+            i = np.unravel_index(np.argmin(self.spec2d), self.spec2d.shape)[0]
+        else:
+            i = self.t_idx(t)
+        d = self.spec2d[i, ...].T
 
         if offset is None:
             offset = self.pump_wn[np.argmin(np.min(d, 1))] - self.probe_wn[np.argmin(
@@ -501,9 +747,8 @@ class TwoDim:
         y_diag = self.probe_wn + offset
         y_antidiag = -self.probe_wn + 2*p + offset
 
-        ts = self.t[spec_i] * np.ones_like(y_diag)
-        diag = self.interpolator_(np.column_stack((ts, self.probe_wn, y_diag)))
-        antidiag = self.interpolator_(np.column_stack((ts, self.probe_wn, y_antidiag)))
+        diag = self.line_profiles(self.probe_wn, y_diag, t)
+        antidiag = self.line_profiles(self.probe_wn, y_antidiag, t)
 
         res = DiagResult(
             diag=diag,
@@ -550,6 +795,70 @@ class TwoDim:
             filtered.spec2d = gaussian_filter(self.spec2d, size, mode='nearest')
         return filtered
 
+    def save_h5(self, fname: PathLike, compression: Optional[str] = None):
+        """
+        Saves the dataset in the native HDF5 format of skultrafast. The file
+        contains the axes, the 2d-spectra, the info dict and, if present, the
+        CLS result. The info is stored as JSON, values which are not
+        JSON-serializable are converted to strings. Fit results of lmfit are
+        not saved.
+
+        Parameters
+        ----------
+        fname: PathLike
+            Path to the file.
+        compression: str or None
+            h5py compression filter, e.g. 'gzip' or 'lzf'.
+        """
+        with h5py.File(fname, 'w') as f:
+            f.attrs['skultrafast_type'] = 'TwoDim'
+            f.attrs['info'] = json.dumps(self.info, default=str)
+            f['t'] = self.t
+            f['pump_wn'] = self.pump_wn
+            f['probe_wn'] = self.probe_wn
+            write_h5_rows(f, 'spec2d', self.spec2d, 1, compression)
+            cls = self.cls_result_
+            if cls is not None:
+                g = f.create_group('cls_result')
+                for name in ['wt', 'slopes', 'slope_errors', 'intercepts',
+                             'intercept_errors']:
+                    if getattr(cls, name) is not None:
+                        g[name] = getattr(cls, name)
+                lines = g.create_group('lines')
+                for i, line in enumerate(cls.lines):
+                    lines[str(i)] = line
+
+    @classmethod
+    def from_file(cls, fname: PathLike,
+                  t_range: Optional[Tuple[float, float]] = None) -> 'TwoDim':
+        """
+        Loads a dataset saved by `save_h5`.
+
+        Parameters
+        ----------
+        fname: PathLike
+            Path to the file.
+        t_range: (float, float) or None
+            If given, only the waiting times within the range are read from
+            the file. The CLS result is only loaded for the complete dataset.
+        """
+        with h5py.File(fname, 'r') as f:
+            if f.attrs.get('skultrafast_type', None) != 'TwoDim':
+                raise ValueError(f'{fname} does not contain a TwoDim')
+            rows = h5_rows_in_range(f['t'][()], t_range)
+            ds = cls(t=f['t'][rows], pump_wn=f['pump_wn'][()],
+                     probe_wn=f['probe_wn'][()],
+                     spec2d=h5_as_array(f['spec2d'], None, rows),
+                     info=json.loads(f.attrs['info']))
+            if 'cls_result' in f and t_range is None:
+                g = f['cls_result']
+                arrs = {k: g[k][()] if k in g else None
+                        for k in ['wt', 'slopes', 'slope_errors', 'intercepts',
+                                  'intercept_errors']}
+                lines = [g['lines'][str(i)][()] for i in range(len(g['lines']))]
+                ds.cls_result_ = CLSResult(lines=lines, **arrs)
+        return ds
+
     def save_txt(self, pname: PathLike, **kwargs):
         """
         Saves 2d-spectra as a text files a directory.
@@ -589,11 +898,17 @@ class TwoDim:
 
     def background_correction(self,
                               excluded_range: Tuple[float, float],
-                              deg: int = 3) -> None:
+                              deg: int = 3,
+                              weights: Optional[np.ndarray] = None) -> None:
         """
         Fits and subtracts a background for each pump-frequency. Done for each
         waiting time. Does the subtraction inplace, e.g. modifies the dataset.
 
+        All fits share the same probe points, hence without weights the
+        background is a fixed linear projection of the data outside the
+        excluded range, which is applied to all spectra with one matrix
+        product.
+
         Parameters
         ----------
         excluded_range: Tuple[float, float]
@@ -601,17 +916,31 @@ class TwoDim:
             contains the signal.
         deg: int
             Degree of the polynomial fit.
+        weights: array or None
+            Weights of the probe points, as in `np.polyfit`. Must be
+            broadcastable to the shape of `spec2d`, e.g. (probe_wn.size, 1)
+            for weights shared by all spectra or the full shape for
+            separate weights per spectrum.
         Returns
         -------
         None
         """
         wn_range = ~inbetween(self.probe_wn, excluded_range[0], excluded_range[1])
-        for ti in range(self.spec2d.shape[0]):
-            for pi in range(self.spec2d.shape[2]):
-                s = self.spec2d[ti, :, pi]
-                back = s[wn_range]
-                p = np.polyfit(self.probe_wn[wn_range], back, deg)
-                s -= np.polyval(p, self.probe_wn)
+        # Centering and scaling keeps the Vandermonde matrix well conditioned.
+        x = self.probe_wn - self.probe_wn[wn_range].mean()
+        x /= np.abs(x[wn_range]).max()
+        V = np.vander(x, deg + 1)
+        back = np.ascontiguousarray(self.spec2d[:, wn_range, :])
+        if weights is None:
+            proj = V @ np.linalg.pinv(V[wn_range])
+            self.spec2d -= np.matmul(proj, back)
+        else:
+            w2 = np.broadcast_to(weights, self.spec2d.shape)[:, wn_range, :]**2
+            Vb = V[wn_range]
+            A = np.einsum('bi,tbk,bj->tkij', Vb, w2, Vb)
+            rhs = np.einsum('bi,tbk->tki', Vb, w2 * back)
+            coef = np.linalg.solve(A, rhs[..., None])[..., 0]
+            self.spec2d -= np.einsum('pi,tki->tpk', V, coef)
 
     def get_minmax(self, t: float, com: int = 3) -> Dict[str, float]:
         """
@@ -690,39 +1019,120 @@ class TwoDim:
         resi = self.spec2d.reshape(nt, -1) - model
         return coef[0].reshape(taus.size, npu, npr), basis, resi, model, taus
 
-    def fit_das(self, taus, fix_last_decay=False) -> ExpFit2DResult:
+    def fit_das(self, taus, fix_last_decay=False, n_svd: Optional[int] = None,
+                w: Optional[float] = None, t0: float = 0.,
+                fix_irf: bool = False) -> ExpFit2DResult:
         """
         Fit the data to a sum of exponentials (DAS), starting from the given decay
         constants. The results are stored in the `fit_exp_result` attribute.
+
+        Uses variable projection: the amplitudes are eliminated by a QR
+        decomposition of the small (n_t, n_tau) basis and only the decay
+        times are optimized, using analytic derivatives. The data is
+        compressed once by its SVD, so the cost of an iteration does not
+        depend on the number of pixels.
+
+        Parameters
+        ----------
+        taus : list of float
+            Starting values of the decay times.
+        fix_last_decay : bool
+            If True, the last decay time is not optimized.
+        n_svd : int or None
+            Number of singular vectors of the data used in the fit. None
+            uses all of them, which gives the same result as fitting the
+            uncompressed data.
+        w, t0 : float
+            If `w` is given, the exponentials are convolved with a gaussian
+            IRF of width `w` (see `_fold_exp`) and time-zero `t0`, both are
+            fitted as well. Otherwise, plain exponentials starting at t=0
+            are used.
+        fix_irf : bool
+            If True, w and t0 are not optimized.
         """
+        taus = np.asarray(taus, dtype=float)
+        nt = self.t.size
+        Y = self.spec2d.reshape(nt, -1)
+        U, S, _ = np.linalg.svd(Y, full_matrices=False)
+        k = S.size if n_svd is None else min(n_svd, S.size)
+        Z = U[:, :k] * S[:k]
 
         params = lmfit.Parameters()
         for i, val in enumerate(taus):
             params.add(f'tau{i}', value=val, vary=True)
         if fix_last_decay:
             params['tau%d' % i].vary = False
-
-        def fcn(params, res_only=True):
-            tau_arr = np.array([params[f'tau{i}'].value for i in range(len(taus))])
-            fit_res = self.fit_taus(tau_arr)
-            if res_only:
-                return fit_res[2]
-            else:
-                return fit_res
-
-        mini = lmfit.Minimizer(fcn, params)
-        res = mini.minimize()
-        fit_res = fcn(res.params, res_only=False)
-        resi = fit_res[2].reshape(self.spec2d.shape)
-        model = fit_res[3].reshape(self.spec2d.shape)
+        if w is not None:
+            params.add('w', value=w, min=0, vary=not fix_irf)
+            params.add('t0', value=t0, vary=not fix_irf)
+        cache: dict = {}
+
+        def project(params):
+            p = tuple(params[name].value for name in params)
+            if cache.get('p') != p:
+                tau_arr = np.array(p[:taus.size])
+                irf = p[taus.size:] if w is not None else None
+                A, dA = _das_basis(self.t, tau_arr, irf)
+                Q, R = np.linalg.qr(A)
+                C = np.linalg.solve(R, Q.T @ Z)
+                r = Z - Q @ (Q.T @ Z)
+                cache.update(p=p, A=A, dA=dA, Q=Q, R=R, C=C, r=r)
+            return cache
+
+        def fcn(params):
+            return project(params)['r'].ravel()
+
+        def jac(params):
+            c = project(params)
+            Q, R, C, r = c['Q'], c['R'], c['C'], c['r']
+            R_inv_T = np.linalg.inv(R).T
+            cols = []
+            for name, dA in zip(params, c['dA']):
+                if not params[name].vary:
+                    continue
+                # Golub-Pereyra derivative of the projected residual.
+                dAC = dA @ C
+                term1 = dAC - Q @ (Q.T @ dAC)
+                term2 = Q @ (R_inv_T @ (dA.T @ r))
+                cols.append(-(term1 + term2).ravel())
+            return np.column_stack(cols)
+
+        # scipy's leastsq does not accept a Jacobian without columns.
+        has_vary = any(p.vary for p in params.values())
+        mini = lmfit.Minimizer(fcn, params, Dfun=jac if has_vary else None)
+        res = mini.minimize(method='leastsq')
+        c = project(res.params)
+        coef = np.linalg.solve(c['R'], c['Q'].T @ Y)
+        model = c['A'] @ coef
+        resi = Y - model
+
+        # The fit statistics refer to the compressed residuals, recalculate
+        # them for the full data, following the definitions in lmfit.
+        redchi = res.redchi
+        res.residual = resi.ravel()
+        res.ndata = resi.size
+        res.nfree = res.ndata - res.nvarys
+        res.chisqr = (resi**2).sum()
+        res.redchi = res.chisqr / max(1, res.nfree)
+        neg2_log_likel = res.ndata * np.log(res.chisqr / res.ndata)
+        res.aic = neg2_log_likel + 2 * res.nvarys
+        res.bic = neg2_log_likel + np.log(res.ndata) * res.nvarys
+        if res.covar is not None and redchi > 0:
+            fac = res.redchi / redchi
+            res.covar *= fac
+            for p in res.params.values():
+                if p.stderr is not None:
+                    p.stderr *= np.sqrt(fac)
         dsc = self.copy()
-        dsc.spec2d = model
+        dsc.spec2d = model.reshape(self.spec2d.shape)
+        fit_taus = np.array([res.params[f'tau{i}'].value for i in range(taus.size)])
         self.fit_exp_result_ = ExpFit2DResult(minimizer=res,
                                               model=dsc,
-                                              residuals=resi,
-                                              das=fit_res[0],
-                                              basis=fit_res[1],
-                                              taus=fit_res[4])
+                                              residuals=resi.reshape(self.spec2d.shape),
+                                              das=coef.reshape(taus.size,
+                                                               *self.spec2d.shape[1:]),
+                                              basis=c['A'],
+                                              taus=fit_taus)
         return self.fit_exp_result_
 
     def fit_gauss(self, mode='both') -> GaussResult:
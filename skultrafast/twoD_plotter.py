@@ -5,7 +5,6 @@ from typing import (TYPE_CHECKING, Any, Dict, List, Literal, Optional, Tuple,
 import attr
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
 from scipy.ndimage import uniform_filter1d
 
 from skultrafast import plot_helpers
@@ -213,29 +212,19 @@ class TwoDimPlotter:
         spec_i = ds.t_idx(t)
         fig, (ax, ax1) = plt.subplots(2, figsize=(3, 6), sharex='col')
 
-        d = ds.spec2d[spec_i].real.copy()[::, ::].T
-        interpol = RegularGridInterpolator(
-            (ds.pump_wn, ds.probe_wn,), d[::, ::], bounds_error=False)
+        d = ds.spec2d[spec_i].real.T
         m = abs(d).max()
         ax.pcolormesh(ds.probe_wn, ds.pump_wn, d, cmap='seismic', vmin=-m, vmax=m)
 
         ax.set(ylim=(ds.pump_wn.min(), ds.pump_wn.max()),
                xlim=(ds.probe_wn.min(), ds.probe_wn.max()))
         ax.set_aspect(1)
-        if offset is None:
-            offset = ds.pump_wn[np.argmin(np.min(d, 1))] - \
-                ds.probe_wn[np.argmin(np.min(d, 0))]
-        if p is None:
-            p = ds.probe_wn[np.argmin(np.min(d, 0))]
-        y_diag = ds.probe_wn + offset
-        y_antidiag = -ds.probe_wn + 2 * p + offset
-        ax.plot(ds.probe_wn, y_diag, lw=1)
-        ax.plot(ds.probe_wn, y_antidiag, lw=1)
-
-        diag = interpol(np.column_stack((y_diag, ds.probe_wn)))
-        antidiag = interpol(np.column_stack((y_antidiag, ds.probe_wn)))
-        ax1.plot(ds.probe_wn, diag)
-        ax1.plot(ds.probe_wn, antidiag)
+        res = ds.diag_and_antidiag(t, offset, p)
+        ax.plot(ds.probe_wn, res.diag_coords, lw=1)
+        ax.plot(ds.probe_wn, res.antidiag_coords, lw=1)
+
+        ax1.plot(ds.probe_wn, res.diag)
+        ax1.plot(ds.probe_wn, res.antidiag)
         return
 
     def psa(self, t: float, bg_correct: bool = True,
@@ -298,9 +287,16 @@ class TwoDimPlotter:
         if ax is None:
             ax = plt.gca()
         l = []
+        if offset is not None:
+            # Same line for all times, extract all of them at once.
+            diag_data = self.ds.diag_and_antidiag(None, offset)
         for ti in t:
-            diag_data = self.ds.diag_and_antidiag(ti, offset)
-            l += ax.plot(diag_data.diag_coords, diag_data.diag, label='%.1f ps' % ti)
+            if offset is None:
+                diag_data = self.ds.diag_and_antidiag(ti, offset)
+                diag = diag_data.diag
+            else:
+                diag = diag_data.diag[self.ds.t_idx(ti)]
+            l += ax.plot(diag_data.diag_coords, diag, label='%.1f ps' % ti)
         ax.set(xlabel=plot_helpers.freq_label, ylabel='Diagonal Amplitude [AU]')
         return l
 
@@ -335,10 +331,15 @@ class TwoDimPlotter:
         if ax is None:
             ax = plt.gca()
         l = []
+        if offset is not None and p is not None:
+            diag_data = self.ds.diag_and_antidiag(None, offset, p)
         for ti in t:
-            diag_data = self.ds.diag_and_antidiag(ti, offset, p)
-            l += ax.plot(diag_data.antidiag_coords,
-                         diag_data.antidiag, label='%.1f ps' % ti)
+            if offset is None or p is None:
+                diag_data = self.ds.diag_and_antidiag(ti, offset, p)
+                antidiag = diag_data.antidiag
+            else:
+                antidiag = diag_data.antidiag[self.ds.t_idx(ti)]
+            l += ax.plot(diag_data.antidiag_coords, antidiag, label='%.1f ps' % ti)
         ax.set(xlabel=plot_helpers.freq_label, ylabel='Anti-diagonal Amplitude [AU]')
         return l
 
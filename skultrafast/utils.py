@@ -3,10 +3,10 @@ from typing import Optional
 from attr import field, dataclass
 import numpy as np
 from scipy.special import erf
-from scipy.stats import median_abs_deviation
 from .unit_conversions import cm2THz
 
 import functools
+import numba
 import wrapt
 
 
@@ -21,6 +21,193 @@ def weighted_binning(x, arr, bins, weights=None):
     return binned_total / weights_total
 
 
+@dataclass
+class BinnedStats:
+    """
+    Statistics of data binned along its last axis, see `bin_along`. Empty bins
+    have a count of zero and nan as mean, variance and position.
+    """
+    mean: np.ndarray
+    """Weighted mean of each bin"""
+    var: np.ndarray
+    """Weighted variance of the values in each bin"""
+    count: np.ndarray
+    """Number of values in each bin"""
+    sum_weights: np.ndarray
+    """Sum of the weights in each bin"""
+    x: np.ndarray
+    """Mean position of the points in each bin"""
+
+    @property
+    def nonempty(self) -> np.ndarray:
+        """Boolean array which is True for bins containing points."""
+        return self.count > 0
+
+
+def bin_along(x, data, edges, weights=None) -> BinnedStats:
+    """
+    Bins data along its last axis. All bins are computed at once with
+    `np.add.reduceat`.
+
+    Parameters
+    ----------
+    x : array (n)
+        Position of the points, e.g. the wavelengths. Does not need to be
+        sorted.
+    data : array (..., n)
+        The data.
+    edges : array (m+1)
+        Increasing edges of the m bins. The bins include their left edge, the
+        last bin also includes its right edge. Points outside are ignored.
+    weights : array (n) or (..., n), optional
+        Weights of the points.
+
+    Returns
+    -------
+    BinnedStats
+        Mean, variance, count, sum of weights and mean position of each bin.
+    """
+    x = np.asarray(x)
+    edges = np.asarray(edges)
+    data = np.asarray(data, dtype=float)
+    if np.any(np.diff(edges) < 0):
+        raise ValueError('The edges must be increasing.')
+    n_bins = edges.size - 1
+    if weights is None:
+        weights = np.ones(x.size)
+    weights = np.broadcast_to(weights, data.shape)
+
+    # Sort the points inside the edges, so that each bin is a contiguous block.
+    inside = (x >= edges[0]) & (x <= edges[-1])
+    order = np.flatnonzero(inside)[np.argsort(x[inside], kind='stable')]
+    x, data, weights = x[order], data[..., order], weights[..., order]
+    bounds = np.searchsorted(x, edges, 'left')
+    bounds[-1] = x.size
+    count = np.diff(bounds)
+    nonempty = count > 0
+
+    def bin_sum(arr):
+        # reduceat sums up to the next given index, so only the starts of the
+        # non-empty bins are passed.
+        out = np.zeros(arr.shape[:-1] + (n_bins,))
+        if x.size > 0:
+            out[..., nonempty] = np.add.reduceat(arr, bounds[:-1][nonempty], axis=-1)
+        return out
+
+    sum_w = bin_sum(weights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = bin_sum(weights * data) / sum_w
+        dev = data - np.repeat(mean[..., nonempty], count[nonempty], axis=-1)
+        var = bin_sum(weights * dev**2) / sum_w
+        x_mean = bin_sum(x) / count
+    return BinnedStats(mean, var, count, sum_w, x_mean)
+
+
+@dataclass
+class SVDResult:
+    """
+    A (possibly truncated) singular value decomposition ``data = u @ diag(s) @
+    vt``, see `svd`.
+    """
+    u: np.ndarray
+    """Left singular vectors, shape (m, k)"""
+    s: np.ndarray
+    """Singular values in decreasing order, shape (k)"""
+    vt: np.ndarray
+    """Right singular vectors, shape (k, n)"""
+    method: str
+    """Method used to calculate the decomposition"""
+
+    @property
+    def rank(self) -> int:
+        """Number of computed components."""
+        return self.s.size
+
+    def truncate(self, n: int) -> 'SVDResult':
+        """Returns the first `n` components."""
+        if n > self.rank:
+            raise ValueError(f'Only {self.rank} components available, not {n}')
+        return SVDResult(self.u[:, :n], self.s[:n], self.vt[:n], self.method)
+
+    def reconstruct(self, n: Optional[int] = None) -> np.ndarray:
+        """Returns the data reconstructed from the first `n` components."""
+        r = self if n is None else self.truncate(n)
+        return (r.u * r.s) @ r.vt
+
+
+def svd(data, n: Optional[int] = None, method: str = 'full', n_oversamples: int = 10,
+        n_iter: int = 4, random_state=0) -> SVDResult:
+    """
+    Calculates the first `n` components of the SVD of a 2D array.
+
+    Parameters
+    ----------
+    data : array (m, k)
+        The data. The mask of masked arrays is ignored.
+    n : int or None
+        Number of components. If None, all components are calculated, which
+        requires `method='full'`.
+    method : 'full', 'randomized' or 'arpack'
+        'full' uses `np.linalg.svd` and truncates the result afterwards. It is
+        exact, but its cost does not depend on `n`. 'randomized' uses the
+        randomized range finder of Halko et al. with `n_iter` power
+        iterations and is much faster for large arrays and small `n`.
+        'arpack' uses `scipy.sparse.linalg.svds`.
+    n_oversamples : int
+        Additional random vectors used by the randomized method.
+    n_iter : int
+        Number of power iterations of the randomized method. Increase it if
+        the singular values decay slowly.
+    random_state : int or np.random.Generator
+        Seed of the randomized method.
+
+    Returns
+    -------
+    SVDResult
+    """
+    data = np.asarray(np.ma.getdata(data), dtype=float)
+    k = min(data.shape)
+    if n is None:
+        if method != 'full':
+            raise ValueError(f'Method {method} needs the number of components')
+        n = k
+    n = min(n, k)
+    if method == 'full' or (method == 'arpack' and n >= k - 1):
+        u, s, vt = np.linalg.svd(data, full_matrices=False)
+        u, s, vt = u[:, :n], s[:n], vt[:n]
+    elif method == 'randomized':
+        u, s, vt = _randomized_svd(data, n, n_oversamples, n_iter, random_state)
+    elif method == 'arpack':
+        from scipy.sparse.linalg import svds
+        u, s, vt = svds(data, k=n)
+        idx = np.argsort(s)[::-1]
+        u, s, vt = u[:, idx], s[idx], vt[idx]
+    else:
+        raise ValueError(f'Unknown svd method {method}')
+    return SVDResult(u, s, vt, method)
+
+
+def _randomized_svd(a, n, n_oversamples, n_iter, random_state):
+    rng = np.random.default_rng(random_state)
+    transpose = a.shape[0] < a.shape[1]
+    if transpose:
+        a = a.T
+    l = min(n + n_oversamples, min(a.shape))
+    q = a @ rng.standard_normal((a.shape[1], l))
+    q, _ = np.linalg.qr(q)
+    # Orthogonalize after each multiplication, otherwise the small singular
+    # values are lost in the power iterations.
+    for i in range(n_iter):
+        q, _ = np.linalg.qr(a.T @ q)
+        q, _ = np.linalg.qr(a @ q)
+    ub, s, vt = np.linalg.svd(q.T @ a, full_matrices=False)
+    u = (q @ ub)[:, :n]
+    s, vt = s[:n], vt[:n]
+    if transpose:
+        return vt.T, s, u.T
+    return u, s, vt
+
+
 def simulate_binning(wrapped=None, *, fac=5):
     """
     Simulates
@@ -57,30 +244,114 @@ def sigma_clip(data, sigma: float = 3, max_iter: int = 5, axis: int = -1, use_ma
     max_iter : int
         How many iterations are done. If a new iteration does not mask new
         values, the function will break the loop.
+    axis : int
+        The axis along which the outliers are determined.
+    use_mad : bool
+        If True, the median absolute deviation scaled to the standard deviation
+        of a normal distribution, 1.4826 MAD, is used instead of the std.
 
     Returns
     -------
     np.ma.MaskedArray
         Array with outliers being masked.
+
+    See Also
+    --------
+    sigma_clip_stats : Returns the statistics of the unmasked data directly.
     """
-    data = np.ma.masked_invalid(data)
-    num_masked = 0
-    for _ in range(max_iter):
-        median = np.ma.median(data, axis, keepdims=1)
-        if use_mad:
-            std = median_abs_deviation(data, axis=1)
-        else:
-            std = np.ma.std(data, axis, keepdims=1)
-
-        upper, lower = median + sigma*std, median - sigma*std
-        data = np.ma.masked_greater(data, upper, copy=False)
-        data = np.ma.masked_less(data, lower, copy=False)
-        n = data.mask.sum()
-        if n == num_masked:
-            break
-        else:
-            num_masked = n
-    return data
+    mask = sigma_clip_stats(data, sigma, max_iter, axis, use_mad)[3]
+    return np.ma.MaskedArray(data, mask=mask)
+
+
+def sigma_clip_stats(data, sigma: float = 3, max_iter: int = 5, axis: int = -1,
+                     use_mad: bool = False, ddof: int = 0):
+    """Like `sigma_clip`, but returns the statistics of the unmasked data
+    without creating masked arrays. The clipping is done by a compiled
+    kernel, parallel over the non-reduced axes.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The data array.
+    sigma, max_iter, axis, use_mad :
+        See `sigma_clip`.
+    ddof : int
+        Delta degrees of freedom of the returned standard deviation.
+
+    Returns
+    -------
+    mean, std, count : np.ndarray
+        Mean, standard deviation and number of the unmasked values along
+        `axis`. Nan, where all values are masked.
+    mask : np.ndarray
+        Boolean array with the shape of data, True for masked values.
+    """
+    if isinstance(data, np.ma.MaskedArray):
+        data = data.astype(float).filled(np.nan)
+    data = np.asarray(data)
+    moved = np.moveaxis(data, axis, -1)
+    rows = np.ascontiguousarray(moved.reshape(-1, moved.shape[-1]), dtype=np.float64)
+    mean, std, count, mask = _sigma_clip_rows(rows, sigma, max_iter, use_mad, ddof)
+    shape = moved.shape[:-1]
+    mask = np.moveaxis(mask.reshape(moved.shape), -1, axis)
+    return mean.reshape(shape), std.reshape(shape), count.reshape(shape), mask
+
+
+@numba.njit(parallel=True, cache=True)
+def _sigma_clip_rows(rows, sigma, max_iter, use_mad, ddof):
+    m, n = rows.shape
+    mean = np.full(m, np.nan)
+    std = np.full(m, np.nan)
+    count = np.zeros(m, np.int64)
+    mask = np.empty((m, n), np.bool_)
+    for i in numba.prange(m):
+        row = rows[i]
+        buf = np.empty(n)
+        k = 0
+        for j in range(n):
+            mask[i, j] = not np.isfinite(row[j])
+            if not mask[i, j]:
+                k += 1
+        for _ in range(max_iter):
+            if k == 0:
+                break
+            c = 0
+            for j in range(n):
+                if not mask[i, j]:
+                    buf[c] = row[j]
+                    c += 1
+            center = np.median(buf[:k])
+            if use_mad:
+                for j in range(k):
+                    buf[j] = abs(buf[j] - center)
+                scale = 1.4826 * np.median(buf[:k])
+            else:
+                scale = np.std(buf[:k])
+            k_new = 0
+            for j in range(n):
+                if not mask[i, j]:
+                    if abs(row[j] - center) > sigma * scale:
+                        mask[i, j] = True
+                    else:
+                        k_new += 1
+            if k_new == k:
+                break
+            k = k_new
+        count[i] = k
+        if k > 0:
+            s = 0.
+            for j in range(n):
+                if not mask[i, j]:
+                    s += row[j]
+            mu = s / k
+            s = 0.
+            for j in range(n):
+                if not mask[i, j]:
+                    s += (row[j] - mu)**2
+            mean[i] = mu
+            if k > ddof:
+                std[i] = np.sqrt(s / (k-ddof))
+    return mean, std, count, mask
 
 
 def gauss_step(x, amp: float, center: float, sigma: float):
@@ -287,9 +558,7 @@ def linreg_std_errors(A, y):
     vcv = A.T @ A
     epsvar = np.var(resi, axis=0, ddof=2)
     bvar = np.linalg.inv(vcv) * epsvar[:, None, None]
-    bstd = np.zeros_like(x[0])
-    for i in range(bstd.shape[1]):
-        bstd[:, i] = np.sqrt(np.diag(bvar[i]))
+    bstd = np.sqrt(np.ma.getdata(bvar).diagonal(axis1=1, axis2=2)).T
     return bstd, bvar, r2
 
 
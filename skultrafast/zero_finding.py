@@ -3,12 +3,14 @@
 Contains functions to find the time-zero and to interpolate the data.
 """
 
+import numba
 import numpy as np
 import skultrafast.dv as dv
 import scipy.ndimage as nd
 
 import matplotlib.pyplot as plt
 #from skultrafast.fitter import _coh_gaussian
+from scipy.interpolate import Akima1DInterpolator, CubicSpline
 from scipy.linalg import lstsq
 from scipy.optimize import least_squares
 
@@ -140,22 +142,157 @@ def robust_fit_tz(wl, tn, degree=3, t=1.345):
     return zeros, o.x[::-1]
 
 
-def interpol(tup, tn, shift=0., new_t=None):
+def interpol(tup, tn, shift=0., new_t=None, kind='linear'):
     """
-    Uses linear interpolation to shift each channcel by given tn.
+    Uses interpolation to shift each channcel by given tn, see
+    `shift_channels`.
     """
-    dat = tup.data
-    t = tup.t
     if new_t is None:
-        new_t = t
+        new_t = tup.t
+    dat_new, _ = shift_channels(tup.t, tup.data, tn, shift, new_t, kind=kind)
+    return dv.tup(tup.wl, new_t, dat_new)
 
-    #t_array = np.tile(t.reshape(t.size, 1), (1, dat.shape[1]))
-    t_array = t[:, None] - tn[None, :]
-    t_array -= shift
-    dat_new = np.zeros((new_t.size, dat.shape[1]))
-    for i in range(dat.shape[1]):
-        dat_new[:, i] = np.interp(new_t, t_array[:, i], dat[:, i], left=0)
-    return dv.tup(tup.wl, t, dat_new)
+
+def shift_channels(t, data, tn, shift=0., new_t=None, err=None, kind='linear'):
+    """
+    Shifts the time-axis of every channel by its time-zero and interpolates
+    the data onto a common time-axis. All channels are interpolated at once
+    by a parallel compiled kernel. Outside of the delay-times, the data and
+    the error are equal to their first or last value.
+
+    Parameters
+    ----------
+    t : array (n)
+        The strictly increasing delay-times.
+    data : array (n, m)
+        The data, one channel per column.
+    tn : array (m)
+        The time-zero of each channel.
+    shift : float
+        Additional shift of all channels.
+    new_t : array or None
+        The common time-axis. Defaults to t.
+    err : array (n, m) or None
+        Error of the data. It is propagated as for linear interpolation, also
+        for the other kinds.
+    kind : {'linear', 'cubic', 'akima'}
+        The kind of interpolation. 'cubic' uses not-a-knot cubic splines.
+
+    Returns
+    -------
+    data, err : array
+        The interpolated data and err, the latter is None if no err is given.
+    """
+    t = np.asarray(t, dtype=float)
+    data = np.asarray(data, dtype=float)
+    new_t = t if new_t is None else np.asarray(new_t, dtype=float)
+    shifts = np.asarray(tn, dtype=float) + shift
+    # The kernels search the intervals without bounds checks.
+    if not np.all(np.diff(t) > 0):
+        raise ValueError('The delay-times must be strictly increasing.')
+    data_new = np.empty((new_t.size, data.shape[1]))
+    if kind == 'linear':
+        _eval_shifted_linear(t, data, new_t, shifts, data_new)
+    else:
+        if kind == 'cubic':
+            coefs = CubicSpline(t, data, axis=0).c
+        elif kind == 'akima':
+            coefs = Akima1DInterpolator(t, data, axis=0).c
+        else:
+            raise ValueError(f'Unknown kind of interpolation: {kind}')
+        _eval_shifted_ppoly(t, np.ascontiguousarray(coefs), data[0], data[-1], new_t,
+                            shifts, data_new)
+    if err is None:
+        return data_new, None
+    err_new = np.empty_like(data_new)
+    _shifted_err(t, np.asarray(err, dtype=float), new_t, shifts, err_new)
+    return data_new, err_new
+
+
+# The kernels loop over the channels in the inner loop, so that memory is
+# accessed contiguously, and keep the interval of the last query of every
+# channel, which makes the search O(1) for increasing query times. The outer
+# parallel loop is over blocks of channels.
+_BLOCK = 64
+
+
+@numba.njit(inline='always')
+def _find_interval(x, q, k):
+    """Index k of the interval x[k] <= q < x[k+1], starting the search at k.
+    Requires x[0] <= q < x[-1]."""
+    while x[k + 1] <= q:
+        k += 1
+    while x[k] > q:
+        k -= 1
+    return k
+
+
+@numba.njit(parallel=True, cache=True)
+def _eval_shifted_linear(x, y, new_t, shifts, out):
+    """Linear interpolation of every channel at new_t shifted by the shift of
+    the channel."""
+    n_ch = out.shape[1]
+    for b in numba.prange((n_ch + _BLOCK - 1) // _BLOCK):
+        j0, j1 = b * _BLOCK, min(n_ch, (b+1) * _BLOCK)
+        ks = np.zeros(j1 - j0, np.int64)
+        for i in range(out.shape[0]):
+            for j in range(j0, j1):
+                q = new_t[i] + shifts[j]
+                if q <= x[0]:
+                    out[i, j] = y[0, j]
+                elif q >= x[-1]:
+                    out[i, j] = y[-1, j]
+                else:
+                    k = _find_interval(x, q, ks[j - j0])
+                    ks[j - j0] = k
+                    a = (q - x[k]) / (x[k + 1] - x[k])
+                    out[i, j] = y[k, j] + a * (y[k + 1, j] - y[k, j])
+
+
+@numba.njit(parallel=True, cache=True)
+def _eval_shifted_ppoly(x, c, first, last, new_t, shifts, out):
+    """Evaluates the piecewise polynomials c of every channel at new_t
+    shifted by the shift of the channel."""
+    n_ch = out.shape[1]
+    for b in numba.prange((n_ch + _BLOCK - 1) // _BLOCK):
+        j0, j1 = b * _BLOCK, min(n_ch, (b+1) * _BLOCK)
+        ks = np.zeros(j1 - j0, np.int64)
+        for i in range(out.shape[0]):
+            for j in range(j0, j1):
+                q = new_t[i] + shifts[j]
+                if q <= x[0]:
+                    out[i, j] = first[j]
+                elif q >= x[-1]:
+                    out[i, j] = last[j]
+                else:
+                    k = _find_interval(x, q, ks[j - j0])
+                    ks[j - j0] = k
+                    dx = q - x[k]
+                    v = c[0, k, j]
+                    for m in range(1, c.shape[0]):
+                        v = v*dx + c[m, k, j]
+                    out[i, j] = v
+
+
+@numba.njit(parallel=True, cache=True)
+def _shifted_err(x, err, new_t, shifts, out):
+    """Propagates the error of linear interpolation."""
+    n_ch = out.shape[1]
+    for b in numba.prange((n_ch + _BLOCK - 1) // _BLOCK):
+        j0, j1 = b * _BLOCK, min(n_ch, (b+1) * _BLOCK)
+        ks = np.zeros(j1 - j0, np.int64)
+        for i in range(out.shape[0]):
+            for j in range(j0, j1):
+                q = new_t[i] + shifts[j]
+                if q <= x[0]:
+                    out[i, j] = err[0, j]
+                elif q >= x[-1]:
+                    out[i, j] = err[-1, j]
+                else:
+                    k = _find_interval(x, q, ks[j - j0])
+                    ks[j - j0] = k
+                    a = (q - x[k]) / (x[k + 1] - x[k])
+                    out[i, j] = np.sqrt(((1-a) * err[k, j])**2 + (a * err[k + 1, j])**2)
 
 
 def get_tz_cor(tup, method=use_diff, deg=3, plot=False, **kwargs):